@@ -1,11 +1,28 @@
 import json
 import logging
-import datamodel
+from datetime import datetime
 from dataaccess.data_access import DataAccess
 from utility.product_processor import ProductProcessor
+from utility.product_file_reader import ProductFileReader
+from utility.bulk_operation_processor import BulkOperationProcessor
+from utility.bulk_operation_processor import is_bulk_operation_job
+from utility.job_context import JobContext
+from utility.metrics import Metrics
+from utility.profiler import start_profiler
+from utility.profiler import finish_profiler
 from datamodel.custom_enums import JobStatus
-from datamodel.custom_exceptions import ShopifyUnauthorizedError
-from datetime import datetime, timedelta
+
+
+# created on the first invocation and reused while the container stays warm
+_data_access = None
+
+
+def get_data_access():
+    global _data_access
+    if _data_access is None:
+        _data_access = DataAccess()
+    return _data_access
+
 
 def lambda_handler(event, context):
     """Sample pure Lambda function
@@ -23,64 +40,104 @@ def lambda_handler(event, context):
     API Gateway Lambda Proxy Output Format: dict
     """
 
-    data_access = DataAccess()
+    # the metrics of the invocation are written as one EMF log line per 100 values when it ends
+    metrics = Metrics()
+    # None unless profiling is enabled for the function
+    profiler = start_profiler()
+    try:
+        with metrics.timer('InvocationTime'):
+            process_message(event, context, metrics)
+    finally:
+        if profiler is not None:
+            profile_name = datetime.utcnow().strftime('%Y-%m-%dT%H-%M-%S') + '-' + str(getattr(context, 'aws_request_id', 'local'))
+            finish_profiler(profiler, profile_name, get_data_access(), metrics)
+        metrics.flush()
+    return None
+
+
+def process_message(event, context, metrics):
+    data_access = get_data_access()
     message_payload = json.loads(event['Records'][0]['Sns']['Message'])
-    job_id = message_payload['jobId']
-    user_id = message_payload['userId']
-    job = data_access.get_job(job_id, user_id)
-    user = data_access.get_user_by_id(user_id)
-    user_domain = user['domain']
-    user_token = user['access_token']
-    product_file_key = job['input_products']
-    product_file_content = data_access.get_product_file(product_file_key)
-    product_items = json.loads(product_file_content)
-    
+    with metrics.timer('JobContextLoadTime'):
+        job_context = JobContext(message_payload, data_access).load()
+    job_id = job_context.job_id
+    user_id = job_context.user_id
+    metrics.put_dimension('JobType', job_context.type)
+    metrics.put_property('JobId', job_id)
+    if job_context.shard is not None:
+        metrics.put_property('Shard', job_context.shard['index'])
+    product_file_key = job_context.input_products
+    # The prepared file's offset index is only loaded by the invocations that
+    # read the prepared file: the first one, a replay and a bulk operation.
+    # Later batches work through the sendable file.
+    product_reader = ProductFileReader(product_file_key, data_access)
+    if job_context.bulk_operation is None:
+        with metrics.timer('ProductFileLoadTime'):
+            job_context.bulk_operation = is_bulk_operation_job(job_context.type, product_reader.count)
+
     processor_info = {
-        'products': product_items,
+        'product_reader': product_reader,
         'user_id': user_id,
         'job_id': job_id,
-        'batch': int(job.get('current_batch')),
-        'domain': user_domain,
-        'access_token': user_token,
-        'type': job.get('type')
+        'start_index': job_context.start_index,
+        'start_time': job_context.start_time,
+        'domain': job_context.domain,
+        'access_token': job_context.access_token,
+        'type': job_context.type,
+        'shard': job_context.shard,
+        'file_key': product_file_key,
+        'context': context,
+        'data_access': data_access,
+        'metrics': metrics
     }
     
     try:
-        processor = ProductProcessor(processor_info)
+        if job_context.bulk_operation:
+            processor = BulkOperationProcessor(processor_info)
+        else:
+            processor = ProductProcessor(processor_info)
         is_completed = processor.process()
     except Exception as error:
         logging.exception('An exception interrupted the job processing. JobId: %s, Error Details: %s', job_id, str(error))
-        data_access.finish_job_transaction({
-            'id': job_id,
-            'user_id': user_id,
-            'status': JobStatus.FAILED.name,
-            'duration': get_job_duration(job_id, user_id, data_access)
-        })
+        finish_job(data_access, job_context, JobStatus.FAILED.name)
     else:
         if is_completed: 
-            exceeded_limit = job['product_limit_exceeded']
+            exceeded_limit = job_context.product_limit_exceeded
             status = JobStatus.COMPLETED.name
             if exceeded_limit: status = JobStatus.PARTIAL_COMPLETE.name
 
-            print(get_job_duration(job_id, user_id, data_access))
-            data_access.finish_job_transaction({
-                'id': job_id,
-                'user_id': user_id,
-                'status': status,
-                'duration': get_job_duration(job_id, user_id, data_access)
-            })
+            finish_job(data_access, job_context, status)
+        elif processor.shards is not None:
+            logging.info('Split job into shards. JobId: %s, Shards: %s', job_id, len(processor.shards))
+            for shard in processor.shards:
+                data_access.publish_to_product_processor(job_context.get_message(shard['start'], shard))
         else:
-            next_batch = int(job.get('current_batch')) + 1,
-            data_access.basic_job_update({
-                'id': job_id,
-                'user_id': user_id,
-                'current_batch': next_batch
-            })
-            data_access.publish_to_product_processor({
-                'jobId': job_id,
-                'userId': user_id
-            })
-    return None
+            if job_context.shard is None:
+                # the shards of a sharded job only keep their cursors in the messages
+                data_access.update_job_cursor({
+                    'id': job_id,
+                    'user_id': user_id
+                }, processor.next_index)
+            data_access.publish_to_product_processor(job_context.get_message(processor.next_index))
+
+
+def finish_job(data_access, job_context, status):
+    job = {
+        'id': job_context.job_id,
+        'user_id': job_context.user_id
+    }
+    # A sharded job is finished by the worker of its last shard, with the
+    # failed status if any of the shards failed
+    if job_context.shard is not None:
+        shards = data_access.finish_job_shard(job, job_context.shard['index'], status == JobStatus.FAILED.name)
+        if shards is None or shards['remaining_shards'] > 0:
+            return
+        if shards['failed']:
+            status = JobStatus.FAILED.name
+
+    job['status'] = status
+    job['duration'] = convert_seconds_to_duration(job_context.get_duration_seconds())
+    data_access.finish_job_transaction(job)
 
 
 def convert_seconds_to_duration(seconds):
@@ -101,12 +158,3 @@ def convert_seconds_to_duration(seconds):
         duration += str(s) + ' sec'
     return duration
 
-
-def get_job_duration(job_id, user_id, data_access):
-    job = data_access.get_job(job_id, user_id)
-    start_time = datetime.strptime(job['start_time'], '%Y-%m-%dT%H:%M:%S.%fZ')
-    end_time = datetime.utcnow()
-    duration = round((end_time - start_time).total_seconds())
-    return convert_seconds_to_duration(duration)
-
-
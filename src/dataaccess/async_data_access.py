@@ -0,0 +1,92 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncDataAccess:
+    """
+    Class for awaiting DataAccess calls from a coroutine. The blocking boto3
+    calls run on a bounded thread pool so database writes overlap with the
+    shopify requests running on the event loop.
+
+    """
+
+    def __init__(self, data_access, max_workers=None):
+        if max_workers is None:
+            max_workers = int(os.environ.get('data_access_workers', 10))
+        self._data_access = data_access
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='data-access')
+
+
+    async def batch_put_results(self, results):
+        return await self.__run(self._data_access.batch_put_results, results)
+
+
+    async def get_result_statuses(self, job_id, result_ids):
+        return await self.__run(self._data_access.get_result_statuses, job_id, result_ids)
+
+
+    async def get_result_data_by_id(self, job_id, result_ids):
+        return await self.__run(self._data_access.get_result_data_by_id, job_id, result_ids)
+
+
+    async def get_failed_result_ids(self, job_id):
+        return await self.__run(self._data_access.get_failed_result_ids, job_id)
+
+
+    async def replace_results(self, job, results):
+        return await self.__run(self._data_access.replace_results, job, results)
+
+
+    async def add_result_counts(self, job, success_count, failed_count, chunk_id):
+        return await self.__run(self._data_access.add_result_counts, job, success_count, failed_count, chunk_id)
+
+
+    async def basic_job_update(self, job):
+        return await self.__run(self._data_access.basic_job_update, job)
+
+
+    async def get_collection_cache(self, job_id):
+        return await self.__run(self._data_access.get_collection_cache, job_id)
+
+
+    async def put_collection_cache(self, job_id, collections):
+        return await self.__run(self._data_access.put_collection_cache, job_id, collections)
+
+
+    async def get_bulk_operation(self, job):
+        return await self.__run(self._data_access.get_bulk_operation, job)
+
+
+    async def put_bulk_operation(self, job, bulk_operation):
+        return await self.__run(self._data_access.put_bulk_operation, job, bulk_operation)
+
+
+    async def get_product_file(self, file_key):
+        return await self.__run(self._data_access.get_product_file, file_key)
+
+
+    async def put_product_file(self, file_key, content, content_type='application/json'):
+        return await self.__run(self._data_access.put_product_file, file_key, content, content_type)
+
+
+    async def put_product_file_index(self, file_key, index):
+        return await self.__run(self._data_access.put_product_file_index, file_key, index)
+
+
+    async def get_product_index(self, file_key):
+        return await self.__run(self._data_access.get_product_index, file_key)
+
+
+    async def put_product_index(self, file_key, index):
+        return await self.__run(self._data_access.put_product_index, file_key, index)
+
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+    async def __run(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(method, *args))
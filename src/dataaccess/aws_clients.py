@@ -0,0 +1,49 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+
+# Clients are created on first use and shared by every DataAccess in the
+# lambda container, so warm invocations reuse them along with their pooled
+# keep-alive connections
+_clients = {}
+_resources = {}
+_lock = threading.Lock()
+
+
+def get_config():
+    config = {
+        'max_pool_connections': int(os.environ.get('data_access_workers', 10)),
+        'retries': {
+            'mode': 'adaptive',
+            'max_attempts': int(os.environ.get('aws_max_attempts', 10))
+        }
+    }
+    # tcp keep-alive is only supported by newer botocore versions
+    if 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+        config['tcp_keepalive'] = True
+    return Config(**config)
+
+
+def get_client(service_name):
+    client = _clients.get(service_name)
+    if client is None:
+        # boto3's default session is not safe to create clients from several threads
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = boto3.client(service_name, config=get_config())
+                _clients[service_name] = client
+    return client
+
+
+def get_resource(service_name):
+    resource = _resources.get(service_name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(service_name)
+            if resource is None:
+                resource = boto3.resource(service_name, config=get_config())
+                _resources[service_name] = resource
+    return resource
@@ -1,18 +1,47 @@
 import logging
-import boto3
 import json
-import requests
-import asyncio
+import aiohttp
 from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key
+from dataaccess import aws_clients
+from dataaccess.shopify_queries import QUERIES
+from dataaccess.shopify_queries import PRODUCT_INDEX_PAGE_SIZE
+from dataaccess.shopify_queries import get_product_create_prefix
+from dataaccess.shopify_queries import get_product_update_prefix
 from datamodel.custom_exceptions import DataAccessError
 from datamodel.custom_exceptions import ShopifyUnauthorizedError
 from datamodel import data_model_utils
 from custom_utils import utils
 import os
+import threading
+import time
 from http import HTTPStatus
 
 
+PRODUCT_FILE_INDEX_SUFFIX = '.index.json'
+PRODUCT_INDEX_SUFFIX = '.handles.json'
+BATCH_WRITE_LIMIT = 25
+BATCH_WRITE_MAX_ATTEMPTS = 8
+BATCH_WRITE_BASE_BACKOFF = 0.05
+BATCH_WRITE_MAX_BACKOFF = 2
+BATCH_GET_LIMIT = 100
+TRANSACT_WRITE_LIMIT = 25
+RESULT_CLAIM_STATUS = 'PENDING'
+RETRYABLE_STATUSES = (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.BAD_GATEWAY, HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.GATEWAY_TIMEOUT)
+
+
+class ShopifyRetryableError(DataAccessError):
+    """
+    Error for shopify responses that did not come from the graphql api. A 429
+    was rejected before the request ran, a gateway error may come after it
+    ran, so only requests that change nothing can be sent again blindly.
+    """
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
 class DataAccess:
     """ 
     Class for getting data and adding data to database and other sources
@@ -21,13 +50,21 @@ class DataAccess:
 
     def __init__(self):
         self._prepared_products_bucket = os.environ.get('prepared_products_bucket')
-        self._s3_client = boto3.client('s3')
-        self._dynamo_client = boto3.client('dynamodb')
+        self._s3_client = aws_clients.get_client('s3')
+        # the client is shared by the AsyncDataAccess worker threads
+        self._dynamo_client = aws_clients.get_client('dynamodb')
         bulk_manager_table = os.environ.get('bulk_manager_table')
-        self._dynamodb = boto3.resource('dynamodb')
+        self._dynamodb = aws_clients.get_resource('dynamodb')
         self._bulk_manager_table =  self._dynamodb.Table(bulk_manager_table) 
-        self._sns_client = boto3.client('sns')
+        self._sns_client = aws_clients.get_client('sns')
         self._api_version = os.environ.get('shopify_api_version')
+        # tests point the shopify calls at a local mock server over http
+        self._shopify_scheme = os.environ.get('shopify_scheme', 'https')
+        # the graphql url and headers of every shop, built once per token
+        self._shopify_endpoints = {}
+        # transactions on the same job item conflict with each other, so the
+        # worker threads write them one at a time
+        self._job_transaction_lock = threading.Lock()
 
 
     def get_job(self, job_id, user_id):
@@ -58,6 +95,96 @@ class DataAccess:
             raise DataAccessError(error)
 
 
+    def put_product_file(self, file_key, content, content_type='application/json'):
+        try:
+            self._s3_client.put_object (
+                Bucket=self._prepared_products_bucket,
+                Key=file_key,
+                Body=content,
+                ContentType=content_type
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def put_profile(self, key, content, content_type='text/plain'):
+        try:
+            self._s3_client.put_object (
+                Bucket=os.environ.get('profile_bucket') or self._prepared_products_bucket,
+                Key=key,
+                Body=content,
+                ContentType=content_type
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def get_product_file_range(self, file_key, start_byte, end_byte):
+        try:
+            response = self._s3_client.get_object (
+                Bucket=self._prepared_products_bucket,
+                Key=file_key,
+                Range='bytes=' + str(start_byte) + '-' + str(end_byte)
+            )
+            return response['Body'].read()
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def get_product_file_index(self, file_key):
+        try:
+            response = self._s3_client.get_object (
+                Bucket=self._prepared_products_bucket,
+                Key=file_key + PRODUCT_FILE_INDEX_SUFFIX
+            )
+            return json.loads(response['Body'].read())
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise DataAccessError(error)
+
+
+    def put_product_file_index(self, file_key, index):
+        try:
+            self._s3_client.put_object (
+                Bucket=self._prepared_products_bucket,
+                Key=file_key + PRODUCT_FILE_INDEX_SUFFIX,
+                Body=json.dumps(index, separators=(',', ':')),
+                ContentType='application/json'
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def get_product_index(self, file_key):
+        try:
+            response = self._s3_client.get_object (
+                Bucket=self._prepared_products_bucket,
+                Key=file_key + PRODUCT_INDEX_SUFFIX
+            )
+            return json.loads(response['Body'].read())
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise DataAccessError(error)
+
+
+    def put_product_index(self, file_key, index):
+        try:
+            self._s3_client.put_object (
+                Bucket=self._prepared_products_bucket,
+                Key=file_key + PRODUCT_INDEX_SUFFIX,
+                Body=json.dumps(index, separators=(',', ':')),
+                ContentType='application/json'
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
     def get_user_by_id(self, user_id):
         user_to_get = {'id': user_id}
         db_user = data_model_utils.convert_to_db_user(user_to_get)
@@ -72,6 +199,43 @@ class DataAccess:
         except ClientError as error:
             raise DataAccessError(error)
 
+
+    def get_job_and_user(self, job_id, user_id):
+        # Reads the job and its user with one BatchGetItem instead of two GetItem calls
+        table_name = os.environ.get('bulk_manager_table')
+        db_job = data_model_utils.convert_to_db_job({'id': job_id, 'user_id': user_id})
+        db_user = data_model_utils.convert_to_db_user({'id': user_id})
+
+        try:
+            request_items = {
+                table_name: {'Keys': [{'PK': db_job['PK'], 'SK': db_job['SK']}, {'PK': db_user['PK'], 'SK': db_user['SK']}]}
+            }
+            items = []
+            attempt = 0
+            while request_items:
+                if attempt > 0:
+                    time.sleep(min(BATCH_WRITE_MAX_BACKOFF, BATCH_WRITE_BASE_BACKOFF * (2 ** attempt)))
+                response = self._dynamodb.batch_get_item(RequestItems=request_items)
+                items.extend(response['Responses'].get(table_name, []))
+                request_items = response.get('UnprocessedKeys')
+                attempt += 1
+                if request_items and attempt >= BATCH_WRITE_MAX_ATTEMPTS:
+                    raise DataAccessError('Could not read the job and user after ' + str(attempt) + ' attempts')
+
+            job = None
+            user = None
+            for item in items:
+                if item['PK'] == db_job['PK']:
+                    job = data_model_utils.extract_job_details(item)
+                else:
+                    user = data_model_utils.extract_user_details(item)
+            if job is None:
+                raise DataAccessError('Job was not found. JobId: ' + job_id)
+            return job, user
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
     def basic_job_update (self, job):
         if 'id' not in job or 'user_id' not in job:
             raise KeyError('\'id\' and \'user_id\' value for job cannot be null')
@@ -104,6 +268,24 @@ class DataAccess:
             raise DataAccessError(error)
 
 
+    def update_job_cursor(self, job, next_index):
+        try:
+            self._dynamo_client.update_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Key={
+                    'PK': { 'S': utils.join_str('job#', job['id']) },
+                    'SK': { 'S': utils.join_str('user#', job['user_id']) },
+                },
+                UpdateExpression='SET current_index = :next_index',
+                ExpressionAttributeValues={
+                    ':next_index': { 'N': str(next_index) }
+                }
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
     def put_result(self, result):
         db_result= data_model_utils.convert_to_db_result(result)
 
@@ -127,17 +309,7 @@ class DataAccess:
         else:
             update_expression = 'SET total_failed = if_not_exists(total_failed, :start) + :incr'
         try:
-            result_item = {
-                'PK': { 'S': utils.join_str('result#', result['id']) },
-                'SK': { 'S': utils.join_str('job#', result['job_id']) },
-                'data': { 'S': result['data'] },
-                'status': { 'S': result['status'] }
-            }
-            if 'errors' in result:
-                result_item['errors'] = { 'S': result['errors'] }
-            if 'warnings' in result:
-                result_item['warnings'] = { 'S': result['warnings'] }
-            
+            result_item = self.__get_result_item(result)
             response = self._dynamo_client.transact_write_items(
                 TransactItems=[
                     {
@@ -170,6 +342,398 @@ class DataAccess:
             raise DataAccessError(error)
 
 
+    def batch_put_results(self, results):
+        table_name = os.environ.get('bulk_manager_table')
+        # BatchWriteItem rejects duplicate keys in one request, the last result for an id wins
+        result_items = list({result['id']: self.__get_result_item(result) for result in results}.values())
+
+        try:
+            for i in range(0, len(result_items), BATCH_WRITE_LIMIT):
+                request_items = {
+                    table_name: [{'PutRequest': {'Item': item}} for item in result_items[i: i + BATCH_WRITE_LIMIT]]
+                }
+                attempt = 0
+                while request_items:
+                    if attempt > 0:
+                        time.sleep(min(BATCH_WRITE_MAX_BACKOFF, BATCH_WRITE_BASE_BACKOFF * (2 ** attempt)))
+                    response = self._dynamo_client.batch_write_item(RequestItems=request_items)
+                    request_items = response.get('UnprocessedItems')
+                    attempt += 1
+                    if request_items and attempt >= BATCH_WRITE_MAX_ATTEMPTS:
+                        raise DataAccessError('Could not write all results after ' + str(attempt) + ' attempts')
+            logging.info('Batch put results completed successfully. Count: %s', len(result_items))
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def get_result_statuses(self, job_id, result_ids):
+        # Returns the status of every result id that already has a result item
+        items = self.__get_result_items(job_id, result_ids, 'PK, #status_db_key', {'#status_db_key': 'status'})
+        return {item['PK']['S'][len('result#'):]: item['status']['S'] for item in items}
+
+
+    def get_result_data_by_id(self, job_id, result_ids):
+        # Returns the data attribute of every result id that has a result item,
+        # a string, or bytes when the data is compressed
+        items = self.__get_result_items(job_id, result_ids, 'PK, #data_db_key', {'#data_db_key': 'data'})
+        return {item['PK']['S'][len('result#'):]: item['data'].get('S', item['data'].get('B')) for item in items if 'data' in item}
+
+
+    def __get_result_items(self, job_id, result_ids, projection, attribute_names):
+        table_name = os.environ.get('bulk_manager_table')
+        keys = [{
+            'PK': { 'S': utils.join_str('result#', str(result_id)) },
+            'SK': { 'S': utils.join_str('job#', job_id) }
+        } for result_id in result_ids]
+
+        try:
+            items = []
+            for i in range(0, len(keys), BATCH_GET_LIMIT):
+                request_items = {
+                    table_name: {
+                        'Keys': keys[i: i + BATCH_GET_LIMIT],
+                        'ProjectionExpression': projection,
+                        'ExpressionAttributeNames': attribute_names,
+                        'ConsistentRead': True
+                    }
+                }
+                attempt = 0
+                while request_items:
+                    if attempt > 0:
+                        time.sleep(min(BATCH_WRITE_MAX_BACKOFF, BATCH_WRITE_BASE_BACKOFF * (2 ** attempt)))
+                    response = self._dynamo_client.batch_get_item(RequestItems=request_items)
+                    items.extend(response['Responses'].get(table_name, []))
+                    request_items = response.get('UnprocessedKeys')
+                    attempt += 1
+                    if request_items and attempt >= BATCH_WRITE_MAX_ATTEMPTS:
+                        raise DataAccessError('Could not read all results after ' + str(attempt) + ' attempts')
+            return items
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def get_failed_result_ids(self, job_id):
+        # Result items are keyed by result id first, so the failed results of
+        # a job are found through the index keyed by job and status
+        try:
+            result_ids = []
+            query = {
+                'TableName': os.environ.get('bulk_manager_table'),
+                'IndexName': os.environ.get('result_status_index', 'SK-status-index'),
+                'KeyConditionExpression': 'SK = :job_id AND #status_db_key = :failed',
+                'ProjectionExpression': 'PK',
+                'ExpressionAttributeNames': {'#status_db_key': 'status'},
+                'ExpressionAttributeValues': {
+                    ':job_id': { 'S': utils.join_str('job#', job_id) },
+                    ':failed': { 'S': 'FAILED' }
+                }
+            }
+            while True:
+                response = self._dynamo_client.query(**query)
+                result_ids.extend(int(item['PK']['S'][len('result#'):]) for item in response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            return sorted(result_ids)
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def replace_results(self, job, results):
+        # Overwrites the results of a replayed job in place. Every result that
+        # turns from failed into success moves one product from total_failed
+        # to total_success in the same transaction, and results that already
+        # are a success are left alone, so a retried write never counts twice.
+        # Returns the number of results written.
+        table_name = os.environ.get('bulk_manager_table')
+        written = 0
+        try:
+            for i in range(0, len(results), TRANSACT_WRITE_LIMIT - 1):
+                pending = results[i: i + TRANSACT_WRITE_LIMIT - 1]
+                while len(pending) > 0:
+                    transact_items = [{
+                        'Put': {
+                            'TableName': table_name,
+                            'Item': self.__get_result_item(result),
+                            'ConditionExpression': 'attribute_not_exists(PK) OR #status_db_key <> :success',
+                            'ExpressionAttributeNames': {'#status_db_key': 'status'},
+                            'ExpressionAttributeValues': {':success': { 'S': 'SUCCESS' }}
+                        }
+                    } for result in pending]
+                    success_count = len([result for result in pending if result['status'] == 'SUCCESS'])
+                    if success_count > 0:
+                        transact_items.append({
+                            'Update': {
+                                'TableName': table_name,
+                                'Key': {
+                                    'PK': { 'S': utils.join_str('job#', job['id']) },
+                                    'SK': { 'S': utils.join_str('user#', job['user_id']) },
+                                },
+                                'UpdateExpression': 'ADD total_success :success, total_failed :failed',
+                                'ExpressionAttributeValues': {
+                                    ':success': { 'N': str(success_count) },
+                                    ':failed': { 'N': str(-success_count) }
+                                }
+                            }
+                        })
+                    try:
+                        self.__transact_job_write(transact_items)
+                        written += len(pending)
+                        break
+                    except ClientError as error:
+                        if error.response['Error']['Code'] != 'TransactionCanceledException':
+                            raise
+                        # the results that were already written by an earlier attempt are dropped
+                        reasons = error.response.get('CancellationReasons') or []
+                        conflicts = {index for index, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed'}
+                        if len(conflicts) == 0:
+                            raise
+                        pending = [result for index, result in enumerate(pending) if index not in conflicts]
+            logging.info('Replaced results. JobId: %s, Count: %s, Written: %s', job['id'], len(results), written)
+            return written
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def add_result_counts(self, job, success_count, failed_count, chunk_id):
+        # A chunk item is put with the increment, in one transaction, so that
+        # a retried chunk whose results were already counted does not
+        # increment the totals again. The markers are items of their own so
+        # the job item, and every counter write to it, stays the same size.
+        table_name = os.environ.get('bulk_manager_table')
+        transact_items = [
+            {
+                'Put': {
+                    'TableName': table_name,
+                    'Item': {
+                        'PK': { 'S': utils.join_str('job#', job['id']) },
+                        'SK': { 'S': utils.join_str('chunk#', chunk_id) },
+                    },
+                    'ConditionExpression': 'attribute_not_exists(PK)'
+                }
+            },
+            {
+                'Update': {
+                    'TableName': table_name,
+                    'Key': {
+                        'PK': { 'S': utils.join_str('job#', job['id']) },
+                        'SK': { 'S': utils.join_str('user#', job['user_id']) },
+                    },
+                    'UpdateExpression': 'ADD total_success :success, total_failed :failed',
+                    'ExpressionAttributeValues': {
+                        ':success': { 'N': str(success_count) },
+                        ':failed': { 'N': str(failed_count) }
+                    }
+                }
+            }
+        ]
+        try:
+            self.__transact_job_write(transact_items)
+            logging.info('Added result counts. JobId: %s, Chunk: %s, Success: %s, Failed: %s', job['id'], chunk_id, success_count, failed_count)
+            return True
+        except ClientError as error:
+            reasons = error.response.get('CancellationReasons') or []
+            if error.response['Error']['Code'] == 'TransactionCanceledException' and len(reasons) > 0 and reasons[0].get('Code') == 'ConditionalCheckFailed':
+                logging.info('Result counts already added. JobId: %s, Chunk: %s', job['id'], chunk_id)
+                return False
+            raise DataAccessError(error)
+
+
+    def __transact_job_write(self, transact_items):
+        # Writes a transaction that updates the job item. Other invocations
+        # of a sharded job write to the same item, so a transaction that is
+        # cancelled by a conflict with theirs is sent again after a backoff.
+        attempt = 0
+        while True:
+            try:
+                with self._job_transaction_lock:
+                    return self._dynamo_client.transact_write_items(TransactItems=transact_items)
+            except ClientError as error:
+                reasons = error.response.get('CancellationReasons') or []
+                conflicted = any(reason.get('Code') == 'TransactionConflict' for reason in reasons)
+                if error.response['Error']['Code'] != 'TransactionCanceledException' or not conflicted:
+                    raise
+                attempt += 1
+                if attempt >= BATCH_WRITE_MAX_ATTEMPTS:
+                    raise
+                time.sleep(min(BATCH_WRITE_MAX_BACKOFF, BATCH_WRITE_BASE_BACKOFF * (2 ** attempt)))
+
+
+    def get_collection_cache(self, job_id):
+        try:
+            response = self._dynamo_client.get_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Key={
+                    'PK': { 'S': utils.join_str('job#', job_id) },
+                    'SK': { 'S': 'collections' },
+                }
+            )
+            if 'Item' in response and int(response['Item']['ttl']['N']) > time.time():
+                return {key: value['S'] for key, value in response['Item']['collections']['M'].items()}
+            return {}
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def put_collection_cache(self, job_id, collections):
+        try:
+            self._dynamo_client.put_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Item={
+                    'PK': { 'S': utils.join_str('job#', job_id) },
+                    'SK': { 'S': 'collections' },
+                    'collections': { 'M': {key: { 'S': value } for key, value in collections.items()} },
+                    'ttl': { 'N': str(int(time.time()) + int(os.environ.get('collection_cache_ttl', 86400))) }
+                }
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def get_bulk_operation(self, job):
+        try:
+            response = self._dynamo_client.get_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Key={
+                    'PK': { 'S': utils.join_str('job#', job['id']) },
+                    'SK': { 'S': 'bulk_operation' },
+                },
+                ConsistentRead=True
+            )
+            if 'Item' in response:
+                return {key: value['S'] for key, value in response['Item'].items() if key not in ('PK', 'SK')}
+            return None
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def put_bulk_operation(self, job, bulk_operation):
+        item = {
+            'PK': { 'S': utils.join_str('job#', job['id']) },
+            'SK': { 'S': 'bulk_operation' },
+        }
+        for key, value in bulk_operation.items():
+            item[key] = { 'S': value }
+        try:
+            self._dynamo_client.put_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Item=item
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def put_job_shards(self, job, shard_count):
+        try:
+            self._dynamo_client.put_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Item={
+                    'PK': { 'S': utils.join_str('job#', job['id']) },
+                    'SK': { 'S': 'shards' },
+                    'shard_count': { 'N': str(shard_count) },
+                    'remaining_shards': { 'N': str(shard_count) }
+                }
+            )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def finish_job_shard(self, job, shard_index, failed=False):
+        # Returns the shards item after the shard is counted as finished, or
+        # None when the shard had already been counted by an earlier delivery
+        update_expression = 'ADD remaining_shards :decr, finished_shards :shards'
+        expression_attr_values = {
+            ':decr': { 'N': '-1' },
+            ':shards': { 'NS': [str(shard_index)] },
+            ':shard': { 'N': str(shard_index) }
+        }
+        if failed:
+            update_expression += ' SET failed = :failed'
+            expression_attr_values[':failed'] = { 'BOOL': True }
+        try:
+            response = self._dynamo_client.update_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Key={
+                    'PK': { 'S': utils.join_str('job#', job['id']) },
+                    'SK': { 'S': 'shards' },
+                },
+                UpdateExpression=update_expression,
+                ConditionExpression='attribute_exists(PK) AND (attribute_not_exists(finished_shards) OR NOT contains(finished_shards, :shard))',
+                ExpressionAttributeValues=expression_attr_values,
+                ReturnValues='ALL_NEW'
+            )
+            attributes = response['Attributes']
+            return {
+                'remaining_shards': int(attributes['remaining_shards']['N']),
+                'failed': attributes.get('failed', { 'BOOL': False })['BOOL']
+            }
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logging.info('Shard already finished. JobId: %s, Shard: %s', job['id'], shard_index)
+                return None
+            raise DataAccessError(error)
+
+
+    def get_rate_budget(self, domain):
+        # The shop's budget shared by the jobs importing into it, see
+        # utility.rate_budget for how it is leased
+        try:
+            response = self._dynamo_client.get_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Key={
+                    'PK': { 'S': utils.join_str('shop#', domain) },
+                    'SK': { 'S': 'rate_budget' },
+                },
+                ConsistentRead=True
+            )
+        except ClientError as error:
+            raise DataAccessError(error)
+        if 'Item' not in response:
+            return None
+        item = response['Item']
+        return {
+            'tokens': float(item['tokens']['N']),
+            'updated_at': float(item['updated_at']['N']),
+            'jobs': json.loads(item['jobs']['S']) if 'jobs' in item else {}
+        }
+
+
+    def put_rate_budget(self, domain, state, updated_at):
+        # The write is conditional on the state that was read, which had no
+        # item when updated_at is None. Returns False when another worker
+        # changed the budget in between.
+        expression_attr_values = {
+            ':tokens': { 'N': repr(state['tokens']) },
+            ':now': { 'N': repr(state['updated_at']) },
+            ':jobs': { 'S': json.dumps(state['jobs']) }
+        }
+        if updated_at is None:
+            condition_expression = 'attribute_not_exists(PK)'
+        else:
+            condition_expression = 'updated_at = :updated_at'
+            expression_attr_values[':updated_at'] = { 'N': repr(updated_at) }
+        try:
+            self._dynamo_client.update_item(
+                TableName=os.environ.get('bulk_manager_table'),
+                Key={
+                    'PK': { 'S': utils.join_str('shop#', domain) },
+                    'SK': { 'S': 'rate_budget' },
+                },
+                UpdateExpression='SET tokens = :tokens, updated_at = :now, jobs = :jobs',
+                ConditionExpression=condition_expression,
+                ExpressionAttributeValues=expression_attr_values
+            )
+            return True
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise DataAccessError(error)
+
+
     def finish_job_transaction(self, job):
         try:
             response = self._dynamo_client.transact_write_items(
@@ -234,83 +798,139 @@ class DataAccess:
             raise Exception('Could not publish message successfully. Error:' + str(error))
 
 
-    async def create_shopify_product(self, product_item, domain, access_token, session):
-        url = 'https://' + domain + '/admin/api/' + self._api_version + '/graphql.json'
-        headers = {'Content-Type': 'application/json', 'X-Shopify-Access-Token': access_token}
+    async def create_shopify_products(self, product_items, domain, access_token, session):
+        # the products are already encoded JSON and are spliced into the body
+        # as they are instead of being parsed and serialized again
+        body = self.__get_product_mutation_body(get_product_create_prefix(len(product_items)), product_items)
+        return await self.__post_graphql_body(body, domain, access_token, session, 'Product create')
 
-        query =  """mutation productCreate($input: ProductInput!) {
-                    productCreate(input: $input) {
-                        product {
-                            id
-                            title
-                            createdAt
-                            featuredImage {
-                                originalSrc
-                            }
-                        }
-                        userErrors {
-                            field
-                            message
-                        }
-                    }
-                }"""
-        variables = {'input': product_item}
-        response = None
-        response = await session.post(url, json={'query': query, 'variables': variables}, headers=headers)
-        if response.status == HTTPStatus.OK:
-            result = await response.json()
-            return result
-        elif response.status == HTTPStatus.UNAUTHORIZED:
-            raise ShopifyUnauthorizedError("Shopify graphql request did not have the necessary credentials")
-        else:
-            raise DataAccessError('Product create request failed. Status Code: ' + str(response.status))
+
+    async def update_shopify_products(self, product_items, domain, access_token, session):
+        # the encoded products carry the id of the product they update
+        body = self.__get_product_mutation_body(get_product_update_prefix(len(product_items)), product_items)
+        return await self.__post_graphql_body(body, domain, access_token, session, 'Product update')
+
+
+    async def create_shopify_variants(self, variant_input, domain, access_token, session):
+        product_id, variants = variant_input
+        variables = {'productId': product_id, 'variants': variants}
+        return await self.__post_query('productVariantsBulkCreate', variables, domain, access_token, session, 'Variants create')
+
+
+    async def get_product_handles(self, cursor, domain, access_token, session):
+        variables = {'first': int(os.environ.get('product_index_page_size', PRODUCT_INDEX_PAGE_SIZE)), 'after': cursor}
+        return await self.__post_query('products', variables, domain, access_token, session, 'Product handles')
 
 
     async def search_collection_by_name(self, collection_name, domain, access_token, session):
-        url = 'https://' + domain + '/admin/api/' + self._api_version + '/graphql.json'
-        headers = {'Content-Type': 'application/json', 'X-Shopify-Access-Token': access_token}
-
-        query =  """query ($title: String){
-                    collections(first:2, query:$title) {
-                        edges {
-                            node {
-                                id
-                                title
-                            }
-                        }
-                    }
-                }"""
-        title = 'title:' + collection_name
-        variables = {'title': title}
-        response = None
-        response = session.post(url, json={'query': query, 'variables': variables}, headers=headers)
-        if response.status == HTTPStatus.OK:
-            result = await response.json()
-            return result
-        elif response.status == HTTPStatus.UNAUTHORIZED:
-            raise ShopifyUnauthorizedError("Shopify graphql request did not have the necessary credentials")
-        else:
-            raise DataAccessError('Product create request failed. Status Code: ' + str(response.status))
-            
+        variables = {'title': 'title:' + collection_name}
+        return await self.__post_query('collections', variables, domain, access_token, session, 'Collection search')
 
-    async def get_collection_by_id(self, gid, domain, access_token, session):
-        url = 'https://' + domain + '/admin/api/' + self._api_version + '/graphql.json'
-        headers = {'Content-Type': 'application/json', 'X-Shopify-Access-Token': access_token}
 
-        query = """query ($id: ID!) {
-                    collection(id: $id) {
-                        title
-                        id
-                    }
-                }"""
+    async def get_collection_by_id(self, gid, domain, access_token, session):
         variables = {'id': gid}
-
-        response = None
-        response = session.post(url, json={'query': query, 'variables': variables}, headers=headers)
-        if response.status == HTTPStatus.OK:
-            result = await response.json()
-            return result
-        elif response.status == HTTPStatus.UNAUTHORIZED:
-            raise ShopifyUnauthorizedError("Shopify graphql request did not have the necessary credentials")
+        return await self.__post_query('collection', variables, domain, access_token, session, 'Collection get')
+
+
+    def __get_product_mutation_body(self, prefix, product_items):
+        body = [prefix]
+        for i, product_item in enumerate(product_items):
+            body.append(('"input' + str(i) + '":' if i == 0 else ',"input' + str(i) + '":').encode('utf-8'))
+            body.append(product_item)
+        body.append(b'}}')
+        return b''.join(body)
+
+
+    def __get_result_item(self, result):
+        result_item = {
+            'PK': { 'S': utils.join_str('result#', result['id']) },
+            'SK': { 'S': utils.join_str('job#', result['job_id']) },
+            'status': { 'S': result['status'] }
+        }
+        # compressed result data is stored as binary
+        if isinstance(result['data'], bytes):
+            result_item['data'] = { 'B': result['data'] }
         else:
-            raise DataAccessError('Product create request failed. Status Code: ' + str(response.status))
+            result_item['data'] = { 'S': result['data'] }
+        if 'errors' in result:
+            result_item['errors'] = { 'S': result['errors'] }
+        if 'warnings' in result:
+            result_item['warnings'] = { 'S': result['warnings'] }
+        return result_item
+
+
+    async def create_staged_upload(self, filename, domain, access_token, session):
+        variables = {'input': [{
+            'resource': 'BULK_MUTATION_VARIABLES',
+            'filename': filename,
+            'mimeType': 'text/jsonl',
+            'httpMethod': 'POST'
+        }]}
+        return await self.__post_query('stagedUploadsCreate', variables, domain, access_token, session, 'Staged upload create')
+
+
+    async def upload_staged_file(self, staged_target, filename, content, session):
+        form = aiohttp.FormData()
+        for parameter in staged_target['parameters']:
+            form.add_field(parameter['name'], parameter['value'])
+        form.add_field('file', content, filename=filename, content_type='text/jsonl')
+
+        async with session.post(staged_target['url'], data=form) as response:
+            if response.status not in (HTTPStatus.OK, HTTPStatus.CREATED, HTTPStatus.NO_CONTENT):
+                raise DataAccessError('Staged upload failed. Status Code: ' + str(response.status))
+            return True
+
+
+    async def run_bulk_mutation(self, mutation, staged_upload_path, domain, access_token, session):
+        variables = {'mutation': mutation, 'stagedUploadPath': staged_upload_path}
+        return await self.__post_query('bulkOperationRunMutation', variables, domain, access_token, session, 'Bulk operation run')
+
+
+    async def get_current_bulk_operation(self, operation_type, domain, access_token, session):
+        variables = {'type': operation_type}
+        return await self.__post_query('currentBulkOperation', variables, domain, access_token, session, 'Current bulk operation')
+
+
+    async def get_bulk_operation_status(self, bulk_operation_id, domain, access_token, session):
+        variables = {'id': bulk_operation_id}
+        return await self.__post_query('bulkOperation', variables, domain, access_token, session, 'Bulk operation status')
+
+
+    async def get_bulk_operation_results(self, url, session):
+        async with session.get(url) as response:
+            if response.status == HTTPStatus.OK:
+                return await response.read()
+            else:
+                raise DataAccessError('Bulk operation results request failed. Status Code: ' + str(response.status))
+
+
+    async def __post_query(self, name, variables, domain, access_token, session, description):
+        body = QUERIES[name].encode(variables)
+        return await self.__post_graphql_body(body, domain, access_token, session, description)
+
+
+    async def __post_graphql_body(self, body, domain, access_token, session, description):
+        url, headers = self.__get_shopify_endpoint(domain, access_token)
+        # the connection goes back to the session's pool on every branch
+        async with session.post(url, data=body, headers=headers) as response:
+            if response.status == HTTPStatus.OK:
+                result = await response.json()
+                return result
+            elif response.status == HTTPStatus.UNAUTHORIZED:
+                raise ShopifyUnauthorizedError("Shopify graphql request did not have the necessary credentials")
+            elif response.status in RETRYABLE_STATUSES:
+                retry_after = response.headers.get('Retry-After')
+                raise ShopifyRetryableError(description + ' request failed. Status Code: ' + str(response.status), response.status,
+                    float(retry_after) if retry_after is not None and retry_after.replace('.', '', 1).isdigit() else None)
+            else:
+                raise DataAccessError(description + ' request failed. Status Code: ' + str(response.status))
+
+
+    def __get_shopify_endpoint(self, domain, access_token):
+        endpoint = self._shopify_endpoints.get((domain, access_token))
+        if endpoint is None:
+            url = self._shopify_scheme + '://' + domain + '/admin/api/' + self._api_version + '/graphql.json'
+            headers = {'Content-Type': 'application/json', 'X-Shopify-Access-Token': access_token}
+            endpoint = (url, headers)
+            self._shopify_endpoints[(domain, access_token)] = endpoint
+        return endpoint
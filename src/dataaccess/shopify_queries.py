@@ -0,0 +1,165 @@
+import functools
+import json
+
+
+# Shopify's requested query cost: a mutation costs 10, an object 1 and a
+# connection 2 plus the cost of the nodes it asks for, scalars are free
+MUTATION_COST = 10
+OBJECT_COST = 1
+CONNECTION_COST = 2
+DEFAULT_REQUEST_COST = 15
+PRODUCT_INDEX_PAGE_SIZE = 250
+PRODUCT_CREATE_ALIAS_PREFIX = 'p'
+PRODUCT_UPDATE_ALIAS_PREFIX = 'u'
+# only the id of a created product is stored with its result
+PRODUCT_MUTATION_SELECTION = 'product { id } userErrors { field message }'
+BULK_OPERATION_MUTATION = 'mutation call($input: ProductInput!) { productCreate(input: $input) { ' + PRODUCT_MUTATION_SELECTION + ' } }'
+# the mutations that change the shop, stagedUploadsCreate only reserves an upload target
+MUTATIONS = frozenset(('productCreate', 'productUpdate', 'productVariantsBulkCreate', 'bulkOperationRunMutation'))
+
+
+def get_connection_cost(first, node_cost=OBJECT_COST):
+    return CONNECTION_COST + first * node_cost
+
+
+class ShopifyQuery:
+    """
+    Class for a graphql request whose query is compacted and encoded once, so
+    a request body only needs its variables encoded. The requested cost is
+    what shopify reserves from the bucket for one unit of the operation,
+    e.g. one aliased productCreate field, before the request runs.
+    """
+
+    def __init__(self, name, query, requested_cost):
+        self.name = name
+        self.query = ' '.join(query.split())
+        self.requested_cost = requested_cost
+        self._prefix = ('{"query":' + json.dumps(self.query) + ',"variables":').encode('utf-8')
+
+
+    def encode(self, variables):
+        return self._prefix + json.dumps(variables, separators=(',', ':')).encode('utf-8') + b'}'
+
+
+QUERIES = {query.name: query for query in (
+    ShopifyQuery('collections', """query ($title: String) {
+        collections(first: 1, query: $title) {
+            edges {
+                node {
+                    id
+                }
+            }
+        }
+    }""", get_connection_cost(1)),
+    ShopifyQuery('collection', """query ($id: ID!) {
+        collection(id: $id) {
+            id
+        }
+    }""", OBJECT_COST),
+    ShopifyQuery('products', """query ($first: Int!, $after: String) {
+        products(first: $first, after: $after) {
+            edges {
+                cursor
+                node {
+                    id
+                    handle
+                }
+            }
+            pageInfo {
+                hasNextPage
+            }
+        }
+    }""", get_connection_cost(PRODUCT_INDEX_PAGE_SIZE)),
+    ShopifyQuery('stagedUploadsCreate', """mutation stagedUploadsCreate($input: [StagedUploadInput!]!) {
+        stagedUploadsCreate(input: $input) {
+            stagedTargets {
+                url
+                parameters {
+                    name
+                    value
+                }
+            }
+            userErrors {
+                field
+                message
+            }
+        }
+    }""", MUTATION_COST),
+    ShopifyQuery('productVariantsBulkCreate', """mutation productVariantsBulkCreate($productId: ID!, $variants: [ProductVariantsBulkInput!]!) {
+        productVariantsBulkCreate(productId: $productId, variants: $variants) {
+            userErrors {
+                field
+                message
+            }
+        }
+    }""", MUTATION_COST),
+    ShopifyQuery('bulkOperationRunMutation', """mutation bulkOperationRunMutation($mutation: String!, $stagedUploadPath: String!) {
+        bulkOperationRunMutation(mutation: $mutation, stagedUploadPath: $stagedUploadPath) {
+            bulkOperation {
+                id
+            }
+            userErrors {
+                field
+                message
+            }
+        }
+    }""", MUTATION_COST),
+    ShopifyQuery('currentBulkOperation', """query ($type: BulkOperationType) {
+        currentBulkOperation(type: $type) {
+            id
+            status
+            createdAt
+        }
+    }""", OBJECT_COST),
+    ShopifyQuery('bulkOperation', """query ($id: ID!) {
+        node(id: $id) {
+            ... on BulkOperation {
+                status
+                errorCode
+                objectCount
+                url
+                partialDataUrl
+            }
+        }
+    }""", OBJECT_COST),
+)}
+
+
+# the product mutations are aliased into templates, see get_product_mutation_prefix
+REQUESTED_COSTS = dict({name: query.requested_cost for name, query in QUERIES.items()}, productCreate=MUTATION_COST, productUpdate=MUTATION_COST)
+
+
+def is_mutation(operation):
+    return operation in MUTATIONS
+
+
+def get_requested_cost(operation, units=1):
+    """Returns the requested cost of units of an operation, DEFAULT_REQUEST_COST per unit for unknown ones."""
+    return REQUESTED_COSTS.get(operation, DEFAULT_REQUEST_COST) * units
+
+
+@functools.lru_cache(maxsize=None)
+def get_product_create_prefix(count):
+    """
+    Returns the encoded start of a request body that creates count products,
+    up to where the first product's input goes. Every product gets its own
+    aliased productCreate field (p0, p1, ...) so several products are
+    created with one request.
+    """
+    return get_product_mutation_prefix('productCreate', PRODUCT_CREATE_ALIAS_PREFIX, count)
+
+
+@functools.lru_cache(maxsize=None)
+def get_product_update_prefix(count):
+    """Same as get_product_create_prefix for aliased productUpdate fields (u0, u1, ...)."""
+    return get_product_mutation_prefix('productUpdate', PRODUCT_UPDATE_ALIAS_PREFIX, count)
+
+
+def get_product_mutation_prefix(mutation, alias_prefix, count):
+    variable_definitions = []
+    mutations = []
+    for i in range(count):
+        variable_definitions.append('$input' + str(i) + ': ProductInput!')
+        mutations.append(alias_prefix + str(i) + ': ' + mutation + '(input: $input' + str(i) + ') { ' + PRODUCT_MUTATION_SELECTION + ' }')
+    query = 'mutation ' + mutation + '(' + ', '.join(variable_definitions) + ') { ' + ' '.join(mutations) + ' }'
+    return ('{"query":' + json.dumps(query) + ',"variables":{').encode('utf-8')
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import math
+import os
+from datetime import datetime
+from datetime import timedelta
+from datamodel.custom_exceptions import MissingArgumentError
+from datamodel.custom_exceptions import DataAccessError
+from datamodel.custom_enums import JobStatus
+from datamodel.custom_enums import ResultStatus
+from dataaccess.data_access import DataAccess
+from dataaccess.data_access import ShopifyRetryableError
+from dataaccess.async_data_access import AsyncDataAccess
+from dataaccess.shopify_queries import BULK_OPERATION_MUTATION
+from utility.result_sink import ResultSink
+from utility.collection_resolver import CollectionResolver
+from utility.product_validator import validate_product
+from utility.sendable_products import PRODUCT_CREATE_VARIANTS
+from utility.product_results import check_product_result
+from utility.product_results import get_product_result
+from utility.product_index import is_indexed_job
+from utility.job_replay import is_replay_job
+from utility.product_results import get_shopify_user_errors
+from utility.shopify_requests import send_shopify_request
+from utility.metrics import Metrics
+from utility import shopify_connection
+
+
+BULK_OPERATION_JOB_TYPE = 'BULK_OPERATION'
+BULK_OPERATION_FILE_SUFFIX = '.bulk.jsonl'
+BULK_OPERATION_LINES_SUFFIX = '.bulk-lines.json'
+FINISHED_STATUSES = ('COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED')
+RESULT_WINDOW_SIZE = 50
+# how far the lambda's clock may run ahead of shopify's when an operation is adopted
+BULK_OPERATION_CLOCK_SKEW = 60
+SPLIT_PRODUCT_ERROR = 'A bulk operation only runs productCreate, so a product with more than {} variants cannot be created by it. Import the product with a regular job.'
+
+
+def is_bulk_operation_job(job_type, product_count):
+    threshold = int(os.environ.get('bulk_operation_threshold', 0))
+    # jobs that look up existing products only create the ones that are
+    # missing, and a replay only sends the products that failed
+    if is_indexed_job(job_type) or is_replay_job(job_type):
+        return False
+    return job_type == BULK_OPERATION_JOB_TYPE or (threshold > 0 and product_count >= threshold)
+
+
+class BulkOperationProcessor:
+    """
+    Class to create the products of a job on shopify with a bulk operation.
+
+    The first invocation validates every product, uploads the sendable ones as
+    a JSONL file and starts a bulkOperationRunMutation. A pending marker is
+    written before the operation is started, so an invocation that finds the
+    marker without an operation id adopts the shop's current operation, when
+    it was created after the marker, instead of starting a second one. Invocations then poll
+    the operation until it finishes, handing over to the next invocation when
+    the lambda runs low on time, and the last one turns the operation's result
+    file into product results.
+    """
+
+    def __init__(self, product_info):
+        if product_info is not None:
+            self._product_reader = product_info.get('product_reader')
+            self._user_id = product_info.get('user_id')
+            self._job_id = product_info.get('job_id')
+            self._job_type = product_info.get('type')
+            self._file_key = product_info.get('file_key')
+            self._domain = product_info.get('domain')
+            self._access_token = product_info.get('access_token')
+            self._context = product_info.get('context')
+            self._metrics = product_info.get('metrics') or Metrics()
+            self._start_time = product_info.get('start_time') or datetime.utcnow().isoformat() + 'Z'
+            self._next_index = product_info.get('start_index', 0)
+            self._data_access = product_info.get('data_access') or DataAccess()
+            self._async_data_access = AsyncDataAccess(self._data_access)
+            self._collection_resolver = CollectionResolver(self._job_id, self._data_access, self._async_data_access, self.__send_shopify_request)
+            self._job = {
+                'id': self._job_id,
+                'user_id': self._user_id
+            }
+        else:
+            raise MissingArgumentError('Missing argument for BulkOperationProcessor class')
+
+
+    def process(self):
+        try:
+            return shopify_connection.run(self.__process())
+        finally:
+            self._async_data_access.shutdown()
+
+
+    @property
+    def next_index(self):
+        # the operation works on the whole file so there is no cursor to move
+        return self._next_index
+
+
+    @property
+    def shards(self):
+        # the operation runs on shopify as a whole so the job is never sharded
+        return None
+
+
+    async def __process(self):
+        self._scheduler = shopify_connection.get_scheduler(self._domain)
+        session = await shopify_connection.get_session(self._domain)
+
+        bulk_operation = await self._async_data_access.get_bulk_operation(self._job)
+        if bulk_operation is not None and 'id' not in bulk_operation:
+            bulk_operation = await self.__adopt_bulk_operation(bulk_operation, session)
+        if bulk_operation is None:
+            bulk_operation = await self.__start_bulk_operation(session)
+            if bulk_operation is None:
+                return True
+            if 'id' not in bulk_operation:
+                # shopify did not answer whether the operation started
+                return False
+
+        operation = await self.__wait_for_bulk_operation(bulk_operation, session)
+        if operation is None:
+            # still running, the next invocation carries on polling
+            return False
+
+        await self.__put_bulk_operation_results(bulk_operation, operation, session)
+        return True
+
+
+    async def __start_bulk_operation(self, session):
+        await self._async_data_access.basic_job_update({
+            'id': self._job_id,
+            'user_id': self._user_id,
+            'status': JobStatus.RUNNING.name,
+            'start_time': self._start_time,
+            'type': self._job_type
+        })
+
+        products = self._product_reader.read(0, self._product_reader.count - 1)
+        result_sink = ResultSink(self._async_data_access, self._job, 1, len(products), RESULT_WINDOW_SIZE, 'invalid-', self._metrics)
+        sendable_items = []
+        for index, product in enumerate(products):
+            errors, warnings = validate_product(product)
+            # the variants of a split product are added by a second mutation
+            create_variants = int(os.environ.get('product_create_variants', PRODUCT_CREATE_VARIANTS))
+            if len(product['variants']) > create_variants:
+                errors.append(SPLIT_PRODUCT_ERROR.format(create_variants))
+            if len(errors) > 0:
+                result_sink.add(get_product_result(self._job_id, product, ResultStatus.FAILED.name, errors, warnings, index + 1, self._file_key))
+            else:
+                sendable_items.append((product, index + 1, warnings))
+
+        self._collection_resolver.prepare([product for product, _, _ in sendable_items], session)
+        try:
+            for product, _, warnings in sendable_items:
+                if 'collectionsToJoin' in product:
+                    await self._collection_resolver.apply(product, warnings)
+        finally:
+            await self._collection_resolver.close()
+        await result_sink.close()
+
+        if len(sendable_items) == 0:
+            return None
+
+        filename = os.path.basename(self._file_key) + BULK_OPERATION_FILE_SUFFIX
+        content = '\n'.join([json.dumps({'input': product}) for product, _, _ in sendable_items]).encode('utf-8')
+        response = await self.__send_shopify_request('stagedUploadsCreate', self._data_access.create_staged_upload, filename, session)
+        staged_upload = response['data']['stagedUploadsCreate']
+        if len(staged_upload['userErrors']) > 0:
+            raise DataAccessError('Staged upload create failed. Details: ' + str(get_shopify_user_errors(staged_upload['userErrors'])))
+        staged_target = staged_upload['stagedTargets'][0]
+        await self._data_access.upload_staged_file(staged_target, filename, content, session)
+
+        staged_upload_path = [parameter['value'] for parameter in staged_target['parameters'] if parameter['name'] == 'key'][0]
+        # the result file refers to products by their line in the uploaded file
+        lines_key = self._file_key + BULK_OPERATION_LINES_SUFFIX
+        lines = [{'id': result_id, 'warnings': warnings} for _, result_id, warnings in sendable_items]
+        await self._async_data_access.put_product_file(lines_key, json.dumps(lines))
+        pending_operation = {
+            'lines_key': lines_key,
+            'requested_at': (datetime.utcnow() - timedelta(seconds=BULK_OPERATION_CLOCK_SKEW)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+        await self._async_data_access.put_bulk_operation(self._job, pending_operation)
+
+        try:
+            response = await self._data_access.run_bulk_mutation(BULK_OPERATION_MUTATION, staged_upload_path, self._domain, self._access_token, session)
+        except ShopifyRetryableError as error:
+            # the operation may have started, the next invocation adopts it or starts it again
+            logging.warning('Bulk operation run was not answered. JobId: %s, Error: %s', self._job_id, str(error))
+            return pending_operation
+        bulk_operation_run = response['data']['bulkOperationRunMutation']
+        if len(bulk_operation_run['userErrors']) > 0:
+            raise DataAccessError('Bulk operation run failed. Details: ' + str(get_shopify_user_errors(bulk_operation_run['userErrors'])))
+
+        bulk_operation = {
+            'id': bulk_operation_run['bulkOperation']['id'],
+            'lines_key': lines_key
+        }
+        await self._async_data_access.put_bulk_operation(self._job, bulk_operation)
+        logging.info('Started bulk operation. JobId: %s, Operation: %s, Products: %s', self._job_id, bulk_operation['id'], len(lines))
+        return bulk_operation
+
+
+    async def __adopt_bulk_operation(self, pending_operation, session):
+        # Shopify runs one bulk mutation at a time per shop, so an operation
+        # started by the interrupted invocation is the current one
+        response = await self.__send_shopify_request('currentBulkOperation', self._data_access.get_current_bulk_operation, 'MUTATION', session)
+        current = response['data']['currentBulkOperation']
+        if current is None or current['createdAt'] < pending_operation['requested_at']:
+            logging.info('No bulk operation to adopt, starting it again. JobId: %s', self._job_id)
+            return None
+        bulk_operation = {
+            'id': current['id'],
+            'lines_key': pending_operation['lines_key']
+        }
+        await self._async_data_access.put_bulk_operation(self._job, bulk_operation)
+        logging.info('Adopted bulk operation. JobId: %s, Operation: %s, Status: %s', self._job_id, current['id'], current['status'])
+        return bulk_operation
+
+
+    async def __wait_for_bulk_operation(self, bulk_operation, session):
+        poll_interval = float(os.environ.get('bulk_operation_poll_interval', 10))
+        safety_margin = float(os.environ.get('invocation_safety_margin', 60))
+        while True:
+            response = await self.__send_shopify_request('bulkOperation', self._data_access.get_bulk_operation_status, bulk_operation['id'], session)
+            operation = response['data']['node']
+            if operation['status'] in FINISHED_STATUSES:
+                logging.info('Bulk operation finished. JobId: %s, Details: %s', self._job_id, operation)
+                return operation
+            if self.__get_remaining_time() - poll_interval < safety_margin:
+                return None
+            await asyncio.sleep(poll_interval)
+
+
+    async def __put_bulk_operation_results(self, bulk_operation, operation, session):
+        lines = json.loads(await self._async_data_access.get_product_file(bulk_operation['lines_key']))
+        result_sink = ResultSink(self._async_data_access, self._job, 1, self._product_reader.count, RESULT_WINDOW_SIZE, 'bulk-', self._metrics)
+        result_url = operation.get('url') or operation.get('partialDataUrl')
+        content = b''
+        if result_url is not None:
+            content = await self._data_access.get_bulk_operation_results(result_url, session)
+
+        products = None
+        completed_lines = set()
+        for row in content.splitlines():
+            if len(row.strip()) == 0:
+                continue
+            line_result = json.loads(row)
+            line_number = line_result['__lineNumber']
+            line = lines[line_number]
+            errors = []
+            product_result = check_product_result(None, line_result, errors, 'productCreate')
+            product_item = product_result['product']
+            if product_result['result'] != ResultStatus.SUCCESS.name:
+                products = products or self.__get_products()
+                product_item = products[line['id'] - 1]
+            result_sink.add(get_product_result(self._job_id, product_item, product_result['result'], errors, line['warnings'], line['id'], self._file_key))
+            completed_lines.add(line_number)
+
+        for line_number, line in enumerate(lines):
+            if line_number not in completed_lines:
+                products = products or self.__get_products()
+                errors = ['The product was not created by the bulk operation. Bulk operation status: ' + operation['status']]
+                result_sink.add(get_product_result(self._job_id, products[line['id'] - 1], ResultStatus.FAILED.name, errors, line['warnings'], line['id'], self._file_key))
+        await result_sink.close()
+
+
+    def __get_products(self):
+        products = self._product_reader.read(0, self._product_reader.count - 1)
+        for product in products:
+            validate_product(product)
+        return products
+
+
+    def __get_remaining_time(self):
+        if self._context is None:
+            return math.inf
+        return self._context.get_remaining_time_in_millis() / 1000
+
+
+    async def __send_shopify_request(self, operation, request, request_input, session, units=1):
+        return await send_shopify_request(self._scheduler, operation, lambda: request(request_input, self._domain, self._access_token, session), units, self._metrics)
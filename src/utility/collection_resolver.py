@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from custom_utils import utils
+
+
+ENTITY_TYPE = 'Collection'
+ID_NOT_FOUND = 'ID_NOT_FOUND'
+NAME_NOT_FOUND = 'NAME_NOT_FOUND'
+
+
+class CollectionResolver:
+    """
+    Class to resolve the collections products should join to collection ids.
+
+    The collections of a whole batch are deduplicated and looked up
+    concurrently before any product needs them. Lookups are cached for the
+    job in the database so later batches only look up collections they have
+    not seen before.
+    """
+
+    def __init__(self, job_id, data_access, async_data_access, send_request):
+        self._job_id = job_id
+        self._data_access = data_access
+        self._async_data_access = async_data_access
+        self._send_request = send_request
+        self._collections = {}
+        self._cache_loading = None
+        self._resolving = {}
+
+
+    def prepare(self, products, session):
+        values = set()
+        for product in products:
+            for col in product.get('collectionsToJoin', []):
+                if str(col) != '' and str(col) not in self._collections and str(col) not in self._resolving:
+                    values.add(str(col))
+        if len(values) > 0:
+            resolving = asyncio.ensure_future(self.__resolve_all(values, session))
+            for value in values:
+                self._resolving[value] = resolving
+
+
+    async def apply(self, product, warnings):
+        collections = product['collectionsToJoin']
+        resolving = {self._resolving[str(col)] for col in collections if str(col) in self._resolving}
+        if len(resolving) > 0:
+            await asyncio.gather(*resolving)
+
+        valid_collections = []
+        for col in collections:
+            collection_id = self._collections.get(str(col))
+            if collection_id is None:
+                message = 'Could not find Collection ' + str(col) + '.'
+                warnings.append(message)
+            elif collection_id == ID_NOT_FOUND:
+                message = 'Collection with Id ' + str(col) + ', was not found.'
+                warnings.append(message)
+            elif collection_id == NAME_NOT_FOUND:
+                message = 'Collection with name ' + str(col) + ', was not found.'
+                warnings.append(message)
+            elif collection_id not in valid_collections:
+                valid_collections.append(collection_id)
+
+        product['collectionsToJoin'] = valid_collections
+
+
+    async def close(self):
+        # the event loop outlives the invocation so no lookup may be left running on it
+        tasks = {task for task in self._resolving.values() if not task.done()}
+        if self._cache_loading is not None and not self._cache_loading.done():
+            tasks.add(self._cache_loading)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # cancelled lookups are started again if a later page needs them
+        self._resolving = {value: task for value, task in self._resolving.items() if task not in tasks}
+        if self._cache_loading in tasks:
+            self._cache_loading = None
+
+
+    async def __resolve_all(self, values, session):
+        if self._cache_loading is None:
+            self._cache_loading = asyncio.ensure_future(self.__load_cache())
+        await self._cache_loading
+
+        missing = [value for value in values if value not in self._collections]
+        if len(missing) == 0:
+            return
+
+        collection_ids = await asyncio.gather(*[self.__get_collection_id(value, session) for value in missing])
+        resolved = {value: collection_id for value, collection_id in zip(missing, collection_ids) if collection_id is not None}
+        for value in missing:
+            # failed lookups are tried again by the products of later pages
+            if value not in resolved: del self._resolving[value]
+        if len(resolved) > 0:
+            self._collections.update(resolved)
+            try:
+                await self._async_data_access.put_collection_cache(self._job_id, self._collections)
+            except Exception as error:
+                logging.error('Failed to cache collections. Details, Job Id: %s, Error: %s', self._job_id, str(error))
+
+
+    async def __load_cache(self):
+        try:
+            self._collections.update(await self._async_data_access.get_collection_cache(self._job_id))
+        except Exception as error:
+            logging.error('Failed to load cached collections. Details, Job Id: %s, Error: %s', self._job_id, str(error))
+
+
+    async def __get_collection_id(self, col, session):
+        try:
+            if utils.is_id(col):
+                response = await self._send_request('collection', self._data_access.get_collection_by_id, utils.get_gid(col, ENTITY_TYPE), session)
+            elif utils.is_gid(col, ENTITY_TYPE):
+                response = await self._send_request('collection', self._data_access.get_collection_by_id, col, session)
+            else:
+                response = await self._send_request('collections', self._data_access.search_collection_by_name, col, session)
+                if len(response['data']['collections']['edges']) > 0:
+                    return response['data']['collections']['edges'][0]['node']['id']
+                else:
+                    return NAME_NOT_FOUND
+
+            if response['data']['collection'] is not None:
+                return response['data']['collection']['id']
+            else:
+                return ID_NOT_FOUND
+        except Exception as error:
+            logging.exception('Failed to get Collection name. Details, Job Id: %s, Input: %s, Error: %s', self._job_id, col, str(error))
+            return None
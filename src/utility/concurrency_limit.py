@@ -0,0 +1,70 @@
+import asyncio
+from collections import deque
+
+
+class ConcurrencyLimit:
+    """
+    Class to limit the requests in flight with an AIMD (additive increase,
+    multiplicative decrease) policy.
+
+    Every successful request raises the limit by 1/limit, so the limit grows
+    by about one per round of requests while the shop keeps up. A throttled
+    request cuts the limit by the decrease factor, once per congestion
+    event: requests that were admitted before the last cut do not cut it
+    again. Waiting requests are admitted in arrival order. Must be used from
+    a running event loop.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=50, decrease_factor=0.5):
+        self._minimum = minimum
+        self._maximum = maximum
+        self._decrease_factor = decrease_factor
+        self._limit = float(max(minimum, min(maximum, initial)))
+        self._in_flight = 0
+        self._epoch = 0
+        self._waiters = deque()
+
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+
+    async def acquire(self):
+        """Waits for a free slot and returns the ticket to release it with."""
+        if self._in_flight < self.limit and len(self._waiters) == 0:
+            self._in_flight += 1
+            return self._epoch
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the cancellation
+                self._in_flight -= 1
+                self.__wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        return self._epoch
+
+
+    def release(self, ticket, throttled=False):
+        self._in_flight -= 1
+        if throttled:
+            if ticket == self._epoch:
+                self._limit = max(self._minimum, self._limit * self._decrease_factor)
+                self._epoch += 1
+        else:
+            self._limit = min(self._maximum, self._limit + 1 / self._limit)
+        self.__wake()
+
+
+    def __wake(self):
+        while len(self._waiters) > 0 and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from utility.concurrency_limit import ConcurrencyLimit
+from dataaccess.shopify_queries import get_requested_cost
+
+
+DEFAULT_MAXIMUM_AVAILABLE = 1000
+DEFAULT_RESTORE_RATE = 50
+DEFAULT_MAX_IN_FLIGHT = 50
+DEFAULT_INITIAL_IN_FLIGHT = 10
+MAX_SINGLE_QUERY_COST = 1000
+
+
+def is_throttled(response):
+    if not isinstance(response, dict):
+        return False
+    return any((error.get('extensions') or {}).get('code') == 'THROTTLED' for error in response.get('errors') or [])
+
+
+class CostScheduler:
+    """
+    Class to admit shopify graphql requests against the shop's query cost bucket.
+
+    The scheduler keeps a local copy of the leaky bucket that shopify uses for
+    graphql rate limiting. A request is admitted as soon as the bucket holds
+    its estimated cost, the requested cost of the operation in the query
+    registry until shopify has reported one, and the estimate is settled
+    against the cost reported in the response. Every response's throttleStatus corrects the local bucket
+    and its size and restore rate, so stores with larger buckets (e.g. Shopify
+    Plus) are used to their limits. Until the first response arrives only one
+    request is in flight. When a budget is set, e.g. the RateBudget shared by
+    the jobs importing into the shop, a request also has to take its cost
+    from it. The requests in flight are capped by an AIMD ConcurrencyLimit that
+    backs off when shopify throttles. Must be created from a running event
+    loop.
+    """
+
+    def __init__(self, maximum_available=DEFAULT_MAXIMUM_AVAILABLE, restore_rate=DEFAULT_RESTORE_RATE, max_in_flight=DEFAULT_MAX_IN_FLIGHT, initial_in_flight=DEFAULT_INITIAL_IN_FLIGHT):
+        self._maximum_available = maximum_available
+        self._restore_rate = restore_rate
+        self._available = maximum_available
+        self._updated_at = time.monotonic()
+        self._in_flight = 0
+        self._costs = {}
+        self._admission_lock = asyncio.Lock()
+        self._slots = ConcurrencyLimit(initial_in_flight, maximum=max_in_flight)
+        self._calibrated = asyncio.Event()
+        self.budget = None
+
+
+    @property
+    def available(self):
+        self.__restore()
+        return self._available
+
+
+    @property
+    def restore_rate(self):
+        return self._restore_rate
+
+
+    @property
+    def concurrency(self):
+        return self._slots.limit
+
+
+    def estimate_cost(self, operation, units=1):
+        if operation in self._costs:
+            return self._costs[operation] * units
+        return get_requested_cost(operation, units)
+
+
+    def get_units_per_request(self, operation, limit):
+        """Returns how many units of an operation fit in one request, keeping a
+        request under shopify's single query limit and half of the bucket."""
+        unit_cost = self._costs.get(operation) or get_requested_cost(operation)
+        budget = min(MAX_SINGLE_QUERY_COST, self._maximum_available // 2)
+        return max(1, min(limit, int(budget // unit_cost)))
+
+
+    async def acquire(self, cost):
+        """Waits until the request can go out and returns the ticket to release it with."""
+        ticket = await self._slots.acquire()
+        budget = self.budget
+        taken = False
+        try:
+            # The shared budget is taken before the admission lock, so the
+            # database round trip of a lease never holds up the requests
+            # queued behind it
+            if budget is not None:
+                await budget.take(cost, self._maximum_available, self._restore_rate)
+                taken = True
+            # Requests are admitted in arrival order so an expensive request
+            # is not starved by cheaper ones
+            async with self._admission_lock:
+                if not self._calibrated.is_set() and self._in_flight > 0:
+                    await self._calibrated.wait()
+                self.__restore()
+                while self._available < cost:
+                    await asyncio.sleep((cost - self._available) / self._restore_rate)
+                    self.__restore()
+                self._available -= cost
+                self._in_flight += 1
+        except BaseException:
+            if taken:
+                budget.refund(cost)
+            self._slots.release(ticket)
+            raise
+        return ticket
+
+
+    def release(self, operation, cost, response, units=1, ticket=None, throttled=False):
+        self._in_flight -= 1
+        self._slots.release(ticket, throttled or is_throttled(response))
+        self.__restore()
+
+        cost_info = None
+        if isinstance(response, dict) and 'extensions' in response:
+            cost_info = response['extensions'].get('cost')
+
+        if cost_info is None:
+            # The request failed before shopify reported a cost, give back the reservation
+            self._available = min(self._maximum_available, self._available + cost)
+            if self.budget is not None:
+                self.budget.refund(cost)
+        else:
+            if cost_info.get('requestedQueryCost') is not None:
+                self._costs[operation] = cost_info['requestedQueryCost'] / units
+            actual_cost = cost_info.get('actualQueryCost') or 0
+            self._available = min(self._maximum_available, self._available + cost - actual_cost)
+            if self.budget is not None:
+                self.budget.refund(cost - actual_cost)
+
+            throttle_status = cost_info.get('throttleStatus')
+            if throttle_status is not None:
+                self._maximum_available = throttle_status['maximumAvailable']
+                self._restore_rate = throttle_status['restoreRate']
+                # Shopify has already deducted the cost of the requests that are
+                # still in flight, so its value is only trusted as an upper bound
+                # unless nothing else is outstanding
+                if self._in_flight == 0:
+                    self._available = throttle_status['currentlyAvailable']
+                else:
+                    self._available = min(self._available, throttle_status['currentlyAvailable'])
+        self._calibrated.set()
+
+
+    def __restore(self):
+        now = time.monotonic()
+        self._available = min(self._maximum_available, self._available + (now - self._updated_at) * self._restore_rate)
+        self._updated_at = now
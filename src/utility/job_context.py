@@ -0,0 +1,116 @@
+import logging
+import os
+import time
+from datetime import datetime
+from utility.job_replay import REPLAY_JOB_TYPE
+
+
+# users read by earlier invocations of this container, keyed by user id
+_users = {}
+
+
+class JobContext:
+    """
+    Class for the job and user state that an invocation needs.
+
+    The slow-changing job fields travel with the message that chains the
+    invocations of a job, and the user is kept while the container is warm,
+    so a warm invocation reads nothing from dynamodb. The job and user are
+    read together with a single BatchGetItem when the message does not carry
+    the job yet or the cached user is older than job_context_ttl seconds.
+    """
+
+    def __init__(self, message_payload, data_access):
+        self.job_id = message_payload['jobId']
+        self.user_id = message_payload['userId']
+        self._message_payload = message_payload
+        self._data_access = data_access
+        # the range of the sendable products a worker of a sharded job owns
+        self.shard = message_payload.get('shard')
+        self.user = None
+        self.start_time = None
+        self.type = None
+        self.product_limit_exceeded = False
+        self.input_products = None
+        self.current_batch = None
+        # whether the job runs as a bulk operation, decided by its first invocation
+        self.bulk_operation = None
+
+
+    def load(self):
+        job_state = self._message_payload.get('job')
+        cached_user = _users.get(self.user_id)
+        ttl = float(os.environ.get('job_context_ttl', 300))
+
+        if job_state is not None and cached_user is not None and time.monotonic() - cached_user[1] < ttl:
+            self.user = cached_user[0]
+            self.start_time = job_state.get('startTime')
+            self.type = job_state.get('type')
+            self.product_limit_exceeded = job_state.get('productLimitExceeded', False)
+            self.input_products = job_state['inputProducts']
+        else:
+            job, user = self._data_access.get_job_and_user(self.job_id, self.user_id)
+            logging.info('Loaded job context. JobId: %s, Cached: %s', self.job_id, job_state is not None)
+            _users[self.user_id] = (user, time.monotonic())
+            self.user = user
+            self.start_time = job.get('start_time')
+            self.type = job.get('type')
+            self.product_limit_exceeded = job.get('product_limit_exceeded', False)
+            self.input_products = job['input_products']
+            self.current_batch = job.get('current_batch')
+
+        self.bulk_operation = (job_state or {}).get('bulkOperation')
+
+        if self.type == REPLAY_JOB_TYPE and 'cursor' not in self._message_payload:
+            # a replay of a finished job starts over on its failed products
+            self.start_time = None
+            self.current_batch = None
+            self.bulk_operation = None
+        if self.start_time is None:
+            # the first invocation of the job starts it
+            self.start_time = datetime.utcnow().isoformat() + 'Z'
+        return self
+
+
+    @property
+    def domain(self):
+        return self.user['domain']
+
+
+    @property
+    def access_token(self):
+        return self.user['access_token']
+
+
+    @property
+    def start_index(self):
+        # the first message of a job comes from the product generator without a
+        # cursor, later ones carry the index of the next product to process
+        if 'cursor' in self._message_payload:
+            return int(self._message_payload['cursor'])
+        current_batch = int(self.current_batch or 1)
+        return (current_batch - 1) * int(os.environ.get('batch_size'))
+
+
+    def get_message(self, cursor, shard=None):
+        message = {
+            'jobId': self.job_id,
+            'userId': self.user_id,
+            'cursor': cursor,
+            'job': {
+                'startTime': self.start_time,
+                'type': self.type,
+                'productLimitExceeded': self.product_limit_exceeded,
+                'inputProducts': self.input_products,
+                'bulkOperation': self.bulk_operation
+            }
+        }
+        shard = shard or self.shard
+        if shard is not None:
+            message['shard'] = shard
+        return message
+
+
+    def get_duration_seconds(self):
+        start_time = datetime.strptime(self.start_time, '%Y-%m-%dT%H:%M:%S.%fZ')
+        return round((datetime.utcnow() - start_time).total_seconds())
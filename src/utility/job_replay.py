@@ -0,0 +1,53 @@
+import logging
+from utility.product_file_reader import build_offset_index
+from utility.product_validator import validate_product
+from utility.sendable_products import encode_sendable_entry
+from utility.product_results import get_result_product_id
+
+
+REPLAY_JOB_TYPE = 'REPLAY'
+REPLAY_FILE_SUFFIX = '.replay.json'
+
+
+def is_replay_job(job_type):
+    return job_type == REPLAY_JOB_TYPE
+
+
+def get_replay_file_key(file_key):
+    return file_key + REPLAY_FILE_SUFFIX
+
+
+async def write_replay_products(product_reader, file_key, job, async_data_access):
+    """
+    Writes the replay file of a finished job, which has the sendable file's
+    format and holds only the products whose results are FAILED. The failed
+    results are found through the result status index and only their
+    products are read from the prepared file. Products that fail validation
+    again keep the results they have. The file's offset index is written as
+    well, replacing the one of an earlier replay of the job. Returns the
+    content of the replay file.
+
+    A replay that is interrupted before it finishes can simply be started
+    again, the products that were created in the meantime no longer have
+    FAILED results.
+    """
+    result_ids = await async_data_access.get_failed_result_ids(job['id'])
+    # sending a product that exists on the store again would duplicate it
+    result_data = await async_data_access.get_result_data_by_id(job['id'], result_ids)
+    created_ids = {result_id for result_id in result_ids if get_result_product_id(result_data.get(str(result_id))) is not None}
+    if len(created_ids) > 0:
+        logging.info('Skipped failed products that were created. JobId: %s, Products: %s', job['id'], sorted(created_ids))
+        result_ids = [result_id for result_id in result_ids if result_id not in created_ids]
+    products = product_reader.read_many([result_id - 1 for result_id in result_ids])
+    entries = []
+    for result_id, product in zip(result_ids, products):
+        errors, warnings = validate_product(product)
+        if len(errors) == 0:
+            entries.append(encode_sendable_entry(result_id, product, warnings))
+
+    content = b'[' + b',\n'.join(entries) + b']'
+    replay_file_key = get_replay_file_key(file_key)
+    await async_data_access.put_product_file(replay_file_key, content)
+    await async_data_access.put_product_file_index(replay_file_key, build_offset_index(content))
+    logging.info('Prepared replay. JobId: %s, Failed: %s, Sendable: %s', job['id'], len(result_ids), len(entries))
+    return content
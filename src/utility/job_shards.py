@@ -0,0 +1,22 @@
+import math
+
+
+def get_shards(product_count, shard_count, batch_size):
+    """
+    Splits the sendable products of a job into at most shard_count ranges of
+    whole batches. A shard is {index, start, end} with end exclusive, so
+    small jobs get fewer shards than asked for.
+    """
+    batch_count = math.ceil(product_count / batch_size)
+    if batch_count == 0:
+        return []
+    shard_batches = math.ceil(batch_count / max(1, shard_count))
+    shard_size = shard_batches * batch_size
+    shards = []
+    for start in range(0, product_count, shard_size):
+        shards.append({
+            'index': len(shards),
+            'start': start,
+            'end': min(start + shard_size, product_count)
+        })
+    return shards
@@ -0,0 +1,75 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+MAX_VALUES_PER_METRIC = 100
+MILLISECONDS = 'Milliseconds'
+COUNT = 'Count'
+COUNT_PER_SECOND = 'Count/Second'
+NONE = 'None'
+
+
+class Metrics:
+    """
+    Class to collect the metrics of an invocation and write them as
+    CloudWatch Embedded Metric Format log lines, which CloudWatch turns into
+    metrics without any api calls. Every value of a metric is kept, so
+    CloudWatch can compute percentiles, and flush writes them at the end of
+    the invocation.
+    """
+
+    def __init__(self, dimensions=None, namespace=None):
+        self._namespace = namespace or os.environ.get('metrics_namespace', 'ProductProcessor')
+        self._dimensions = dict(dimensions or {})
+        self._properties = {}
+        self._values = {}
+        self._units = {}
+
+
+    def put(self, name, value, unit=MILLISECONDS):
+        self._values.setdefault(name, []).append(value)
+        self._units[name] = unit
+
+
+    def put_dimension(self, name, value):
+        self._dimensions[name] = value
+
+
+    def put_property(self, name, value):
+        """Adds a value that is searchable in the log line but is not a metric."""
+        self._properties[name] = value
+
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, (time.perf_counter() - start) * 1000)
+
+
+    def flush(self):
+        # EMF allows at most 100 values per metric in one line
+        while len(self._values) > 0:
+            line = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self._namespace,
+                        'Dimensions': [list(self._dimensions)],
+                        'Metrics': [{'Name': name, 'Unit': self._units[name]} for name in self._values]
+                    }]
+                }
+            }
+            line.update(self._properties)
+            line.update(self._dimensions)
+            for name in list(self._values):
+                line[name] = self._values[name][:MAX_VALUES_PER_METRIC]
+                self._values[name] = self._values[name][MAX_VALUES_PER_METRIC:]
+                if len(self._values[name]) == 0:
+                    del self._values[name]
+            # lambda sends stdout to cloudwatch logs, where EMF lines are picked up
+            print(json.dumps(line, separators=(',', ':')), flush=True)
@@ -0,0 +1,124 @@
+import json
+import logging
+import re
+from utility import json_codec
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+MAX_READ_GAP = 20
+
+
+def build_offset_index(content):
+    """
+    Scans a JSON array of products and returns the byte span of every element.
+    The content is decoded as latin-1 so character positions map one to one
+    to byte positions; string values are mangled but only the spans are kept.
+    """
+    text = content.decode('latin-1')
+    decoder = json.JSONDecoder()
+    starts = []
+    ends = []
+
+    index = WHITESPACE.match(text, 0).end()
+    if text.startswith('\xef\xbb\xbf', index):
+        index = WHITESPACE.match(text, index + 3).end()
+    if index >= len(text) or text[index] != '[':
+        raise ValueError('Product file is not a JSON array')
+
+    index = WHITESPACE.match(text, index + 1).end()
+    if index < len(text) and text[index] == ']':
+        return {'count': 0, 'starts': starts, 'ends': ends}
+
+    while True:
+        _, end = decoder.raw_decode(text, index)
+        starts.append(index)
+        ends.append(end)
+        index = WHITESPACE.match(text, end).end()
+        if index >= len(text):
+            raise ValueError('Product file ended before the closing bracket')
+        if text[index] == ',':
+            index = WHITESPACE.match(text, index + 1).end()
+        elif text[index] == ']':
+            break
+        else:
+            raise ValueError('Unexpected character in product file at byte ' + str(index))
+
+    return {'count': len(starts), 'starts': starts, 'ends': ends}
+
+
+class ProductFileReader:
+    """
+    Class to read a slice of products from the prepared products file without
+    downloading and parsing the whole file on every batch. The offset index
+    is loaded on first use when load is not called.
+    """
+
+    def __init__(self, file_key, data_access):
+        self._file_key = file_key
+        self._data_access = data_access
+        self._index = None
+        self._content = None
+
+
+    def load(self, content=None):
+        """Loads the offset index of the file. The content can be passed in
+        when the caller has just written the file."""
+        self._index = self._data_access.get_product_file_index(self._file_key)
+        if self._index is None:
+            # First batch of the job: download the file once, build the offset
+            # index and keep the content around so this invocation needs no
+            # ranged reads.
+            self._content = content if content is not None else self._data_access.get_product_file(self._file_key)
+            self._index = build_offset_index(self._content)
+            self._data_access.put_product_file_index(self._file_key, self._index)
+            logging.info('Built product file index. File: %s, Products: %s', self._file_key, self._index['count'])
+        return self
+
+
+    @property
+    def count(self):
+        if self._index is None:
+            self.load()
+        return self._index['count']
+
+
+    def read(self, start_index, end_index):
+        """Returns products from start_index to end_index, both inclusive."""
+        content, spans = self.read_spans(start_index, end_index)
+        if len(spans) == 0:
+            return []
+        return json_codec.loads(b'[' + content[spans[0][0]:spans[-1][1]] + b']')
+
+
+    def read_many(self, indexes):
+        """Returns the products at the sorted indexes. Indexes close to each
+        other are read with one ranged read, skipping the products between
+        them unparsed."""
+        products = []
+        i = 0
+        while i < len(indexes):
+            j = i
+            while j + 1 < len(indexes) and indexes[j + 1] - indexes[j] <= MAX_READ_GAP:
+                j += 1
+            content, spans = self.read_spans(indexes[i], indexes[j])
+            for index in indexes[i:j + 1]:
+                start, end = spans[index - indexes[i]]
+                products.append(json_codec.loads(content[start:end]))
+            i = j + 1
+        return products
+
+
+    def read_spans(self, start_index, end_index):
+        """Returns a buffer holding the products from start_index to end_index,
+        both inclusive, and the byte span of every product in it, so products
+        can be used without parsing them."""
+        end_index = min(end_index, self.count - 1)
+        if start_index > end_index:
+            return b'', []
+
+        starts = self._index['starts'][start_index:end_index + 1]
+        ends = self._index['ends'][start_index:end_index + 1]
+        if self._content is not None:
+            return self._content, list(zip(starts, ends))
+        content = self._data_access.get_product_file_range(self._file_key, starts[0], ends[-1] - 1)
+        return content, [(start - starts[0], end - starts[0]) for start, end in zip(starts, ends)]
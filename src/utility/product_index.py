@@ -0,0 +1,75 @@
+import logging
+import re
+from datamodel.custom_exceptions import DataAccessError
+
+
+UPSERT_JOB_TYPE = 'UPSERT'
+SKIP_EXISTING_JOB_TYPE = 'SKIP_EXISTING'
+HANDLE_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def is_indexed_job(job_type):
+    return job_type in (UPSERT_JOB_TYPE, SKIP_EXISTING_JOB_TYPE)
+
+
+def get_product_handle(product):
+    """Returns the product's handle or, when it has none, the one shopify generates from its title."""
+    handle = product.get('handle')
+    if handle is None or str(handle).strip() == '':
+        handle = product.get('title') or ''
+    return HANDLE_SEPARATORS.sub('-', str(handle).lower()).strip('-')
+
+
+class ProductIndex:
+    """
+    Class for the handle to id index of the products already on the shop.
+
+    The index is built once per job, before any product is sent, by paging
+    through the shop's products, and written next to the prepared file so
+    later batches and the workers of a sharded job read it instead of
+    listing the products again. Loading it again for the same job reads the
+    written index, so products the job created itself never count as
+    existing ones.
+    """
+
+    def __init__(self, job_id, file_key, data_access, async_data_access, send_request):
+        self._job_id = job_id
+        self._file_key = file_key
+        self._data_access = data_access
+        self._async_data_access = async_data_access
+        self._send_request = send_request
+        self._handles = None
+
+
+    async def load(self, session):
+        if self._handles is None:
+            handles = await self._async_data_access.get_product_index(self._file_key)
+            if handles is None:
+                handles = await self.__build(session)
+                await self._async_data_access.put_product_index(self._file_key, handles)
+            self._handles = handles
+        return self
+
+
+    def get(self, handle):
+        """Returns the id of the shop's product with the handle, None when there is none."""
+        if not handle:
+            return None
+        return self._handles.get(handle)
+
+
+    async def __build(self, session):
+        handles = {}
+        cursor = None
+        while True:
+            response = await self._send_request('products', self._data_access.get_product_handles, cursor, session)
+            if response is None or response.get('data') is None:
+                raise DataAccessError('Could not list the products of the shop. Error: ' + str((response or {}).get('errors')))
+            products = response['data']['products']
+            for edge in products['edges']:
+                handles[edge['node']['handle']] = edge['node']['id']
+            if not products['pageInfo']['hasNextPage'] or len(products['edges']) == 0:
+                break
+            cursor = products['edges'][-1]['cursor']
+        logging.info('Built product index. JobId: %s, Products: %s', self._job_id, len(handles))
+        return handles
@@ -1,22 +1,59 @@
-from collections import Counter
 import logging
-import json
 import asyncio
-import aiohttp
-from boto3 import session
-from botocore.vendored.six import reraise
 from datamodel.custom_exceptions import MissingArgumentError
 from datamodel.custom_exceptions import ShopifyUnauthorizedError
 from datamodel.custom_exceptions import DataAccessError
 from datamodel.custom_enums import JobStatus
 from datamodel.custom_enums import ResultStatus
 from dataaccess.data_access import DataAccess
-from custom_utils import utils
+from dataaccess.shopify_queries import PRODUCT_CREATE_ALIAS_PREFIX
+from dataaccess.shopify_queries import PRODUCT_UPDATE_ALIAS_PREFIX
+from dataaccess.data_access import RESULT_CLAIM_STATUS
+from dataaccess.data_access import ShopifyRetryableError
+from dataaccess.async_data_access import AsyncDataAccess
+from utility.result_sink import ResultSink
+from utility.result_sink import ReplayResultSink
+from utility.collection_resolver import CollectionResolver
+from utility.product_file_reader import ProductFileReader
+from utility.sendable_products import write_sendable_products
+from utility.sendable_products import get_sendable_file_key
+from utility.sendable_products import read_sendable_entries
+from utility.sendable_products import encode_product
+from utility.sendable_products import PRODUCT_CREATE_VARIANTS
+from utility.job_shards import get_shards
+from utility.product_index import ProductIndex
+from utility.product_index import is_indexed_job
+from utility.product_index import SKIP_EXISTING_JOB_TYPE
+from utility.job_replay import is_replay_job
+from utility.job_replay import get_replay_file_key
+from utility.job_replay import write_replay_products
+from utility.product_results import check_product_result
+from utility.product_results import get_product_result
+from utility.product_results import get_variants_error
+from utility.cost_scheduler import is_throttled
+from utility.shopify_requests import send_shopify_request
+from utility.rate_budget import get_job_weight
+from utility.metrics import Metrics
+from utility.metrics import COUNT
+from utility.metrics import COUNT_PER_SECOND
+from utility import shopify_connection
 from datetime import datetime
 import os
 import time
 
 
+RESULT_WINDOW_SIZE = 50
+MAX_RUNNING_PAGES = 2
+VARIANTS_PER_REQUEST = 100
+REQUEST_FAILED_ERROR = 'An issue occured whiles creating the product.'
+THROTTLED_PRODUCT_ERROR = 'Shopify kept throttling the requests to create this product.'
+UNANSWERED_PRODUCT_ERROR = 'Shopify did not answer whether this product was created. It was not sent again to avoid creating a duplicate, check the store for it.'
+INTERRUPTED_PRODUCT_ERROR = 'The import was interrupted while this product was being created. It was not sent again to avoid creating a duplicate, check the store for it.'
+SKIPPED_PRODUCT_WARNING = 'A product with the handle {} already exists on the store, it was not created again.'
+UPDATED_PRODUCT_WARNING = 'A product with the handle {} already existed on the store and was updated.'
+VARIANTS_FAILED_ERROR = 'Variants {} to {} could not be added to the product, which was created without them. {}'
+
+
 class ProductProcessor:
     """
     Class to process and create products on shopify
@@ -24,219 +61,385 @@ class ProductProcessor:
 
     def __init__(self, product_info):
         if product_info is not None:
-            self._products = product_info.get('products')
+            self._product_reader = product_info.get('product_reader')
             self._user_id = product_info.get('user_id')
             self._job_id = product_info.get('job_id')
             self._job_type = product_info.get('type')
-            self._batch = product_info.get('batch')
+            self._file_key = product_info.get('file_key')
+            # a replay only works through the products whose results failed
+            self._replay = is_replay_job(self._job_type)
+            self._sendable_file_key = get_replay_file_key(self._file_key) if self._replay else get_sendable_file_key(self._file_key)
+            self._sendable_reader = None
+            self._start_index = product_info.get('start_index', 0)
+            self._next_index = self._start_index
+            self._shard = product_info.get('shard')
+            self._shard_count = int(os.environ.get('shard_count', 1))
+            self._shards = None
+            self._job = {
+                'id': self._job_id,
+                'user_id': self._user_id
+            }
+            self._context = product_info.get('context')
+            self._metrics = product_info.get('metrics') or Metrics()
+            self._start_time = product_info.get('start_time') or datetime.utcnow().isoformat() + 'Z'
             self._batch_size = int(os.environ.get('batch_size'))
+            self._safety_margin = float(os.environ.get('invocation_safety_margin', 60))
+            self._page_durations = []
+            self._result_sinks = []
             self._domain = product_info.get('domain')
             self._access_token = product_info.get('access_token')
-            self._data_access = DataAccess()
-            self._current_rate_limit = 1000
-            self._batch_duration = 0
+            self._data_access = product_info.get('data_access') or DataAccess()
+            self._async_data_access = AsyncDataAccess(self._data_access)
+            self._products_per_request = int(os.environ.get('products_per_request', 10))
+            self._variants_per_request = int(os.environ.get('variants_per_request', VARIANTS_PER_REQUEST))
+            self._collection_resolver = CollectionResolver(self._job_id, self._data_access, self._async_data_access, self.__send_shopify_request)
+            # upsert and skip-existing jobs look up the shop's products by handle
+            self._product_index = None
+            if is_indexed_job(self._job_type):
+                self._product_index = ProductIndex(self._job_id, self._file_key, self._data_access, self._async_data_access, self.__send_shopify_request)
         else:
             raise MissingArgumentError('Missing argument for ProductProcessor class')
 
     
     def process(self):
-        if self._batch == 1:
-            self._data_access.basic_job_update({
-                'id': self._job_id,
-                'user_id': self._user_id,
-                'status': JobStatus.RUNNING.name,
-                'start_time': datetime.utcnow().isoformat() + 'Z',
-                'type': self._job_type
-            })
-
-        batch_start_index = (self._batch - 1) * self._batch_size
-        batch_end_index = (self._batch * self._batch_size) - 1
-        product_end_index = len(self._products) - 1
-        is_last_batch = False
-        batch_products = []
-
-        if batch_end_index >= product_end_index:
-            batch_products = self._products[batch_start_index:]
-            is_last_batch = True
-        else:
-            batch_products = self._products[batch_start_index: (batch_end_index + 1)]
-
-        async_batch_size = 50 #number of products that should be run asynchronously
-        async_batches = [batch_products[i: i + async_batch_size] for i in range(0, len(batch_products), async_batch_size)]
-        result_counter = batch_start_index + 1
-
-        for batch in async_batches:   
-            #We are checking to ensure that we have enough rate limit to 
-            #run batch asynchonously. If not we delay a bit so we can recover rate
-            #limit to run the batch without hitting our limit
-            rate_limit_needed_for_batch = 750
-            limit_restore_rate = 50
-            actual_rate_limit_left = self._current_rate_limit + (self._batch_duration * limit_restore_rate)
-            if actual_rate_limit_left < rate_limit_needed_for_batch:
-                extra_limit_needed = rate_limit_needed_for_batch - actual_rate_limit_left
-                time_to_wait = (extra_limit_needed // limit_restore_rate) + 1
-                time.sleep(time_to_wait)
-
-            start = time.time()
-            asyncio.run(self.__create_products(batch, result_counter))
-            result_counter += async_batch_size
-            end = time.time()
-            self._batch_duration = int(end - start)
-        
-        if is_last_batch:
+        try:
+            # The first batch validates the whole job and every batch then works
+            # through the products that can be created, by their position in the
+            # sendable file
+            if self._start_index == 0 and self._shard is None:
+                self._data_access.basic_job_update({
+                    'id': self._job_id,
+                    'user_id': self._user_id,
+                    'status': JobStatus.RUNNING.name,
+                    'start_time': self._start_time,
+                    'type': self._job_type
+                })
+                with self._metrics.timer('SendableFileTime'):
+                    if self._replay:
+                        content = shopify_connection.run(write_replay_products(self._product_reader, self._file_key, self._job, self._async_data_access))
+                    else:
+                        content = shopify_connection.run(write_sendable_products(self._product_reader, self._file_key, self._job, self._async_data_access, self._metrics, self._product_index is not None))
+                self._sendable_reader = ProductFileReader(self._sendable_file_key, self._data_access).load(content)
+                if self._product_index is not None:
+                    # built before the job is sharded so every worker reads the same index
+                    with self._metrics.timer('ProductIndexTime'):
+                        shopify_connection.run(self.__load_product_index())
+
+                if self._shard_count > 1:
+                    shards = get_shards(self._sendable_reader.count, self._shard_count, self._batch_size)
+                    if len(shards) > 1:
+                        # the shards are published to concurrent workers instead
+                        self._data_access.put_job_shards(self._job, len(shards))
+                        self._shards = shards
+                        return False
+            else:
+                self._sendable_reader = ProductFileReader(self._sendable_file_key, self._data_access).load()
+
+            shopify_connection.run(self.__process_products())
+        finally:
+            self._async_data_access.shutdown()
+            self.__release_rate_budget()
+
+        if self._next_index >= self.__get_end_index():
             return True
         else:
             return False
 
 
-    async def __create_products(self, products, result_counter):
-        counter = result_counter
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            for product in products:
-                if 'option1Name' in product: del product['option1Name']
-                if 'option2Name' in product: del product['option2Name']
-                if 'option3Name' in product: del product['option3Name']
-                if 'variantTitles' in product: del product['variantTitles']
-                errors = product['errors']
-                warnings = product['warnings']
-                del product['errors']
-                del product['warnings']
-                if len(product['variants']) > 100:
-                    errors.append('The number of product variants for this product exceeds the shopify limit of 100 variants')
-                if 'collectionsToJoin' in product and len(product['collectionsToJoin']) > 4:
-                    errors.append('Maximum Collections to add a product to cannot is limited to 4')
-                tasks.append(self.__put_shopify_product(product, counter, errors, warnings, session))
-                counter += 1
-            await asyncio.gather(*tasks)
-
-
-    async def __put_shopify_product(self, product_item, counter, errors, warnings, session):
-        
-        if len(errors) > 0:
-            self.__put_result(product_item, ResultStatus.FAILED.name, errors, warnings, counter)
+    @property
+    def next_index(self):
+        return self._next_index
+
+
+    @property
+    def shards(self):
+        """The shards to publish when the job was split by this invocation."""
+        return self._shards
+
+
+    def __get_end_index(self):
+        if self._shard is not None:
+            return self._shard['end']
+        return self._sendable_reader.count
+
+
+    async def __connect(self):
+        # Every product of a page is scheduled at once, the cost scheduler
+        # decides when each shopify request can go out
+        self._scheduler = shopify_connection.get_scheduler(self._domain)
+        self._session = await shopify_connection.get_session(self._domain)
+        # Every job importing into the shop, and every worker of a sharded
+        # job, leases its cost from the shop's shared budget. Jobs with few
+        # products left get a larger share so they finish quickly.
+        budget = shopify_connection.get_rate_budget(self._domain, self._job_id, self._data_access)
+        budget.weight = get_job_weight(self.__get_end_index() - self._start_index)
+        self._scheduler.budget = budget
+
+
+    async def __load_product_index(self):
+        await self.__connect()
+        await self._product_index.load(self._session)
+
+
+    async def __process_products(self):
+        await self.__connect()
+        if self._product_index is not None:
+            await self._product_index.load(self._session)
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        product_count = self.__get_end_index()
+        index = self._start_index
+        next_page = None
+        running_pages = []
+
+        # Pages of batch_size products are processed until the invocation is
+        # close to its time limit. The next page is read and started while the
+        # previous one finishes, so admission never stops between pages.
+        try:
+            while index < product_count:
+                if index > self._start_index and not self.__has_time_for_page():
+                    break
+                if next_page is None:
+                    next_page = loop.run_in_executor(None, self.__read_page, index, min(index + self._batch_size, product_count) - 1)
+                entries = await next_page
+                index += len(entries)
+                next_page = None
+                if index < product_count:
+                    next_page = loop.run_in_executor(None, self.__read_page, index, min(index + self._batch_size, product_count) - 1)
+
+                running_pages.append(asyncio.ensure_future(self.__create_products(entries)))
+                if len(running_pages) >= MAX_RUNNING_PAGES:
+                    await running_pages.pop(0)
+            await asyncio.gather(*running_pages)
+        except BaseException:
+            # the loop outlives this invocation so nothing may be left running on it
+            for page in running_pages:
+                page.cancel()
+            await asyncio.gather(*running_pages, return_exceptions=True)
+            raise
+        finally:
+            await self._collection_resolver.close()
+        self._next_index = index
+        elapsed = time.monotonic() - start
+        self._metrics.put('Products', index - self._start_index, COUNT)
+        if elapsed > 0:
+            self._metrics.put('ProductsPerSecond', (index - self._start_index) / elapsed, COUNT_PER_SECOND)
+
+
+    def __release_rate_budget(self):
+        # the job stops counting against the other jobs' shares between invocations
+        try:
+            shopify_connection.release_rate_budget(self._domain, self._job_id)
+        except DataAccessError as error:
+            logging.error('An error occured whiles releasing the rate budget. JobId: %s, Error: %s', self._job_id, str(error))
+
+
+    def __read_page(self, start_index, end_index):
+        with self._metrics.timer('PageReadTime'):
+            return read_sendable_entries(self._sendable_reader, start_index, end_index)
+
+
+    def __has_time_for_page(self):
+        if self._context is None:
+            return True
+        remaining_time = self._context.get_remaining_time_in_millis() / 1000
+        page_time = 0
+        if len(self._page_durations) > 0:
+            page_time = sum(self._page_durations) / len(self._page_durations)
+        # the page that is still running has to finish as well as the new one
+        return remaining_time - self._safety_margin > MAX_RUNNING_PAGES * page_time
+
+
+    async def __create_products(self, entries):
+        start = time.monotonic()
+        session = self._session
+        # Result ids are the products' positions in the prepared file, the ones
+        # that failed validation are missing from the page. A replay replaces
+        # the failed results in place.
+        if self._replay:
+            result_sink = ReplayResultSink(self._async_data_access, self._job, entries[0]['id'], entries[-1]['id'], metrics=self._metrics)
         else:
-            if 'collectionsToJoin' in product_item:
-                await self.__modify_product(product_item, warnings, session)
-            response = None
+            result_sink = ResultSink(self._async_data_access, self._job, entries[0]['id'], entries[-1]['id'], RESULT_WINDOW_SIZE, metrics=self._metrics)
+        self._result_sinks.append(result_sink)
+        try:
+            # A redelivered batch resumes at the exact product: finished products
+            # are only counted again, and a product whose claim has no result may
+            # already exist on shopify so it is never sent twice. Every product
+            # of a replay starts with a failed result.
+            statuses = await self._async_data_access.get_result_statuses(self._job_id, [entry['id'] for entry in entries])
+            sendable_entries = []
+            for entry in entries:
+                status = statuses.get(str(entry['id']))
+                if status is None or (self._replay and status == ResultStatus.FAILED.name):
+                    sendable_entries.append(entry)
+                elif status == RESULT_CLAIM_STATUS:
+                    self.__put_result(entry['product'], ResultStatus.FAILED.name, [INTERRUPTED_PRODUCT_ERROR], entry['warnings'], entry['id'])
+                else:
+                    result_sink.count(entry['id'], status)
+            if len(sendable_entries) < len(entries):
+                logging.info('Resumed page. JobId: %s, Products: %s, Remaining: %s', self._job_id, len(entries), len(sendable_entries))
+
+            update_entries = []
+            if self._product_index is not None:
+                sendable_entries, update_entries = self.__route_existing_products(sendable_entries)
+
+            self._collection_resolver.prepare(sendable_entries + update_entries, session)
+            tasks = []
+            for operation, operation_entries in (('productCreate', sendable_entries), ('productUpdate', update_entries)):
+                request_size = self._scheduler.get_units_per_request(operation, self._products_per_request)
+                for i in range(0, len(operation_entries), request_size):
+                    tasks.append(asyncio.ensure_future(self.__put_shopify_products(operation_entries[i: i + request_size], session, operation)))
             try:
-                response = await self._data_access.create_shopify_product(product_item, self._domain, self._access_token, session)
-            except ShopifyUnauthorizedError as error:
-                logging.exception(str(error))
-                raise ShopifyUnauthorizedError(error)
-            except (DataAccessError, Exception) as error:
-                logging.exception('An Error occured whiles creating shopify product. Details are JobId: %s, Products: %s, Error: %s', self._job_id, product_item, str(error))
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        finally:
+            await result_sink.close()
+            self._result_sinks.remove(result_sink)
+        duration = time.monotonic() - start
+        self._page_durations.append(duration)
+        self._metrics.put('PageTime', duration * 1000)
+
+
+    def __route_existing_products(self, entries):
+        # Products whose handle is already on the shop are skipped, or updated
+        # by upsert jobs, so only the new ones are created
+        create_entries = []
+        update_entries = []
+        for entry in entries:
+            product_id = self._product_index.get(entry.get('handle'))
+            if product_id is None:
+                create_entries.append(entry)
+            elif self._job_type == SKIP_EXISTING_JOB_TYPE:
+                entry['warnings'].append(SKIPPED_PRODUCT_WARNING.format(entry['handle']))
+                self.__put_result({'id': product_id, 'handle': entry['handle']}, ResultStatus.SUCCESS.name, [], entry['warnings'], entry['id'])
             else:
-                product_result = self.__check_product_result(product_item, response, errors)
-                self.__put_result(product_result['product'], product_result['result'], errors, warnings, counter)
-                if 'extensions' in response:
-                    self._current_rate_limit = response['extensions']['cost']['throttleStatus']['currentlyAvailable']
-
-
-    def __check_product_result(self, product, response, errors):
-        result = None
-        if response is None:
-            errors.append('An issue occured whiles creating the product.')
-            result = ResultStatus.FAILED.name
-        elif 'errors' in response:
-            logging.error('A graphql syntax error occured whiles creating product. Product Details: %s, Error: %s', product, response['errors'])
-            errors.append('An issue occured whiles creating the product.')
-            result = ResultStatus.FAILED.name
-        elif response['data']['productCreate']['product'] is None:
-            user_errors = response['data']['productCreate']['userErrors']
-            error_messages = self.__get_shopify_user_errors(user_errors)
-            errors.extend(error_messages)
-            result = ResultStatus.FAILED.name
-        elif response['data']['productCreate']['product'] is not None:
-            product = response['data']['productCreate']['product']
-            result = ResultStatus.SUCCESS.name
+                entry['productId'] = product_id
+                entry['warnings'].append(UPDATED_PRODUCT_WARNING.format(entry['handle']))
+                update_entries.append(entry)
+        if len(create_entries) < len(entries):
+            logging.info('Found existing products. JobId: %s, Products: %s, Existing: %s', self._job_id, len(entries), len(entries) - len(create_entries))
+        return create_entries, update_entries
+
+
+    async def __put_shopify_products(self, entries, session, operation):
+        # The products stay encoded as they were read from the sendable file,
+        # only their resolved collections, and the id of an updated product,
+        # are spliced in
+        items = []
+        extra_variants = {}
+        for entry in entries:
+            collection_ids = None
+            if 'collectionsToJoin' in entry:
+                await self._collection_resolver.apply(entry, entry['warnings'])
+                collection_ids = entry['collectionsToJoin']
+            items.append((encode_product(entry['product'], collection_ids, entry.get('productId')), entry['id'], [], entry['warnings']))
+            if 'extraVariants' in entry:
+                extra_variants[entry['id']] = entry['extraVariants']
+        await self.__create_shopify_products(items, session, operation, extra_variants)
+
+
+    async def __create_shopify_products(self, items, session, operation='productCreate', extra_variants=None):
+        product_items = [product_item for product_item, _, _, _ in items]
+        request = self._data_access.create_shopify_products
+        alias_prefix = PRODUCT_CREATE_ALIAS_PREFIX
+        if operation == 'productUpdate':
+            request = self._data_access.update_shopify_products
+            alias_prefix = PRODUCT_UPDATE_ALIAS_PREFIX
+        response = None
+        try:
+            # the products are claimed once the request is admitted, so products
+            # still queued when the invocation ends are not taken as sent
+            response = await self.__send_shopify_request(operation, request, product_items, session, len(product_items), lambda: self.__claim_products(items))
+        except ShopifyUnauthorizedError as error:
+            logging.exception(str(error))
+            raise ShopifyUnauthorizedError(error)
+        except ShopifyRetryableError as error:
+            # a gateway error may come after the products were created
+            logging.error('Shopify did not answer a product mutation. JobId: %s, Products: %s, Error: %s', self._job_id, [counter for _, counter, _, _ in items], str(error))
+            self.__put_failed_results(items, UNANSWERED_PRODUCT_ERROR)
+        except (DataAccessError, Exception) as error:
+            logging.exception('An Error occured whiles creating shopify products. Details are JobId: %s, Products: %s, Error: %s', self._job_id, [counter for _, counter, _, _ in items], str(error))
+            self.__put_failed_results(items, REQUEST_FAILED_ERROR)
         else:
-            logging.error('An Unknown error occured whiles creating product on shopify. Response Details: %s', response)
-            result = ResultStatus.FAILED.name
-        return {
-            'result': result,
-            'product': product
-        }     
+            if is_throttled(response):
+                logging.error('Shopify products were still throttled after retrying. JobId: %s, Products: %s', self._job_id, len(items))
+                self.__put_failed_results(items, THROTTLED_PRODUCT_ERROR)
+                return
 
+            if 'errors' in response and response.get('data') is None and len(items) > 1:
+                # A document level error, e.g. one product failing input validation,
+                # rejects every product in the request so they are retried one by one
+                logging.warning('Retrying products separately after a graphql error. JobId: %s, Error: %s', self._job_id, response['errors'])
+                await asyncio.gather(*[self.__create_shopify_products([item], session, operation, extra_variants) for item in items])
+                return
 
-    def __get_shopify_user_errors(self, user_errors):
+            variant_tasks = []
+            for i, (product_item, counter, errors, warnings) in enumerate(items):
+                product_result = check_product_result(product_item, response, errors, alias_prefix + str(i))
+                variants = (extra_variants or {}).get(counter)
+                if variants is not None and product_result['result'] == ResultStatus.SUCCESS.name:
+                    variant_tasks.append(self.__add_variants(product_result['product'], variants, counter, warnings, session))
+                else:
+                    self.__put_result(product_result['product'], product_result['result'], errors, warnings, counter)
+            await asyncio.gather(*variant_tasks)
+
+
+    async def __add_variants(self, product, variants, result_id, warnings, session):
+        # The variants a product has beyond what productCreate took are added
+        # to it in concurrent productVariantsBulkCreate requests. A product
+        # missing variants fails, its result keeps the id of the product that
+        # exists on the store so a replay never creates it again.
+        size = self._variants_per_request
+        chunks = [variants[i: i + size] for i in range(0, len(variants), size)]
+        responses = await asyncio.gather(*[
+            self.__send_shopify_request('productVariantsBulkCreate', self._data_access.create_shopify_variants, (product['id'], chunk), session)
+            for chunk in chunks
+        ], return_exceptions=True)
+        first_variant = int(os.environ.get('product_create_variants', PRODUCT_CREATE_VARIANTS)) + 1
         errors = []
-        for error in user_errors:
-            field = ''
-            for name in error['field']:
-                field += str(name) + ' '
+        for i, response in enumerate(responses):
+            if isinstance(response, ShopifyUnauthorizedError):
+                raise response
+            error = get_variants_error(response)
+            if error is not None:
+                start = first_variant + i * size
+                logging.error('Variants could not be added to a product. JobId: %s, Product: %s, Error: %s', self._job_id, result_id, error)
+                errors.append(VARIANTS_FAILED_ERROR.format(start, start + len(chunks[i]) - 1, error))
+        status = ResultStatus.FAILED.name if len(errors) > 0 else ResultStatus.SUCCESS.name
+        self.__put_result(product, status, errors, warnings, result_id)
 
-            message = error['message']
-            error_message = field.strip() + ': ' + message
-            errors.append(error_message)
-        return errors
 
+    def __put_failed_results(self, items, error):
+        for product_item, counter, errors, warnings in items:
+            errors.append(error)
+            self.__put_result(product_item, ResultStatus.FAILED.name, errors, warnings, counter)
 
-    def __put_result(self, product_item, status, errors, warnings, result_id):
-        try:
-            product_result = {
-                'id': str(result_id),
-                'job_id': self._job_id,
-                'data': json.dumps(product_item),
-                'status': status,
-            }
-            job = {
-                'id': self._job_id,
-                'user_id': self._user_id
-            }
-            if len(errors) > 0: product_result['errors'] = json.dumps(errors)
-            if len(warnings) > 0: product_result['warnings'] = json.dumps(warnings)
-            self._data_access.add_result_transaction(product_result, job)
-        except Exception as error:
-            logging.error('An error occured whiles adding product result to database. Details: %s', str(error))
+
+    async def __claim_products(self, items):
+        # The result item of a product, keyed by job and result id, is its
+        # idempotency key: it is claimed before the product is sent and
+        # overwritten by the product's result
+        claims = [{
+            'id': str(counter),
+            'job_id': self._job_id,
+            'data': '{}',
+            'status': RESULT_CLAIM_STATUS
+        } for _, counter, _, _ in items]
+        await self._async_data_access.batch_put_results(claims)
 
 
-    async def __get_collection_id(self, input, get_type, session):
+    async def __send_shopify_request(self, operation, request, request_input, session, units=1, before_send=None):
+        return await send_shopify_request(self._scheduler, operation, lambda: request(request_input, self._domain, self._access_token, session), units, self._metrics, before_send)
+
+
+    def __put_result(self, product_item, status, errors, warnings, result_id):
         try:
-            response = None
-            if get_type == 'ID':
-                response = await self._data_access.get_collection_by_id(input, self._domain, self._access_token, session)
-                if response['data']['collection'] is not None:
-                    return response['data']['collection']['id']
-                else:
-                    return 'ID_NOT_FOUND'
-            elif get_type == 'NAME':
-                response = await self._data_access.search_collection_by_name(input, self._domain, self._access_token, session)
-                if len(response['data']['collections']['edges']) > 0:
-                    return response['data']['collections']['edges'][0]['node']['id']
-                else:
-                    return 'NAME_NOT_FOUND'
+            product_result = get_product_result(self._job_id, product_item, status, errors, warnings, result_id, self._file_key)
+            result_sink = [sink for sink in self._result_sinks if sink.contains(result_id)][0]
+            result_sink.add(product_result)
         except Exception as error:
-            logging.exception('Failed to get Collection name. Details, Job Id: %s, Input: %s, Error: %s', self._job_id, input, str(error))     
-            return None             
-
-    async def __modify_product(self, product, warnings, session):
-        collections = product['collectionsToJoin']
-        valid_collections = []
-        entity_type = 'Collection'
-        get_type = ''
-
-        for col in collections:
-            value = col
-            if utils.is_id(col):
-                get_type = 'ID'
-                value = utils.get_gid(col, entity_type)
-            elif utils.is_gid(col, get_type):
-                get_type = 'ID'
-            else:
-                get_type = 'NAME'
-
-            collection_id = await self.__get_collection_id(value, get_type, session)
-            if collection_id is None:
-                message = 'Could not find Collection ' + col + '.'
-                warnings.append(message)
-            elif collection_id == 'ID_NOT_FOUND':
-                message = 'Collection with Id ' + col + ', was not found.'
-                warnings.append(message)
-            elif collection_id == 'ID_NOT_FOUND':
-                message = 'Collection with name ' + col + ', was not found.'
-                warnings.append(message)
-            else:
-                valid_collections.append(collection_id)
-        
-        product['collectionsToJoin'] = valid_collections
+            logging.error('An error occured whiles adding product result to database. Details: %s', str(error))
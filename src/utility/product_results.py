@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import zlib
+from datamodel.custom_enums import ResultStatus
+from utility.product_file_reader import ProductFileReader
+
+
+RESULT_REFERENCE_KEY = 'ref'
+
+
+def check_product_result(product, response, errors, alias):
+    result = None
+    product_response = None
+    if response is not None and response.get('data') is not None:
+        product_response = response['data'].get(alias)
+
+    if response is None:
+        errors.append('An issue occured whiles creating the product.')
+        result = ResultStatus.FAILED.name
+    elif product_response is None:
+        logging.error('A graphql syntax error occured whiles creating product. Product Details: %s, Error: %s', product, response.get('errors'))
+        errors.append('An issue occured whiles creating the product.')
+        result = ResultStatus.FAILED.name
+    elif product_response['product'] is None:
+        user_errors = product_response['userErrors']
+        error_messages = get_shopify_user_errors(user_errors)
+        errors.extend(error_messages)
+        result = ResultStatus.FAILED.name
+    elif product_response['product'] is not None:
+        product = product_response['product']
+        result = ResultStatus.SUCCESS.name
+    else:
+        logging.error('An Unknown error occured whiles creating product on shopify. Response Details: %s', response)
+        result = ResultStatus.FAILED.name
+    return {
+        'result': result,
+        'product': product
+    }
+
+
+def get_variants_error(response):
+    """Returns why a productVariantsBulkCreate request failed, None when its variants were added."""
+    if isinstance(response, Exception) or response is None:
+        return 'An issue occured whiles adding the variants.'
+    variants_response = (response.get('data') or {}).get('productVariantsBulkCreate')
+    if variants_response is None:
+        return 'An issue occured whiles adding the variants.'
+    if len(variants_response['userErrors']) > 0:
+        return ' '.join(get_shopify_user_errors(variants_response['userErrors']))
+    return None
+
+
+def get_shopify_user_errors(user_errors):
+    errors = []
+    for error in user_errors:
+        field = ''
+        for name in error['field'] or []:
+            field += str(name) + ' '
+
+        message = error['message']
+        error_message = field.strip() + ': ' + message
+        errors.append(error_message)
+    return errors
+
+
+def get_product_result(job_id, product_item, status, errors, warnings, result_id, file_key=None):
+    product_result = {
+        'id': str(result_id),
+        'job_id': job_id,
+        'data': get_result_data(product_item, status, result_id, file_key),
+        'status': status,
+    }
+    if len(errors) > 0: product_result['errors'] = json.dumps(errors)
+    if len(warnings) > 0: product_result['warnings'] = json.dumps(warnings)
+    return product_result
+
+
+def get_result_data(product_item, status, result_id, file_key=None):
+    """
+    Returns the data stored with a product result. Result ids are positions
+    in the prepared products file, so by default the data only refers to the
+    product in file_key, plus the shopify id of a created product, also of
+    one that failed after it was created, and
+    read_result_data rehydrates it. With result_data_format set to full the
+    whole product is stored, zlib compressed when result_data_compression
+    is set to zlib.
+    """
+    if file_key is not None and os.environ.get('result_data_format', 'reference') == 'reference':
+        data = {RESULT_REFERENCE_KEY: {'file_key': file_key, 'index': int(result_id) - 1}}
+        if isinstance(product_item, dict) and product_item.get('id') is not None:
+            data['product_id'] = product_item['id']
+        return json.dumps(data, separators=(',', ':'))
+
+    if isinstance(product_item, (bytes, memoryview)):
+        # products read from the sendable file are already encoded
+        data = bytes(product_item).decode('utf-8')
+    else:
+        data = json.dumps(product_item, separators=(',', ':'))
+    if os.environ.get('result_data_compression') == 'zlib':
+        return zlib.compress(data.encode('utf-8'))
+    return data
+
+
+def get_result_product_id(data):
+    """Returns the shopify id of the product a result's data attribute was created as, None when it was not created."""
+    if data is None:
+        return None
+    data = getattr(data, 'value', data)
+    if isinstance(data, (bytes, bytearray)):
+        data = zlib.decompress(data).decode('utf-8')
+    result_data = json.loads(data)
+    if not isinstance(result_data, dict):
+        return None
+    if RESULT_REFERENCE_KEY in result_data:
+        return result_data.get('product_id')
+    return result_data.get('id')
+
+
+def read_result_data(data, data_access, product_readers=None):
+    """
+    Returns the full product of a result's data attribute, reading a
+    referenced product from its prepared products file. Pass the same
+    product_readers dict when reading many results so every file's index is
+    loaded once.
+    """
+    data = getattr(data, 'value', data)
+    if isinstance(data, (bytes, bytearray)):
+        data = zlib.decompress(data).decode('utf-8')
+    result_data = json.loads(data)
+    if not isinstance(result_data, dict) or RESULT_REFERENCE_KEY not in result_data:
+        return result_data
+
+    reference = result_data[RESULT_REFERENCE_KEY]
+    product_readers = product_readers if product_readers is not None else {}
+    product_reader = product_readers.get(reference['file_key'])
+    if product_reader is None:
+        product_reader = ProductFileReader(reference['file_key'], data_access).load()
+        product_readers[reference['file_key']] = product_reader
+    product = product_reader.read(reference['index'], reference['index'])[0]
+    if 'product_id' in result_data:
+        product['id'] = result_data['product_id']
+    return product
@@ -0,0 +1,28 @@
+import os
+
+
+# shopify's limit of variants per product in the pinned api version, 2021-07,
+# raise it with max_product_variants together with the api version
+MAX_PRODUCT_VARIANTS = 100
+MAX_PRODUCT_COLLECTIONS = 4
+
+
+def validate_product(product):
+    """
+    Removes the fields the product generator adds for its own use from a
+    prepared product and returns the product's errors and warnings.
+    """
+    if 'option1Name' in product: del product['option1Name']
+    if 'option2Name' in product: del product['option2Name']
+    if 'option3Name' in product: del product['option3Name']
+    if 'variantTitles' in product: del product['variantTitles']
+    errors = product['errors']
+    warnings = product['warnings']
+    del product['errors']
+    del product['warnings']
+    max_variants = int(os.environ.get('max_product_variants', MAX_PRODUCT_VARIANTS))
+    if len(product['variants']) > max_variants:
+        errors.append('The number of product variants for this product exceeds the shopify limit of ' + str(max_variants) + ' variants')
+    if 'collectionsToJoin' in product and len(product['collectionsToJoin']) > MAX_PRODUCT_COLLECTIONS:
+        errors.append('Maximum Collections to add a product to cannot is limited to 4')
+    return errors, warnings
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from utility.metrics import COUNT
+from utility import shopify_connection
+
+
+DEFAULT_INTERVAL = 10
+DEFAULT_THRESHOLD = 60
+DEFAULT_PREFIX = 'profiles/'
+
+
+class SamplingProfiler:
+    """
+    Class to take a sampling profile of an invocation. A daemon thread wakes
+    every interval, counts the stack of every other thread in the folded
+    format flamegraph tools read, and posts a callback to the shopify event
+    loop to measure how late the loop runs it. Nothing is traced between
+    samples, so the overhead does not depend on the code being profiled.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL / 1000):
+        self._interval = interval
+        self._stacks = Counter()
+        self._loop_lags = []
+        self._probe_pending = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start = None
+        self._end = None
+
+
+    @property
+    def duration(self):
+        return (self._end or time.perf_counter()) - self._start
+
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self.__sample, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self._end = time.perf_counter()
+
+
+    def get_folded_stacks(self):
+        return ''.join(stack + ' ' + str(count) + '\n' for stack, count in self._stacks.most_common())
+
+
+    def get_loop_lag(self):
+        """Returns the sample count and the median, p99 and maximum lag of the event loop in milliseconds."""
+        lags = sorted(self._loop_lags)
+        if len(lags) == 0:
+            return {'samples': 0}
+        return {
+            'samples': len(lags),
+            'p50': lags[len(lags) // 2],
+            'p99': lags[min(len(lags) - 1, int(len(lags) * 0.99))],
+            'max': lags[-1]
+        }
+
+
+    def __sample(self):
+        names = {}
+        while not self._stopped.wait(self._interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + ')')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.__probe_loop()
+
+
+    def __probe_loop(self):
+        loop = shopify_connection.get_event_loop()
+        if self._probe_pending or loop is None or not loop.is_running():
+            return
+        # a stalled loop gets one probe, whose lag covers the whole stall
+        self._probe_pending = True
+        try:
+            loop.call_soon_threadsafe(self.__record_loop_lag, time.perf_counter())
+        except RuntimeError:
+            self._probe_pending = False
+
+
+    def __record_loop_lag(self, posted):
+        self._loop_lags.append((time.perf_counter() - posted) * 1000)
+        self._probe_pending = False
+
+
+def start_profiler():
+    """Starts a SamplingProfiler when profile_enabled is true, otherwise returns None."""
+    if os.environ.get('profile_enabled', 'false').lower() != 'true':
+        return None
+    return SamplingProfiler(float(os.environ.get('profile_interval', DEFAULT_INTERVAL)) / 1000).start()
+
+
+def finish_profiler(profiler, name, data_access, metrics):
+    """
+    Stops the profiler and records the loop lag. When the invocation took at
+    least profile_threshold seconds, its folded stacks and a summary are
+    written as name.folded and name.json under profile_prefix in the
+    profile_bucket, or to profile_dir when it is set.
+    """
+    profiler.stop()
+    loop_lag = profiler.get_loop_lag()
+    if loop_lag['samples'] > 0:
+        metrics.put('LoopLagP99', loop_lag['p99'])
+        metrics.put('LoopLagMax', loop_lag['max'])
+    if profiler.duration < float(os.environ.get('profile_threshold', DEFAULT_THRESHOLD)):
+        return
+
+    summary = json.dumps({'name': name, 'duration': profiler.duration, 'loop_lag': loop_lag})
+    folded_stacks = profiler.get_folded_stacks()
+    try:
+        profile_dir = os.environ.get('profile_dir')
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+            with open(os.path.join(profile_dir, name + '.folded'), 'w') as profile_file:
+                profile_file.write(folded_stacks)
+            with open(os.path.join(profile_dir, name + '.json'), 'w') as summary_file:
+                summary_file.write(summary)
+        else:
+            prefix = os.environ.get('profile_prefix', DEFAULT_PREFIX)
+            data_access.put_profile(prefix + name + '.folded', folded_stacks.encode('utf-8'))
+            data_access.put_profile(prefix + name + '.json', summary.encode('utf-8'), 'application/json')
+        metrics.put('ProfileWritten', 1, COUNT)
+        logging.info('Wrote invocation profile. Name: %s, Duration: %s, Loop lag: %s', name, profiler.duration, loop_lag)
+    except Exception as error:
+        logging.error('An error occured whiles writing the invocation profile. Name: %s, Error: %s', name, str(error))
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import random
+import time
+
+
+MAX_CONTENTION_DELAY = 0.05
+ACTIVE_JOB_TIMEOUT = 10
+USAGE_HALF_LIFE = 5
+CONTENDED_FRACTION = 0.5
+SMALL_JOB_PRODUCTS = 1000
+SMALL_JOB_WEIGHT = 4
+MAX_RELEASE_ATTEMPTS = 5
+DEFAULT_LEASE_SECONDS = 2
+
+
+def get_job_weight(remaining_products):
+    """Returns the share weight of a job, jobs with few products left get a larger share."""
+    if remaining_products <= int(os.environ.get('rate_budget_small_job', SMALL_JOB_PRODUCTS)):
+        return float(os.environ.get('rate_budget_small_job_weight', SMALL_JOB_WEIGHT))
+    return 1
+
+
+def lease_rate_budget(state, job_id, weight, cost, amount, maximum_available, restore_rate, now):
+    """
+    Leases tokens of a shop's budget to a job. Returns the granted tokens,
+    at least cost or 0, the seconds to wait before asking again when nothing
+    was granted and the new state to write when something was.
+
+    The state holds the shop's tokens, which refill at the restore rate, and
+    the weight and recent usage of every job that leased from it. Usage
+    decays with a half life of a few seconds and a job that has not leased
+    for a while no longer counts as active. While more than one job is
+    active and the bucket is below half full, a job whose usage is above its
+    weighted share waits for the others, otherwise any job takes what is
+    there so the bucket is never left to fill up.
+    """
+    if state is None:
+        available = maximum_available
+        jobs = {}
+    else:
+        elapsed = max(0, now - state['updated_at'])
+        available = min(maximum_available, state['tokens'] + elapsed * restore_rate)
+        decay = 0.5 ** (elapsed / USAGE_HALF_LIFE)
+        jobs = {
+            other_id: dict(job, used=job['used'] * decay)
+            for other_id, job in state['jobs'].items()
+            if other_id == job_id or now - job['seen'] < ACTIVE_JOB_TIMEOUT
+        }
+    job = jobs.setdefault(job_id, {'used': 0})
+    job['weight'] = weight
+    job['seen'] = now
+
+    share = weight / sum(other['weight'] for other in jobs.values())
+    total_used = sum(other['used'] for other in jobs.values())
+    contended = len(jobs) > 1 and available < maximum_available * CONTENDED_FRACTION
+    if contended and job['used'] > share * total_used:
+        return 0, cost / restore_rate, None
+    if available < cost:
+        return 0, (cost - available) / restore_rate, None
+
+    granted = min(amount, available)
+    if contended:
+        # a large lease would hold back tokens the other jobs are waiting for
+        granted = max(cost, min(granted, share * available))
+    job['used'] += granted
+    return granted, 0, {'tokens': available - granted, 'updated_at': now, 'jobs': jobs}
+
+
+def return_rate_budget(state, job_id, tokens, maximum_available, restore_rate, now):
+    """Returns the state after a job gave back its unspent tokens and stopped leasing."""
+    elapsed = max(0, now - state['updated_at'])
+    jobs = {other_id: job for other_id, job in state['jobs'].items() if other_id != job_id}
+    decay = 0.5 ** (elapsed / USAGE_HALF_LIFE)
+    return {
+        'tokens': min(maximum_available, state['tokens'] + elapsed * restore_rate + tokens),
+        'updated_at': now,
+        'jobs': {other_id: dict(job, used=job['used'] * decay) for other_id, job in jobs.items()}
+    }
+
+
+class RateBudget:
+    """
+    Class for sharing a shop's query cost budget between the jobs importing
+    into it.
+
+    The budget is a token bucket keyed by shop domain that refills at the
+    shop's restore rate, so concurrent jobs, whether of one user or of
+    several, and the workers of a sharded job together never spend more
+    than shopify restores. The store is the BulkManager table through
+    DataAccess, or anything with the same get_rate_budget and
+    put_rate_budget methods. Tokens are leased to the jobs by their weighted
+    fair share, see lease_rate_budget, in blocks of rate_budget_lease_seconds
+    of the shop's restore rate, but at least rate_budget_lease tokens, that
+    are spent locally. A worker therefore calls the database about once
+    every few seconds however many requests it sends, and only one lease of
+    a worker is in flight at a time. Tokens refunded by cheaper than
+    estimated requests stay in the worker's lease until release gives them
+    back.
+    """
+
+    def __init__(self, domain, job_id, store, weight=1, lease_size=None, clock=time.time):
+        if lease_size is None:
+            lease_size = float(os.environ.get('rate_budget_lease', 100))
+        self._domain = domain
+        self._job_id = job_id
+        self._store = store
+        self._lease_size = lease_size
+        self._lease_seconds = float(os.environ.get('rate_budget_lease_seconds', DEFAULT_LEASE_SECONDS))
+        self._clock = clock
+        self._lease_lock = asyncio.Lock()
+        self._leased = 0
+        self._maximum_available = None
+        self._restore_rate = None
+        self.weight = weight
+
+
+    async def take(self, cost, maximum_available, restore_rate):
+        loop = asyncio.get_running_loop()
+        self._maximum_available = maximum_available
+        self._restore_rate = restore_rate
+        # a request can never cost more than the shop's bucket holds
+        cost = min(cost, maximum_available)
+        while self._leased < cost:
+            async with self._lease_lock:
+                # the lease another request waited for may already cover this one
+                if self._leased >= cost:
+                    break
+                needed = cost - self._leased
+                amount = min(maximum_available, max(needed, self._lease_size, restore_rate * self._lease_seconds))
+                granted, delay = await loop.run_in_executor(None, self.__lease, needed, amount, maximum_available, restore_rate)
+                self._leased += granted
+                if granted == 0:
+                    await asyncio.sleep(delay)
+        self._leased -= cost
+
+
+    def refund(self, amount):
+        if amount > 0:
+            self._leased += amount
+
+
+    def release(self):
+        """Gives the unspent lease back to the shop and stops counting the job as active."""
+        if self._restore_rate is None:
+            return
+        for _ in range(MAX_RELEASE_ATTEMPTS):
+            state = self._store.get_rate_budget(self._domain)
+            if state is None:
+                break
+            released = return_rate_budget(state, self._job_id, self._leased, self._maximum_available, self._restore_rate, self._clock())
+            if self._store.put_rate_budget(self._domain, released, state['updated_at']):
+                break
+        self._leased = 0
+        self._restore_rate = None
+
+
+    def __lease(self, cost, amount, maximum_available, restore_rate):
+        state = self._store.get_rate_budget(self._domain)
+        granted, delay, leased = lease_rate_budget(state, self._job_id, self.weight, cost, amount,
+                                                   maximum_available, restore_rate, self._clock())
+        if granted == 0:
+            return 0, delay
+        # the write is conditional on the state that was read, so concurrent
+        # workers never take the same tokens
+        if not self._store.put_rate_budget(self._domain, leased, None if state is None else state['updated_at']):
+            return 0, random.uniform(0, MAX_CONTENTION_DELAY)
+        return granted, 0
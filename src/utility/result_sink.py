@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import time
+from datamodel.custom_enums import ResultStatus
+from dataaccess.data_access import BATCH_WRITE_LIMIT
+from dataaccess.data_access import TRANSACT_WRITE_LIMIT
+
+
+class ResultSink:
+    """
+    Class to buffer product results and write them to the database in batches.
+
+    Results are grouped into fixed windows of result ids. Every full group of
+    results is written in the background as soon as it is available and each
+    window gets a single counter update once all of its results in the batch
+    range have been added, or when the sink is closed. The sink must be used
+    from a running event loop with an AsyncDataAccess. Sinks that write
+    different results of the same id range need different chunk prefixes.
+    With metrics, the latency of every write is recorded.
+    """
+
+    def __init__(self, data_access, job, start_id, end_id, window_size=50, chunk_prefix='', metrics=None):
+        self._data_access = data_access
+        self._metrics = metrics
+        self._job = job
+        self._chunk_prefix = chunk_prefix
+        self._start_id = start_id
+        self._end_id = end_id
+        self._window_size = window_size
+        self._windows = {}
+        self._tasks = set()
+
+
+    def contains(self, result_id):
+        return self._start_id <= int(result_id) <= self._end_id
+
+
+    def add(self, result):
+        window, state = self.__get_window(result['id'])
+        state['pending'].append(result)
+        if len(state['pending']) >= BATCH_WRITE_LIMIT:
+            self.__write_pending(state)
+        self.__count(window, state, result['status'])
+
+
+    def count(self, result_id, status):
+        """Counts a result that was written by an earlier attempt of the batch,
+        so its window is counted in full without writing the result again."""
+        window, state = self.__get_window(result_id)
+        self.__count(window, state, status)
+
+
+    async def drain(self):
+        """Waits for every write that has been started so far."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+
+    async def close(self):
+        for window in sorted(self._windows):
+            self.__schedule(self.__finish_window(window))
+        await self.drain()
+
+
+    def __get_window(self, result_id):
+        window = (int(result_id) - 1) // self._window_size
+        if window not in self._windows:
+            self._windows[window] = {'pending': [], 'writes': [], 'success': 0, 'failed': 0, 'write_failed': False}
+        return window, self._windows[window]
+
+
+    def __count(self, window, state, status):
+        if status == ResultStatus.SUCCESS.name:
+            state['success'] += 1
+        else:
+            state['failed'] += 1
+        if state['success'] + state['failed'] >= self.__get_window_size(window):
+            self.__schedule(self.__finish_window(window))
+
+
+    def __get_window_bounds(self, window):
+        window_start = max(window * self._window_size + 1, self._start_id)
+        window_end = min((window + 1) * self._window_size, self._end_id)
+        return window_start, window_end
+
+
+    def __get_window_size(self, window):
+        window_start, window_end = self.__get_window_bounds(window)
+        return window_end - window_start + 1
+
+
+    def __schedule(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+
+    def __write_pending(self, state):
+        if len(state['pending']) > 0:
+            state['writes'].append(self.__schedule(self.__put_results(state, state['pending'])))
+            state['pending'] = []
+
+
+    async def __put_results(self, state, results):
+        start = time.perf_counter()
+        try:
+            await self._data_access.batch_put_results(results)
+            self.__put_latency('ResultWriteLatency', start)
+        except Exception as error:
+            state['write_failed'] = True
+            logging.error('An error occured whiles adding product results to database. JobId: %s, Details: %s', self._job['id'], str(error))
+
+
+    async def __finish_window(self, window):
+        state = self._windows.pop(window, None)
+        if state is None:
+            return
+
+        self.__write_pending(state)
+        window_start, window_end = self.__get_window_bounds(window)
+        # ids are positional so the chunk id is the same when a batch is retried
+        chunk_id = self._chunk_prefix + str(window_start) + '-' + str(window_end)
+        await asyncio.gather(*[write for write in state['writes'] if not write.done()])
+        if state['write_failed']:
+            logging.error('Skipped result counts for chunk with failed writes. JobId: %s, Chunk: %s', self._job['id'], chunk_id)
+            return
+        start = time.perf_counter()
+        try:
+            await self._data_access.add_result_counts(self._job, state['success'], state['failed'], chunk_id)
+            self.__put_latency('ResultCountLatency', start)
+        except Exception as error:
+            logging.error('An error occured whiles adding result counts to database. JobId: %s, Chunk: %s, Details: %s', self._job['id'], chunk_id, str(error))
+
+
+    def __put_latency(self, name, start):
+        if self._metrics is not None:
+            self._metrics.put(name, (time.perf_counter() - start) * 1000)
+
+
+class ReplayResultSink:
+    """
+    Class to write the results of a replayed job in place.
+
+    Results are written in the background in groups that fit one transaction
+    together with the change they make to the job's counters, see
+    DataAccess.replace_results. Results that were counted by an earlier
+    attempt of the replay are neither written nor counted again, so counting
+    a result that is already written does nothing. It is used like a
+    ResultSink.
+    """
+
+    def __init__(self, data_access, job, start_id, end_id, metrics=None):
+        self._data_access = data_access
+        self._metrics = metrics
+        self._job = job
+        self._start_id = start_id
+        self._end_id = end_id
+        self._pending = []
+        self._tasks = set()
+
+
+    def contains(self, result_id):
+        return self._start_id <= int(result_id) <= self._end_id
+
+
+    def add(self, result):
+        self._pending.append(result)
+        if len(self._pending) >= TRANSACT_WRITE_LIMIT - 1:
+            self.__write_pending()
+
+
+    def count(self, result_id, status):
+        pass
+
+
+    async def drain(self):
+        """Waits for every write that has been started so far."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+
+    async def close(self):
+        self.__write_pending()
+        await self.drain()
+
+
+    def __write_pending(self):
+        if len(self._pending) > 0:
+            task = asyncio.ensure_future(self.__replace_results(self._pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self._pending = []
+
+
+    async def __replace_results(self, results):
+        start = time.perf_counter()
+        try:
+            await self._data_access.replace_results(self._job, results)
+            if self._metrics is not None:
+                self._metrics.put('ResultWriteLatency', (time.perf_counter() - start) * 1000)
+        except Exception as error:
+            logging.error('An error occured whiles replacing product results in database. JobId: %s, Details: %s', self._job['id'], str(error))
@@ -0,0 +1,105 @@
+import os
+import logging
+from utility import json_codec
+from datamodel.custom_enums import ResultStatus
+from utility.result_sink import ResultSink
+from utility.product_validator import validate_product
+from utility.product_results import get_product_result
+from utility.product_index import get_product_handle
+
+
+SENDABLE_FILE_SUFFIX = '.sendable.json'
+INVALID_CHUNK_PREFIX = 'invalid-'
+RESULT_WINDOW_SIZE = 50
+# products with more variants than one productCreate takes are split
+PRODUCT_CREATE_VARIANTS = 100
+PRODUCT_FIELD = b',"product":'
+
+
+def get_sendable_file_key(file_key):
+    return file_key + SENDABLE_FILE_SUFFIX
+
+
+async def write_sendable_products(product_reader, file_key, job, async_data_access, metrics=None, with_handles=False):
+    """
+    Validates every product of the job in one pass before anything is sent
+    to shopify. The invalid products are failed in bulk and the valid ones
+    are written, normalized, to the sendable file as a JSON array of
+    {id, warnings, collectionsToJoin, handle, extraVariants, product} entries that later
+    batches read instead of the prepared file. The handle is only written
+    with_handles, for jobs that look up existing products by it. The product is the last field of an
+    entry so read_sendable_entries can hand it on without parsing it.
+    Returns the content of the sendable file.
+
+    Running it again for the same job writes the same results, counts and
+    file, so an interrupted first batch can simply be retried.
+    """
+    products = product_reader.read(0, product_reader.count - 1)
+    result_sink = ResultSink(async_data_access, job, 1, max(1, len(products)), RESULT_WINDOW_SIZE, INVALID_CHUNK_PREFIX, metrics)
+    entries = []
+    for index, product in enumerate(products):
+        errors, warnings = validate_product(product)
+        if len(errors) > 0:
+            result_sink.add(get_product_result(job['id'], product, ResultStatus.FAILED.name, errors, warnings, index + 1, file_key))
+        else:
+            entries.append(encode_sendable_entry(index + 1, product, warnings, with_handles))
+    await result_sink.close()
+
+    content = b'[' + b',\n'.join(entries) + b']'
+    await async_data_access.put_product_file(get_sendable_file_key(file_key), content)
+    logging.info('Prevalidated products. JobId: %s, Products: %s, Sendable: %s', job['id'], len(products), len(entries))
+    return content
+
+
+def encode_sendable_entry(result_id, product, warnings, with_handles=False):
+    """
+    Returns the encoded sendable entry of a valid product. The product keeps
+    the variants one productCreate takes, the rest are kept as the entry's
+    extraVariants and added once the product exists.
+    """
+    entry = {'id': result_id, 'warnings': warnings}
+    # collections are resolved per batch, so they are kept out of the encoded product
+    if 'collectionsToJoin' in product:
+        entry['collectionsToJoin'] = product.pop('collectionsToJoin')
+    if with_handles:
+        entry['handle'] = get_product_handle(product)
+    create_variants = int(os.environ.get('product_create_variants', PRODUCT_CREATE_VARIANTS))
+    variants = product.get('variants') or []
+    if len(variants) > create_variants:
+        entry['extraVariants'] = variants[create_variants:]
+        product['variants'] = variants[:create_variants]
+    entry['product'] = product
+    return json_codec.dumps(entry)
+
+
+def read_sendable_entries(sendable_reader, start_index, end_index):
+    """
+    Returns the entries of the sendable file from start_index to end_index,
+    both inclusive. Only the id, warnings, collections and handle of an
+    entry, and its extra variants, are parsed, its product is a memoryview over the encoded product
+    in the buffer that was read.
+    """
+    content, spans = sendable_reader.read_spans(start_index, end_index)
+    view = memoryview(content)
+    entries = []
+    for start, end in spans:
+        # quotes are escaped inside JSON strings, so the first match is the product field
+        product_start = content.find(PRODUCT_FIELD, start, end)
+        entry = json_codec.loads(content[start:product_start] + b'}')
+        entry['product'] = view[product_start + len(PRODUCT_FIELD):end - 1]
+        entries.append(entry)
+    return entries
+
+
+def encode_product(product, collection_ids=None, product_id=None):
+    """Returns the encoded product with its resolved collections, and the id of the product it updates, added to it."""
+    fields = []
+    if product_id is not None:
+        fields.append(b'"id":' + json_codec.dumps(product_id))
+    if collection_ids is not None:
+        fields.append(b'"collectionsToJoin":' + json_codec.dumps(collection_ids))
+    if len(fields) == 0:
+        return product
+    if len(product) == 2:
+        return b'{' + b','.join(fields) + b'}'
+    return b''.join([product[:-1], b',', b','.join(fields), b'}'])
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import aiohttp
+from utility.cost_scheduler import CostScheduler
+from utility.rate_budget import RateBudget
+
+
+# The event loop and everything bound to it live for the lifetime of the
+# lambda container so warm invocations reuse open connections to the shop
+# and what the scheduler has learned about the shop's cost bucket
+_event_loop = None
+_sessions = {}
+_schedulers = {}
+_budgets = {}
+
+
+def run(coroutine):
+    global _event_loop
+    if _event_loop is None or _event_loop.is_closed():
+        _event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_event_loop)
+        _sessions.clear()
+        _schedulers.clear()
+        _budgets.clear()
+    return _event_loop.run_until_complete(coroutine)
+
+
+def get_event_loop():
+    return _event_loop
+
+
+async def get_session(domain):
+    session = _sessions.get(domain)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=int(os.environ.get('shopify_max_concurrency', 50)),
+            keepalive_timeout=float(os.environ.get('shopify_keepalive_timeout', 30)),
+            ttl_dns_cache=int(os.environ.get('shopify_dns_cache_ttl', 300))
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[domain] = session
+    return session
+
+
+def close_sessions():
+    """Closes the session of every shop, their connections are bound to the event loop."""
+    sessions = [session for session in _sessions.values() if not session.closed]
+    _sessions.clear()
+    if len(sessions) > 0 and _event_loop is not None and not _event_loop.is_closed():
+        _event_loop.run_until_complete(_close_all(sessions))
+
+
+async def _close_all(sessions):
+    await asyncio.gather(*(session.close() for session in sessions))
+
+
+def get_scheduler(domain):
+    scheduler = _schedulers.get(domain)
+    if scheduler is None:
+        scheduler = CostScheduler(
+            max_in_flight=int(os.environ.get('shopify_max_concurrency', 50)),
+            initial_in_flight=int(os.environ.get('shopify_initial_concurrency', 10))
+        )
+        _schedulers[domain] = scheduler
+    return scheduler
+
+
+def get_rate_budget(domain, job_id, data_access):
+    budget = _budgets.get((domain, job_id))
+    if budget is None:
+        budget = RateBudget(domain, job_id, data_access)
+        _budgets[(domain, job_id)] = budget
+    return budget
+
+
+def release_rate_budget(domain, job_id):
+    budget = _budgets.pop((domain, job_id), None)
+    if budget is not None:
+        budget.release()
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from http import HTTPStatus
+from dataaccess.data_access import ShopifyRetryableError
+from utility.cost_scheduler import is_throttled
+from dataaccess.shopify_queries import is_mutation
+from utility.metrics import COUNT
+from utility.metrics import NONE
+
+
+BASE_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30
+
+
+async def send_shopify_request(scheduler, operation, send, units=1, metrics=None, before_send=None):
+    """
+    Sends a shopify request through the scheduler and sends it again when
+    shopify answers THROTTLED or 429, i.e. when the request never ran. Reads
+    are sent again after a gateway error as well, while a mutation may have
+    run before the gateway gave up on it, so its error is raised for the
+    caller to handle. Returns the last response, or raises the last error, once
+    shopify_max_throttled_retries retries of throttled requests or
+    shopify_max_retries retries of failed requests are used up. Throttling
+    is expected while the shop's bucket is shared, so it has the larger limit.
+
+    A throttled request gives its cost back to the scheduler, whose bucket is
+    corrected by the response's throttleStatus, so the next attempt is only
+    admitted once the shop has restored its cost. As other apps may be using
+    the same bucket, the retry also waits an exponential delay that starts at
+    the time the shop needs to restore the request's cost, jittered so that
+    requests throttled together do not return together, or the Retry-After
+    delay of a 429.
+
+    With metrics, the time spent waiting for admission, the latency, query
+    cost and throttling of every attempt and the retry delays are recorded.
+
+    before_send is awaited once, after the first attempt is admitted and right
+    before it goes out, e.g. to claim the products a mutation creates only
+    when the request is really sent.
+    """
+    max_retries = int(os.environ.get('shopify_max_retries', 5))
+    max_throttled_retries = int(os.environ.get('shopify_max_throttled_retries', 20))
+    retries = 0
+    throttled_retries = 0
+    prepared = before_send is None
+    while True:
+        cost = scheduler.estimate_cost(operation, units)
+        start = time.perf_counter()
+        ticket = await scheduler.acquire(cost)
+        sent = time.perf_counter()
+        response = None
+        retry_after = None
+        try:
+            if not prepared:
+                await before_send()
+                prepared = True
+            response = await send()
+        except ShopifyRetryableError as error:
+            scheduler.release(operation, cost, None, units, ticket, throttled=True)
+            put_request_metrics(metrics, start, sent, None, True)
+            if error.status == HTTPStatus.TOO_MANY_REQUESTS:
+                if throttled_retries >= max_throttled_retries:
+                    raise
+                throttled_retries += 1
+            else:
+                if is_mutation(operation) or retries >= max_retries:
+                    raise
+                retries += 1
+            logging.warning('Retrying shopify request. Operation: %s, Attempt: %s, Error: %s', operation, retries + throttled_retries, str(error))
+            retry_after = error.retry_after
+        except BaseException:
+            scheduler.release(operation, cost, None, units, ticket)
+            raise
+        else:
+            scheduler.release(operation, cost, response, units, ticket)
+            put_request_metrics(metrics, start, sent, response, is_throttled(response))
+            if not is_throttled(response) or throttled_retries >= max_throttled_retries:
+                return response
+            throttled_retries += 1
+            logging.info('Requeued throttled shopify request. Operation: %s, Attempt: %s, Concurrency: %s', operation, retries + throttled_retries, scheduler.concurrency)
+
+        attempt = retries + throttled_retries - 1
+        delay = min(MAX_RETRY_DELAY, max(BASE_RETRY_DELAY, cost / scheduler.restore_rate) * (2 ** min(attempt, 10)))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if metrics is not None:
+            metrics.put('ShopifyRetryDelay', delay * 1000)
+        await asyncio.sleep(delay)
+
+
+def put_request_metrics(metrics, start, sent, response, throttled):
+    if metrics is None:
+        return
+    metrics.put('ShopifyAdmissionWait', (sent - start) * 1000)
+    metrics.put('ShopifyLatency', (time.perf_counter() - sent) * 1000)
+    metrics.put('ShopifyThrottled', 1 if throttled else 0, COUNT)
+    cost_info = None
+    if isinstance(response, dict) and 'extensions' in response:
+        cost_info = response['extensions'].get('cost')
+    if cost_info is not None:
+        metrics.put('ShopifyQueryCost', cost_info.get('actualQueryCost') or 0, NONE)
+        if cost_info.get('throttleStatus') is not None:
+            metrics.put('ShopifyCostAvailable', cost_info['throttleStatus']['currentlyAvailable'], NONE)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+
+# Benchmarks run as scripts (python -m tests.benchmark.<name>) so they put the
+# lambda source directory on the path the same way tests/conftest.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src'))
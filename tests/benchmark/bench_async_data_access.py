@@ -0,0 +1,76 @@
+"""
+Compares persisting product results inline from the shopify coroutines with
+the blocking DataAccess against the ResultSink on AsyncDataAccess.
+
+    python -m tests.benchmark.bench_async_data_access
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('bulk_manager_table', 'BulkManager')
+
+from tests.benchmark.stand_ins import LocalDynamoDB
+from dataaccess.data_access import DataAccess
+from dataaccess.async_data_access import AsyncDataAccess
+from utility.result_sink import ResultSink
+
+
+JOB = {'id': 'benchmark-job', 'user_id': 'benchmark-user'}
+CHUNK_SIZE = 50
+
+
+def get_result(result_id):
+    return {'id': str(result_id), 'job_id': JOB['id'], 'data': '{}', 'status': 'SUCCESS'}
+
+
+def get_data_access(dynamo_latency):
+    data_access = DataAccess()
+    data_access._dynamo_client = LocalDynamoDB(dynamo_latency)
+    return data_access
+
+
+async def run_inline(data_access, products, shopify_latency):
+    async def create(result_id):
+        await asyncio.sleep(shopify_latency)
+        data_access.add_result_transaction(get_result(result_id), JOB)
+
+    for start in range(1, products + 1, CHUNK_SIZE):
+        await asyncio.gather(*[create(i) for i in range(start, min(start + CHUNK_SIZE, products + 1))])
+
+
+async def run_async(data_access, products, shopify_latency):
+    async_data_access = AsyncDataAccess(data_access)
+    sink = ResultSink(async_data_access, JOB, 1, products, CHUNK_SIZE)
+
+    async def create(result_id):
+        await asyncio.sleep(shopify_latency)
+        sink.add(get_result(result_id))
+
+    for start in range(1, products + 1, CHUNK_SIZE):
+        await asyncio.gather(*[create(i) for i in range(start, min(start + CHUNK_SIZE, products + 1))])
+        await sink.drain()
+    await sink.close()
+    async_data_access.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--shopify-latency', type=float, default=0.25)
+    parser.add_argument('--dynamo-latency', type=float, default=0.01)
+    args = parser.parse_args()
+
+    for name, runner in (('inline', run_inline), ('async', run_async)):
+        data_access = get_data_access(args.dynamo_latency)
+        start = time.perf_counter()
+        asyncio.run(runner(data_access, args.products, args.shopify_latency))
+        elapsed = time.perf_counter() - start
+        print('%-7s products=%d elapsed=%.2fs products/sec=%.1f dynamodb_calls=%d' % (
+            name, args.products, elapsed, args.products / elapsed, sum(data_access._dynamo_client.calls.values())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Drives lambda_handler through whole jobs offline: moto stands in for the
+BulkManager table, the prepared products bucket and the SNS topic, whose
+messages are delivered to an SQS queue the harness feeds back into the
+handler, and the mock shopify server creates the products. Every file size
+runs in its own process so peak memory is measured per job.
+
+Reports products/sec, invocations per job, dynamodb calls and peak memory.
+Needs moto.
+
+    python -m tests.benchmark.bench_job --sizes 1000 10000 50000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ['bulk_manager_table'] = 'BulkManager'
+os.environ['prepared_products_bucket'] = 'prepared-products'
+os.environ['shopify_api_version'] = '2021-07'
+os.environ['shopify_scheme'] = 'http'
+
+RESULT_PREFIX = 'RESULT '
+JOB_ID = 'benchmark-job'
+USER_ID = 'benchmark-user'
+FILE_KEY = 'prepared/benchmark-job.json'
+
+
+class LambdaContext:
+    """Stand-in for the lambda context of an invocation with a fixed timeout"""
+
+    def __init__(self, timeout, request_id):
+        self.aws_request_id = request_id
+        self._deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+def get_products(count, variants):
+    return [{
+        'title': 'Product ' + str(i),
+        'descriptionHtml': '<p>Description of product ' + str(i) + '</p>',
+        'tags': ['benchmark', 'tag-' + str(i % 10)],
+        'variants': [{'price': '10.00', 'sku': 'SKU-' + str(i) + '-' + str(v)} for v in range(variants)],
+        'errors': [],
+        'warnings': []
+    } for i in range(count)]
+
+
+def create_resources(shopify, args):
+    import boto3
+    boto3.client('dynamodb').create_table(
+        TableName='BulkManager',
+        KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'PK', 'AttributeType': 'S'}, {'AttributeName': 'SK', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    table.put_item(Item={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID, 'input_products': FILE_KEY, 'type': 'CREATE', 'product_limit_exceeded': False})
+    table.put_item(Item={'PK': 'user#' + USER_ID, 'SK': 'user', 'domain': shopify.domain, 'access_token': 'token', 'active_job_count': 1})
+
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket='prepared-products', CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+    s3.put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(get_products(args.products, args.variants)))
+
+    # the SNS chain is delivered to a queue that the harness reads from
+    topic_arn = boto3.client('sns').create_topic(Name='ProductImportTopic')['TopicArn']
+    sqs = boto3.client('sqs')
+    queue_url = sqs.create_queue(QueueName='ProductImportQueue')['QueueUrl']
+    queue_arn = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+    boto3.client('sns').subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=queue_arn, Attributes={'RawMessageDelivery': 'true'})
+    os.environ['import_topic_arn'] = topic_arn
+    return table, queue_url
+
+
+def run_job(args):
+    import boto3
+    from moto import mock_aws
+    from tests.mocks.dynamodb_calls import DynamoDBCallCounter
+    from tests.mocks.shopify_server import MockShopifyServer
+
+    os.environ['batch_size'] = str(args.batch_size)
+    os.environ['invocation_safety_margin'] = str(args.safety_margin)
+    with mock_aws(), MockShopifyServer(latency=args.latency, maximum_available=args.maximum_available,
+                                       restore_rate=args.restore_rate, product_create_cost=args.product_create_cost,
+                                       background_cost_rate=args.background_cost_rate) as shopify:
+        table, queue_url = create_resources(shopify, args)
+        sqs = boto3.client('sqs')
+
+        import app
+        from utility import shopify_connection
+        invocations = 0
+        start = time.perf_counter()
+        messages = [json.dumps({'jobId': JOB_ID, 'userId': USER_ID})]
+        with DynamoDBCallCounter(app.get_data_access()) as counter:
+            try:
+                while len(messages) > 0:
+                    message = messages.pop(0)
+                    invocations += 1
+                    # the handler's EMF metric lines are not part of the report
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        app.lambda_handler({'Records': [{'Sns': {'Message': message}}]}, LambdaContext(args.timeout, str(invocations)))
+                    response = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)
+                    for received in response.get('Messages', []):
+                        messages.append(received['Body'])
+                        sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=received['ReceiptHandle'])
+            finally:
+                shopify_connection.close_sessions()
+        elapsed = time.perf_counter() - start
+
+        job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+        return {
+            'products': args.products,
+            'status': job.get('status'),
+            'created': len(shopify.products),
+            'failed': int(job.get('total_failed', 0)),
+            'elapsed': elapsed,
+            'products_per_second': args.products / elapsed,
+            'invocations': invocations,
+            'dynamodb_calls': sum(counter.calls.values()),
+            'throttled': shopify.throttled_requests,
+            # ru_maxrss is in kilobytes on linux
+            'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--products', type=int, help='runs a single job in this process')
+    parser.add_argument('--variants', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=120, help='simulated lambda timeout in seconds')
+    parser.add_argument('--safety-margin', type=float, default=10)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--maximum-available', type=float, default=20000)
+    parser.add_argument('--restore-rate', type=float, default=10000)
+    parser.add_argument('--product-create-cost', type=int, default=10)
+    parser.add_argument('--background-cost-rate', type=float, default=0)
+    args = parser.parse_args()
+
+    if args.products is not None:
+        print(RESULT_PREFIX + json.dumps(run_job(args)), flush=True)
+        return
+
+    # every size runs in a fresh process with the other arguments passed on
+    arguments = sys.argv[1:]
+    if '--sizes' in arguments:
+        index = arguments.index('--sizes')
+        arguments = arguments[:index] + arguments[index + 1 + len(args.sizes):]
+    for size in args.sizes:
+        output = subprocess.run([sys.executable, '-m', 'tests.benchmark.bench_job', '--products', str(size)] + arguments,
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads([line for line in output.splitlines() if line.startswith(RESULT_PREFIX)][-1][len(RESULT_PREFIX):])
+        print('products=%(products)d status=%(status)s created=%(created)d failed=%(failed)d elapsed=%(elapsed).1fs '
+              'products/sec=%(products_per_second).1f invocations=%(invocations)d dynamodb_calls=%(dynamodb_calls)d '
+              'throttled=%(throttled)d peak_memory=%(peak_memory_mb).0fMB' % result, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Compares building productCreate request bodies from parsed products, the way
+the processor did before, with splicing the encoded products of the sendable
+file into a pre-encoded request body with DataAccess.create_shopify_products,
+whose session only takes the body. Reports bytes/sec and time per product.
+
+    python -m tests.benchmark.bench_request_building
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ.setdefault('bulk_manager_table', 'BulkManager')
+os.environ.setdefault('shopify_api_version', '2021-07')
+
+from dataaccess.data_access import DataAccess
+from dataaccess.shopify_queries import PRODUCT_CREATE_ALIAS_PREFIX
+from dataaccess.shopify_queries import PRODUCT_MUTATION_SELECTION
+from utility import json_codec
+from utility.product_file_reader import ProductFileReader
+from utility.sendable_products import encode_product
+from utility.sendable_products import read_sendable_entries
+
+
+class LocalProductFiles:
+    """Stand-in for the data access of a ProductFileReader whose content is passed in"""
+
+    def get_product_file_index(self, file_key):
+        return None
+
+    def put_product_file_index(self, file_key, index):
+        pass
+
+
+class DiscardedResponse:
+    """Stand-in for an aiohttp response that answers every request with an empty result"""
+
+    status = 200
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def json(self):
+        return {}
+
+
+class DiscardingSession:
+    """Stand-in for the aiohttp session of a DataAccess that drops the bodies it is given"""
+
+    def post(self, url, data=None, headers=None):
+        return DiscardedResponse()
+
+
+def get_sendable_content(products, variants):
+    entries = []
+    for i in range(products):
+        product = {
+            'title': 'Product ' + str(i),
+            'descriptionHtml': '<p>Description of product ' + str(i) + '</p>' * 10,
+            'tags': ['tag-' + str(tag) for tag in range(10)],
+            'variants': [{'price': '10.00', 'sku': 'SKU-' + str(i) + '-' + str(v), 'options': ['Option ' + str(v)]} for v in range(variants)]
+        }
+        entries.append(json.dumps({'id': i + 1, 'warnings': [], 'product': product}, separators=(',', ':')))
+    return ('[' + ',\n'.join(entries) + ']').encode('utf-8')
+
+
+def build_parsed(reader, products, page_size, request_size):
+    # parses every page and serializes every request body again
+    for start in range(0, products, page_size):
+        content, spans = reader.read_spans(start, start + page_size - 1)
+        entries = json.loads(b'[' + content[spans[0][0]:spans[-1][1]] + b']')
+        for i in range(0, len(entries), request_size):
+            product_items = [entry['product'] for entry in entries[i: i + request_size]]
+            variable_definitions = []
+            mutations = []
+            variables = {}
+            for j, product_item in enumerate(product_items):
+                variable_definitions.append('$input' + str(j) + ': ProductInput!')
+                mutations.append(PRODUCT_CREATE_ALIAS_PREFIX + str(j) + ': productCreate(input: $input' + str(j) + ') { ' + PRODUCT_MUTATION_SELECTION + ' }')
+                variables['input' + str(j)] = product_item
+            query = 'mutation productCreate(' + ', '.join(variable_definitions) + ') {' + ' '.join(mutations) + '}'
+            json.dumps({'query': query, 'variables': variables}).encode('utf-8')
+
+
+def build_spliced(data_access, reader, products, page_size, request_size):
+    # only the entries' headers are parsed, the products are spliced in as they are
+    asyncio.run(send_spliced(data_access, DiscardingSession(), reader, products, page_size, request_size))
+
+
+async def send_spliced(data_access, session, reader, products, page_size, request_size):
+    for start in range(0, products, page_size):
+        entries = read_sendable_entries(reader, start, start + page_size - 1)
+        for i in range(0, len(entries), request_size):
+            product_items = [encode_product(entry['product']) for entry in entries[i: i + request_size]]
+            await data_access.create_shopify_products(product_items, 'benchmark.myshopify.com', 'benchmark', session)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--variants', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--request-size', type=int, default=10)
+    args = parser.parse_args()
+
+    content = get_sendable_content(args.products, args.variants)
+    reader = ProductFileReader('benchmark.sendable.json', LocalProductFiles()).load(content)
+    print('json backend: %s, file size: %.1f MB' % ('orjson' if json_codec.orjson is not None else 'json', len(content) / 1e6))
+    # the clients of the data access are created before the clock starts
+    data_access = DataAccess()
+    for name, build in (('parsed', build_parsed), ('spliced', functools.partial(build_spliced, data_access))):
+        start = time.perf_counter()
+        build(reader, args.products, args.page_size, args.request_size)
+        elapsed = time.perf_counter() - start
+        print('%-8s products=%d elapsed=%.3fs MB/sec=%.1f us/product=%.1f' % (
+            name, args.products, elapsed, len(content) / elapsed / 1e6, elapsed / args.products * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Runs the ProductProcessor against the mock shopify server while another app
+drains the shop's cost bucket and some requests fail with a 503, once without
+retries and once with the retry policy and adaptive concurrency. Needs moto.
+
+    python -m tests.benchmark.bench_shopify_throttling
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ['bulk_manager_table'] = 'BulkManager'
+os.environ['prepared_products_bucket'] = 'prepared-products'
+os.environ['shopify_api_version'] = '2021-07'
+os.environ['shopify_scheme'] = 'http'
+
+import boto3
+from moto import mock_aws
+
+from tests.mocks.shopify_server import MockShopifyServer
+from dataaccess.data_access import DataAccess
+from utility.product_file_reader import ProductFileReader
+from utility.product_processor import ProductProcessor
+from utility import shopify_connection
+
+
+FILE_KEY = 'prepared/benchmark.json'
+
+
+def create_tables(products):
+    boto3.client('dynamodb').create_table(
+        TableName='BulkManager',
+        KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'PK', 'AttributeType': 'S'}, {'AttributeName': 'SK', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket='prepared-products', CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+    items = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(products)]
+    s3.put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(items))
+
+
+def run(name, args, max_retries):
+    os.environ['shopify_max_retries'] = str(max_retries)
+    os.environ['shopify_max_throttled_retries'] = str(max_retries * 4)
+    os.environ['batch_size'] = str(args.products)
+    with mock_aws(), MockShopifyServer(latency=args.latency, maximum_available=args.maximum_available,
+                                       background_cost_rate=args.background_cost_rate,
+                                       server_error_rate=args.server_error_rate) as shopify:
+        create_tables(args.products)
+        data_access = DataAccess()
+        processor = ProductProcessor({
+            'product_reader': ProductFileReader(FILE_KEY, data_access).load(),
+            'user_id': 'benchmark-user',
+            'job_id': 'benchmark-job-' + name,
+            'type': 'CREATE',
+            'file_key': FILE_KEY,
+            'domain': shopify.domain,
+            'access_token': 'token',
+            'data_access': data_access
+        })
+        start = time.perf_counter()
+        try:
+            processor.process()
+        finally:
+            shopify_connection.close_sessions()
+        elapsed = time.perf_counter() - start
+
+        job = boto3.resource('dynamodb').Table('BulkManager').get_item(
+            Key={'PK': 'job#benchmark-job-' + name, 'SK': 'user#benchmark-user'})['Item']
+        scheduler = shopify_connection.get_scheduler(shopify.domain)
+        print('%-9s products=%d elapsed=%.2fs created=%d failed=%d throttled=%d server_errors=%d final_concurrency=%d' % (
+            name, args.products, elapsed, len(shopify.products), job.get('total_failed', 0),
+            shopify.throttled_requests, shopify.server_errors, scheduler.concurrency), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--maximum-available', type=float, default=200)
+    parser.add_argument('--background-cost-rate', type=float, default=20)
+    parser.add_argument('--server-error-rate', type=float, default=0.1)
+    args = parser.parse_args()
+
+    run('no-retry', args, 0)
+    run('retry', args, 5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import Counter
+
+
+class LocalDynamoDB:
+    """
+    In memory stand-in for the low level dynamodb client with a fixed
+    round-trip latency per call, so benchmarks are repeatable offline
+    """
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.items = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+
+    def transact_write_items(self, TransactItems):
+        self.__call('transact_write_items')
+        for transact_item in TransactItems:
+            if 'Put' in transact_item:
+                self.__put(transact_item['Put']['Item'])
+            elif 'Update' in transact_item:
+                self.__touch(transact_item['Update']['Key'])
+        return {}
+
+
+    def batch_write_item(self, RequestItems):
+        self.__call('batch_write_item')
+        for requests in RequestItems.values():
+            for request in requests:
+                self.__put(request['PutRequest']['Item'])
+        return {'UnprocessedItems': {}}
+
+
+    def update_item(self, **kwargs):
+        self.__call('update_item')
+        self.__touch(kwargs['Key'])
+        return {}
+
+
+    def __call(self, name):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[name] += 1
+
+
+    def __put(self, item):
+        with self._lock:
+            self.items[(item['PK']['S'], item['SK']['S'])] = item
+
+
+    def __touch(self, key):
+        with self._lock:
+            self.items.setdefault((key['PK']['S'], key['SK']['S']), dict(key))
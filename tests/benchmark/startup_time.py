@@ -0,0 +1,58 @@
+"""
+Measures what a cold start of the lambda pays before the handler runs: the
+import time of the handler module (split by module with -X importtime) and
+the time to build the shared DataAccess, against a warm invocation that
+reuses it.
+
+    python -m tests.benchmark.startup_time
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ.setdefault('bulk_manager_table', 'BulkManager')
+
+SRC_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'src')
+
+
+def get_import_times(module):
+    """Imports the module in a fresh interpreter and returns the cumulative
+    import time of every module in microseconds."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_PATH, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            env=env, capture_output=True, text=True, check=True).stderr
+    import_times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    import_times = get_import_times(args.module)
+    print('import %s: %.1fms' % (args.module, import_times.get(args.module, 0) / 1000))
+    for name, cumulative in sorted(import_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print('  %-50s %8.1fms' % (name, cumulative / 1000))
+
+    sys.path.insert(0, SRC_PATH)
+    import app
+    for invocation in ('cold', 'warm'):
+        start = time.perf_counter()
+        app.get_data_access()
+        print('%s data access: %.1fms' % (invocation, (time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+
+import pytest
+
+
+# The lambda code imports its modules relative to the src directory, the same
+# way it is laid out in the deployment package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'result_status_index: create the BulkManager table with the index of results by job and status')
+    config.addinivalue_line('markers', 'shopify_server(**kwargs): arguments of the MockShopifyServer of the shopify fixture')
+
+
+@pytest.fixture()
+def aws(request, monkeypatch):
+    """Mocked AWS with the BulkManager table and the prepared products bucket"""
+    import boto3
+    from moto import mock_aws
+    from moto.dynamodb.responses import DynamoHandler
+
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-2')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('bulk_manager_table', 'BulkManager')
+    monkeypatch.setenv('prepared_products_bucket', 'prepared-products')
+    monkeypatch.setenv('shopify_api_version', '2021-07')
+    monkeypatch.setenv('shopify_scheme', 'http')
+    monkeypatch.setenv('batch_size', '50')
+    monkeypatch.setenv('bulk_operation_poll_interval', '0')
+    table = {
+        'TableName': 'BulkManager',
+        'KeySchema': [{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+        'AttributeDefinitions': [{'AttributeName': 'PK', 'AttributeType': 'S'}, {'AttributeName': 'SK', 'AttributeType': 'S'}],
+        'BillingMode': 'PAY_PER_REQUEST'
+    }
+    if request.node.get_closest_marker('result_status_index') is not None:
+        table['AttributeDefinitions'].append({'AttributeName': 'status', 'AttributeType': 'S'})
+        table['GlobalSecondaryIndexes'] = [{
+            'IndexName': 'SK-status-index',
+            'KeySchema': [{'AttributeName': 'SK', 'KeyType': 'HASH'}, {'AttributeName': 'status', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'KEYS_ONLY'}
+        }]
+    # moto's dynamodb backend deep copies its tables for a transaction, which
+    # is not safe while the AsyncDataAccess workers write to them, so the
+    # mocked calls are handled one at a time
+    lock = threading.Lock()
+    call_action = DynamoHandler.call_action
+
+    def call_action_locked(self):
+        with lock:
+            return call_action(self)
+    monkeypatch.setattr(DynamoHandler, 'call_action', call_action_locked)
+    with mock_aws():
+        boto3.client('dynamodb').create_table(**table)
+        boto3.client('s3').create_bucket(Bucket='prepared-products', CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+        yield
+
+
+@pytest.fixture()
+def shopify(request):
+    from tests.mocks.shopify_server import MockShopifyServer
+    from utility import shopify_connection
+
+    marker = request.node.get_closest_marker('shopify_server')
+    with MockShopifyServer(**(marker.kwargs if marker is not None else {})) as server:
+        try:
+            yield server
+        finally:
+            shopify_connection.close_sessions()
+
+
+@pytest.fixture()
+def published(monkeypatch):
+    """The messages the handler publishes to the product processor topic"""
+    import app
+    from dataaccess.data_access import DataAccess
+    messages = []
+    monkeypatch.setattr(app, '_data_access', None)
+    monkeypatch.setattr(DataAccess, 'publish_to_product_processor', lambda self, message: messages.append(message))
+    return messages
@@ -0,0 +1,36 @@
+from collections import Counter
+
+
+READ_OPERATIONS = ('GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems')
+
+
+class DynamoDBCallCounter:
+    """
+    Counts the dynamodb api calls a DataAccess makes through its low level
+    client and its table resource, e.g. to assert how many reads one
+    invocation costs.
+    """
+
+    def __init__(self, data_access):
+        self.calls = Counter()
+        self._clients = [data_access._dynamo_client, data_access._dynamodb.meta.client]
+
+
+    @property
+    def reads(self):
+        return sum(self.calls[operation] for operation in READ_OPERATIONS)
+
+
+    def __count(self, model, **kwargs):
+        self.calls[model.name] += 1
+
+
+    def __enter__(self):
+        for client in self._clients:
+            client.meta.events.register('before-call.dynamodb', self.__count)
+        return self
+
+
+    def __exit__(self, *args):
+        for client in self._clients:
+            client.meta.events.unregister('before-call.dynamodb', self.__count)
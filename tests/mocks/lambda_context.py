@@ -0,0 +1,9 @@
+class LambdaContext:
+    """Stand-in for the lambda context with a fixed remaining time"""
+
+    def __init__(self, remaining_millis=900000, aws_request_id='test'):
+        self.remaining_millis = remaining_millis
+        self.aws_request_id = aws_request_id
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
@@ -0,0 +1,30 @@
+import copy
+import threading
+
+
+class LocalRateBudgetStore:
+    """
+    In-memory stand-in for the rate budget items of the BulkManager table,
+    with the same conditional writes, so RateBudgets of concurrent jobs can
+    share a shop's budget without dynamodb.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._budgets = {}
+        self.conflicts = 0
+
+
+    def get_rate_budget(self, domain):
+        with self._lock:
+            return copy.deepcopy(self._budgets.get(domain))
+
+
+    def put_rate_budget(self, domain, state, updated_at):
+        with self._lock:
+            current = self._budgets.get(domain)
+            if (current is None and updated_at is not None) or (current is not None and current['updated_at'] != updated_at):
+                self.conflicts += 1
+                return False
+            self._budgets[domain] = copy.deepcopy(state)
+            return True
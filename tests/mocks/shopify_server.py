@@ -0,0 +1,291 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from aiohttp import web
+
+
+PRODUCT_CREATE_FIELD = re.compile(r'(\w+)\s*:\s*productCreate\(input:\s*\$(\w+)\)')
+PRODUCT_UPDATE_FIELD = re.compile(r'(\w+)\s*:\s*productUpdate\(input:\s*\$(\w+)\)')
+HANDLE_SEPARATORS = re.compile(r'[\W_]+')
+
+
+class MockShopifyServer:
+    """
+    Local stand-in for the shopify admin graphql api. It creates products in
+    memory, lists them by handle, updates them, runs bulk operations from staged uploads and enforces a query
+    cost bucket the way shopify does, answering THROTTLED when it is empty.
+    Other apps using the shop are simulated by background_cost_rate, which
+    drains the bucket without the client knowing, and server_error_rate
+    answers that share of graphql requests with a 503. Run it with the
+    processors' shopify_scheme set to http and the user's domain set to
+    server.domain.
+    """
+
+    def __init__(self, latency=0, maximum_available=1000, restore_rate=50, product_create_cost=10, bulk_operation_polls=1,
+                 background_cost_rate=0, server_error_rate=0, seed=0):
+        self.latency = latency
+        self.background_cost_rate = background_cost_rate
+        self.server_error_rate = server_error_rate
+        self.server_errors = 0
+        self._random = random.Random(seed)
+        self.maximum_available = maximum_available
+        self.restore_rate = restore_rate
+        self.product_create_cost = product_create_cost
+        self.bulk_operation_polls = bulk_operation_polls
+        # products whose title starts with INVALID, and variants whose sku
+        # does, are rejected with a user error
+        self.reject_invalid_titles = True
+        self.max_create_variants = 100
+        self.collections = {}
+        self.products = []
+        self.requests = Counter()
+        self.throttled_requests = 0
+        self._available = maximum_available
+        self._updated_at = time.monotonic()
+        self._staged_uploads = {}
+        self._bulk_operations = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self.port = None
+
+
+    @property
+    def domain(self):
+        return '127.0.0.1:' + str(self.port)
+
+
+    def start(self):
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            app = web.Application()
+            app.router.add_post('/admin/api/{version}/graphql.json', self.__graphql)
+            app.router.add_post('/staged-uploads', self.__staged_upload)
+            app.router.add_get('/bulk-results/{id}', self.__bulk_results)
+            self._runner = web.AppRunner(app)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+    async def __graphql(self, request):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.server_error_rate > 0 and self._random.random() < self.server_error_rate:
+            self.server_errors += 1
+            return web.Response(status=503)
+        body = await request.json()
+        query = body['query']
+        variables = body.get('variables') or {}
+
+        if 'stagedUploadsCreate' in query:
+            self.requests['stagedUploadsCreate'] += 1
+            return web.json_response(self.__with_cost(self.__create_staged_upload(request), 10))
+        if 'bulkOperationRunMutation' in query:
+            self.requests['bulkOperationRunMutation'] += 1
+            return web.json_response(self.__with_cost(self.__run_bulk_operation(request, variables), 10))
+        if 'currentBulkOperation' in query:
+            self.requests['currentBulkOperation'] += 1
+            return web.json_response(self.__with_cost({'data': {'currentBulkOperation': self.__get_current_bulk_operation()}}, 1))
+        if 'BulkOperation' in query:
+            self.requests['bulkOperation'] += 1
+            return web.json_response(self.__with_cost(self.__get_bulk_operation(request, variables['id']), 1))
+        if 'productVariantsBulkCreate' in query:
+            if not self.__take(10):
+                return web.json_response(self.__throttled(10))
+            self.requests['productVariantsBulkCreate'] += 1
+            data = {'productVariantsBulkCreate': self.__create_variants(variables['productId'], variables['variants'])}
+            return web.json_response(self.__with_cost({'data': data}, 10, taken=True))
+        if 'productCreate' in query:
+            fields = PRODUCT_CREATE_FIELD.findall(query)
+            requested_cost = self.product_create_cost * len(fields)
+            if not self.__take(requested_cost):
+                return web.json_response(self.__throttled(requested_cost))
+            self.requests['productCreate'] += 1
+            data = {alias: self.__create_product(variables[name]) for alias, name in fields}
+            return web.json_response(self.__with_cost({'data': data}, requested_cost, taken=True))
+        if 'productUpdate' in query:
+            fields = PRODUCT_UPDATE_FIELD.findall(query)
+            requested_cost = self.product_create_cost * len(fields)
+            if not self.__take(requested_cost):
+                return web.json_response(self.__throttled(requested_cost))
+            self.requests['productUpdate'] += 1
+            data = {alias: self.__update_product(variables[name]) for alias, name in fields}
+            return web.json_response(self.__with_cost({'data': data}, requested_cost, taken=True))
+        if 'products(' in query:
+            self.requests['products'] += 1
+            start = int(variables['after'] or 0)
+            page = self.products[start:start + variables['first']]
+            edges = [{'cursor': str(start + i + 1), 'node': {'id': product['id'], 'handle': product['handle']}} for i, product in enumerate(page)]
+            page_info = {'hasNextPage': start + len(page) < len(self.products)}
+            return web.json_response(self.__with_cost({'data': {'products': {'edges': edges, 'pageInfo': page_info}}}, 2 + len(page)))
+        if 'collections(' in query:
+            self.requests['collections'] += 1
+            title = variables['title'].split(':', 1)[1]
+            edges = [{'node': {'id': gid, 'title': title}} for gid, name in self.collections.items() if name == title]
+            return web.json_response(self.__with_cost({'data': {'collections': {'edges': edges}}}, 4))
+        if 'collection(' in query:
+            self.requests['collection'] += 1
+            gid = variables['id']
+            collection = {'id': gid, 'title': self.collections[gid]} if gid in self.collections else None
+            return web.json_response(self.__with_cost({'data': {'collection': collection}}, 1))
+        return web.json_response({'errors': [{'message': 'Unsupported query'}]})
+
+
+    async def __staged_upload(self, request):
+        form = await request.post()
+        self._staged_uploads[form['key']] = form['file'].file.read()
+        return web.Response(status=201)
+
+
+    async def __bulk_results(self, request):
+        return web.Response(body=self._bulk_operations[request.match_info['id']]['results'])
+
+
+    def __create_product(self, product_input):
+        if self.reject_invalid_titles and product_input.get('title', '').startswith('INVALID'):
+            return {'product': None, 'userErrors': [{'field': ['title'], 'message': 'Title is invalid'}]}
+        if len(product_input.get('variants') or []) > self.max_create_variants:
+            return {'product': None, 'userErrors': [{'field': ['variants'], 'message': 'Too many variants'}]}
+        product = {'id': 'gid://shopify/Product/' + str(len(self.products) + 1), 'title': product_input.get('title')}
+        handle = HANDLE_SEPARATORS.sub('-', (product_input.get('handle') or product_input.get('title') or '').lower()).strip('-')
+        self.products.append(dict(product_input, id=product['id'], handle=handle))
+        return {'product': product, 'userErrors': []}
+
+
+    def __update_product(self, product_input):
+        for existing in self.products:
+            if existing['id'] == product_input['id']:
+                existing.update(product_input)
+                return {'product': {'id': existing['id'], 'title': existing.get('title')}, 'userErrors': []}
+        return {'product': None, 'userErrors': [{'field': ['id'], 'message': 'Product does not exist'}]}
+
+
+    def __create_variants(self, product_id, variants):
+        if self.reject_invalid_titles and any(variant.get('sku', '').startswith('INVALID') for variant in variants):
+            return {'userErrors': [{'field': ['variants', 'sku'], 'message': 'Sku is invalid'}]}
+        for existing in self.products:
+            if existing['id'] == product_id:
+                existing['variants'] = (existing.get('variants') or []) + variants
+                return {'userErrors': []}
+        return {'userErrors': [{'field': ['productId'], 'message': 'Product does not exist'}]}
+
+
+    def __create_staged_upload(self, request):
+        key = 'tmp/bulk/' + str(uuid.uuid4()) + '/bulk_op_vars.jsonl'
+        target = {
+            'url': 'http://' + request.host + '/staged-uploads',
+            'resourceUrl': None,
+            'parameters': [{'name': 'key', 'value': key}, {'name': 'policy', 'value': 'mock'}]
+        }
+        return {'data': {'stagedUploadsCreate': {'stagedTargets': [target], 'userErrors': []}}}
+
+
+    def __run_bulk_operation(self, request, variables):
+        current = self.__get_current_bulk_operation()
+        if current is not None and current['status'] == 'RUNNING':
+            user_errors = [{'field': None, 'message': 'A bulk mutation operation for this app and shop is already in progress.'}]
+            return {'data': {'bulkOperationRunMutation': {'bulkOperation': None, 'userErrors': user_errors}}}
+        content = self._staged_uploads[variables['stagedUploadPath']]
+        results = []
+        for line_number, line in enumerate(content.decode('utf-8').splitlines()):
+            product_create = self.__create_product(json.loads(line)['input'])
+            results.append(json.dumps({'data': {'productCreate': product_create}, '__lineNumber': line_number}))
+        operation_id = str(len(self._bulk_operations) + 1)
+        self._bulk_operations[operation_id] = {
+            'polls': 0,
+            'count': len(results),
+            'results': '\n'.join(results).encode('utf-8'),
+            'url': 'http://' + request.host + '/bulk-results/' + operation_id,
+            'created_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+        bulk_operation = {'id': 'gid://shopify/BulkOperation/' + operation_id, 'status': 'CREATED'}
+        return {'data': {'bulkOperationRunMutation': {'bulkOperation': bulk_operation, 'userErrors': []}}}
+
+
+    def __get_current_bulk_operation(self):
+        if len(self._bulk_operations) == 0:
+            return None
+        operation_id = str(len(self._bulk_operations))
+        operation = self._bulk_operations[operation_id]
+        status = 'COMPLETED' if operation['polls'] >= self.bulk_operation_polls else 'RUNNING'
+        return {'id': 'gid://shopify/BulkOperation/' + operation_id, 'status': status, 'createdAt': operation['created_at']}
+
+
+    def __get_bulk_operation(self, request, gid):
+        operation_id = gid.rsplit('/', 1)[1]
+        operation = self._bulk_operations[operation_id]
+        operation['polls'] += 1
+        node = {'id': gid, 'status': 'RUNNING', 'errorCode': None, 'objectCount': '0', 'url': None, 'partialDataUrl': None}
+        if operation['polls'] >= self.bulk_operation_polls:
+            node.update({'status': 'COMPLETED', 'objectCount': str(operation['count']), 'url': operation['url']})
+        return {'data': {'node': node}}
+
+
+    def __restore(self):
+        now = time.monotonic()
+        restored = (now - self._updated_at) * (self.restore_rate - self.background_cost_rate)
+        self._available = max(0, min(self.maximum_available, self._available + restored))
+        self._updated_at = now
+
+
+    def __take(self, cost):
+        self.__restore()
+        if self._available < cost:
+            self.throttled_requests += 1
+            return False
+        self._available -= cost
+        return True
+
+
+    def __throttle_status(self):
+        self.__restore()
+        return {
+            'maximumAvailable': self.maximum_available,
+            'currentlyAvailable': int(self._available),
+            'restoreRate': self.restore_rate
+        }
+
+
+    def __throttled(self, requested_cost):
+        return {
+            'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+            'extensions': {'cost': {'requestedQueryCost': requested_cost, 'actualQueryCost': None, 'throttleStatus': self.__throttle_status()}}
+        }
+
+
+    def __with_cost(self, response, cost, taken=False):
+        if not taken:
+            self.__take(cost)
+        response['extensions'] = {'cost': {'requestedQueryCost': cost, 'actualQueryCost': cost, 'throttleStatus': self.__throttle_status()}}
+        return response
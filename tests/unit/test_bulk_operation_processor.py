@@ -0,0 +1,95 @@
+import json
+
+import boto3
+import pytest
+
+from tests.mocks.lambda_context import LambdaContext
+
+
+JOB_ID = 'bulk-job'
+USER_ID = 'bulk-user'
+FILE_KEY = 'prepared/bulk-job.json'
+
+pytestmark = pytest.mark.shopify_server(bulk_operation_polls=2)
+
+
+def get_products():
+    products = []
+    for i in range(120):
+        product = {'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []}
+        if i == 5:
+            product['variants'] = [{'price': '1.00'}] * 101
+        if i == 7:
+            product['title'] = 'INVALID product'
+        products.append(product)
+    return products
+
+
+def run_bulk_operation(shopify, remaining_millis):
+    from dataaccess.data_access import DataAccess
+    from utility.product_file_reader import ProductFileReader
+    from utility.bulk_operation_processor import BulkOperationProcessor
+
+    product_reader = ProductFileReader(FILE_KEY, DataAccess()).load()
+    processor = BulkOperationProcessor({
+        'product_reader': product_reader,
+        'user_id': USER_ID,
+        'job_id': JOB_ID,
+        'type': 'BULK_OPERATION',
+        'file_key': FILE_KEY,
+        'domain': shopify.domain,
+        'access_token': 'token',
+        'context': LambdaContext(remaining_millis)
+    })
+    return processor.process()
+
+
+def test_bulk_operation_creates_products_and_results(aws, shopify):
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(get_products()))
+
+    # not enough time left to wait for the operation, the next invocation polls again
+    assert run_bulk_operation(shopify, 1000) is False
+    assert run_bulk_operation(shopify, 900000) is True
+
+    assert shopify.requests['bulkOperationRunMutation'] == 1
+    assert shopify.requests['productCreate'] == 0
+    assert len(shopify.products) == 118
+
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['total_success'] == 118
+    assert job['total_failed'] == 2
+
+    invalid_result = table.get_item(Key={'PK': 'result#6', 'SK': 'job#' + JOB_ID})['Item']
+    assert invalid_result['status'] == 'FAILED'
+    rejected_result = table.get_item(Key={'PK': 'result#8', 'SK': 'job#' + JOB_ID})['Item']
+    assert rejected_result['status'] == 'FAILED'
+    assert 'title: Title is invalid' in json.loads(rejected_result['errors'])
+    created_result = table.get_item(Key={'PK': 'result#120', 'SK': 'job#' + JOB_ID})['Item']
+    assert created_result['status'] == 'SUCCESS'
+    assert json.loads(created_result['data'])['product_id'].startswith('gid://shopify/Product/')
+    assert json.loads(created_result['data'])['ref'] == {'file_key': FILE_KEY, 'index': 119}
+
+
+def test_interrupted_start_adopts_the_running_operation(aws, shopify, monkeypatch):
+    from dataaccess.data_access import DataAccess
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(get_products()))
+    put_bulk_operation = DataAccess.put_bulk_operation
+
+    def interrupt_after_run(self, job, bulk_operation):
+        if 'id' in bulk_operation:
+            raise TimeoutError('interrupted before the operation was recorded')
+        return put_bulk_operation(self, job, bulk_operation)
+    monkeypatch.setattr(DataAccess, 'put_bulk_operation', interrupt_after_run)
+    with pytest.raises(TimeoutError):
+        run_bulk_operation(shopify, 900000)
+    monkeypatch.setattr(DataAccess, 'put_bulk_operation', put_bulk_operation)
+
+    # the redelivered invocation finds the pending marker and polls the operation that is running
+    assert run_bulk_operation(shopify, 900000) is True
+
+    assert shopify.requests['currentBulkOperation'] == 1
+    assert shopify.requests['bulkOperationRunMutation'] == 1
+    assert len(shopify.products) == 118
+    job = boto3.resource('dynamodb').Table('BulkManager').get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert (job['total_success'], job['total_failed']) == (118, 2)
@@ -0,0 +1,32 @@
+import asyncio
+
+
+class LocalCollectionCache:
+    """Stand-in for the async data access of a CollectionResolver without cached collections"""
+
+    async def get_collection_cache(self, job_id):
+        return {}
+
+    async def put_collection_cache(self, job_id, collections):
+        pass
+
+
+def test_closed_resolver_leaves_no_lookup_running():
+    from utility.collection_resolver import CollectionResolver
+    sent = []
+
+    async def send_request(operation, request, request_input, session):
+        sent.append(request_input)
+        # the shop never answers
+        await asyncio.Event().wait()
+
+    async def prepare_and_close():
+        resolver = CollectionResolver('job', None, LocalCollectionCache(), send_request)
+        resolver.prepare([{'collectionsToJoin': ['Summer']}], None)
+        while len(sent) == 0:
+            await asyncio.sleep(0)
+        await resolver.close()
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(prepare_and_close()) == []
+    assert sent == ['Summer']
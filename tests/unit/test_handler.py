@@ -1,73 +1,44 @@
 import json
 
-import pytest
-
-from hello_world import app
-
-
-@pytest.fixture()
-def apigw_event():
-    """ Generates API GW Event"""
-
-    return {
-        "body": '{ "test": "body"}',
-        "resource": "/{proxy+}",
-        "requestContext": {
-            "resourceId": "123456",
-            "apiId": "1234567890",
-            "resourcePath": "/{proxy+}",
-            "httpMethod": "POST",
-            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
-            "accountId": "123456789012",
-            "identity": {
-                "apiKey": "",
-                "userArn": "",
-                "cognitoAuthenticationType": "",
-                "caller": "",
-                "userAgent": "Custom User Agent String",
-                "user": "",
-                "cognitoIdentityPoolId": "",
-                "cognitoIdentityId": "",
-                "cognitoAuthenticationProvider": "",
-                "sourceIp": "127.0.0.1",
-                "accountId": "",
-            },
-            "stage": "prod",
-        },
-        "queryStringParameters": {"foo": "bar"},
-        "headers": {
-            "Via": "1.1 08f323deadbeefa7af34d5feb414ce27.cloudfront.net (CloudFront)",
-            "Accept-Language": "en-US,en;q=0.8",
-            "CloudFront-Is-Desktop-Viewer": "true",
-            "CloudFront-Is-SmartTV-Viewer": "false",
-            "CloudFront-Is-Mobile-Viewer": "false",
-            "X-Forwarded-For": "127.0.0.1, 127.0.0.2",
-            "CloudFront-Viewer-Country": "US",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Upgrade-Insecure-Requests": "1",
-            "X-Forwarded-Port": "443",
-            "Host": "1234567890.execute-api.us-east-1.amazonaws.com",
-            "X-Forwarded-Proto": "https",
-            "X-Amz-Cf-Id": "aaaaaaaaaae3VYQb9jd-nvCd-de396Uhbp027Y2JvkCPNLmGJHqlaA==",
-            "CloudFront-Is-Tablet-Viewer": "false",
-            "Cache-Control": "max-age=0",
-            "User-Agent": "Custom User Agent String",
-            "CloudFront-Forwarded-Proto": "https",
-            "Accept-Encoding": "gzip, deflate, sdch",
-        },
-        "pathParameters": {"proxy": "/examplepath"},
-        "httpMethod": "POST",
-        "stageVariables": {"baz": "qux"},
-        "path": "/examplepath",
-    }
-
-
-def test_lambda_handler(apigw_event, mocker):
-
-    ret = app.lambda_handler(apigw_event, "")
-    data = json.loads(ret["body"])
-
-    assert ret["statusCode"] == 200
-    assert "message" in ret["body"]
-    assert data["message"] == "hello world"
-    # assert "location" in data.dict_keys()
+import boto3
+
+from tests.mocks.lambda_context import LambdaContext
+
+
+JOB_ID = 'handler-job'
+USER_ID = 'handler-user'
+FILE_KEY = 'prepared/handler-job.json'
+
+
+def test_job_is_carried_through_the_sns_chain_until_it_completes(aws, shopify, published, monkeypatch):
+    import app
+    from dataaccess.data_access import DataAccess
+    index_reads = []
+    get_product_file_index = DataAccess.get_product_file_index
+    monkeypatch.setattr(DataAccess, 'get_product_file_index', lambda self, file_key: index_reads.append(file_key) or get_product_file_index(self, file_key))
+
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    table.put_item(Item={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID, 'input_products': FILE_KEY, 'type': 'CREATE', 'product_limit_exceeded': False})
+    table.put_item(Item={'PK': 'user#' + USER_ID, 'SK': 'user', 'domain': shopify.domain, 'access_token': 'token', 'active_job_count': 1})
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(120)]
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+
+    messages = [{'jobId': JOB_ID, 'userId': USER_ID}]
+    invocations = 0
+    while len(messages) > 0:
+        invocations += 1
+        assert app.lambda_handler({'Records': [{'Sns': {'Message': json.dumps(messages.pop(0))}}]}, LambdaContext(60000, 'handler-test')) is None
+        messages.extend(published)
+        published.clear()
+        assert len(messages) <= 1
+        assert all(message['job']['bulkOperation'] is False for message in messages)
+
+    assert len(shopify.products) == 120
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['status'] == 'COMPLETED'
+    assert job['total_success'] == 120
+    # one invocation per page of 50 products
+    assert invocations == 3
+    # only the first invocation reads the prepared file, later ones read the sendable file
+    assert index_reads.count(FILE_KEY) == 1
+    assert table.get_item(Key={'PK': 'user#' + USER_ID, 'SK': 'user'})['Item']['active_job_count'] == 0
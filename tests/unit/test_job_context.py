@@ -0,0 +1,67 @@
+import boto3
+import pytest
+
+from tests.mocks.dynamodb_calls import DynamoDBCallCounter
+
+
+JOB_ID = 'context-job'
+USER_ID = 'context-user'
+
+
+@pytest.fixture()
+def data_access(aws, monkeypatch):
+    from utility import job_context
+    monkeypatch.setattr(job_context, '_users', {})
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    table.put_item(Item={
+        'PK': 'job#' + JOB_ID,
+        'SK': 'user#' + USER_ID,
+        'input_products': 'prepared/context-job.json',
+        'type': 'CREATE',
+        'product_limit_exceeded': True,
+        'current_batch': 3
+    })
+    table.put_item(Item={'PK': 'user#' + USER_ID, 'SK': 'user', 'domain': 'shop.myshopify.com', 'access_token': 'token'})
+
+    from dataaccess.data_access import DataAccess
+    return DataAccess()
+
+
+def load(message, data_access):
+    from utility.job_context import JobContext
+    return JobContext(message, data_access).load()
+
+
+def test_first_invocation_reads_job_and_user_once(data_access):
+    with DynamoDBCallCounter(data_access) as counter:
+        context = load({'jobId': JOB_ID, 'userId': USER_ID}, data_access)
+
+    assert counter.reads == 1
+    assert counter.calls['BatchGetItem'] == 1
+    assert context.domain == 'shop.myshopify.com'
+    assert context.input_products == 'prepared/context-job.json'
+    assert context.product_limit_exceeded is True
+    assert context.start_index == 100
+
+
+def test_warm_invocation_reads_nothing(data_access):
+    first = load({'jobId': JOB_ID, 'userId': USER_ID}, data_access)
+
+    with DynamoDBCallCounter(data_access) as counter:
+        context = load(first.get_message(150), data_access)
+
+    assert counter.reads == 0
+    assert context.start_index == 150
+    assert context.start_time == first.start_time
+    assert context.access_token == 'token'
+
+
+def test_stale_context_is_read_again(data_access, monkeypatch):
+    first = load({'jobId': JOB_ID, 'userId': USER_ID}, data_access)
+    monkeypatch.setenv('job_context_ttl', '0')
+
+    with DynamoDBCallCounter(data_access) as counter:
+        context = load(first.get_message(150), data_access)
+
+    assert counter.calls['BatchGetItem'] == 1
+    assert context.start_index == 150
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+import boto3
+import pytest
+
+from tests.mocks.lambda_context import LambdaContext
+
+
+JOB_ID = 'shard-job'
+USER_ID = 'shard-user'
+FILE_KEY = 'prepared/shard-job.json'
+
+
+@pytest.fixture()
+def aws(aws, monkeypatch):
+    monkeypatch.setenv('batch_size', '20')
+    monkeypatch.setenv('shard_count', '3')
+
+
+def invoke(message):
+    import app
+    app.lambda_handler({'Records': [{'Sns': {'Message': json.dumps(message)}}]}, LambdaContext())
+
+
+def test_get_shards_keeps_whole_batches():
+    from utility.job_shards import get_shards
+    shards = get_shards(95, 3, 20)
+    assert [(shard['start'], shard['end']) for shard in shards] == [(0, 40), (40, 80), (80, 95)]
+    assert len(get_shards(15, 3, 20)) == 1
+
+
+def test_sharded_job_finishes_with_its_last_shard(aws, shopify, published):
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    table.put_item(Item={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID, 'input_products': FILE_KEY, 'type': 'CREATE', 'product_limit_exceeded': False})
+    table.put_item(Item={'PK': 'user#' + USER_ID, 'SK': 'user', 'domain': shopify.domain, 'access_token': 'token', 'active_job_count': 1})
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(100)]
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+
+    invoke({'jobId': JOB_ID, 'userId': USER_ID})
+    shard_messages = list(published)
+    assert [message['shard']['index'] for message in shard_messages] == [0, 1, 2]
+    assert len(shopify.products) == 0
+
+    for message in reversed(shard_messages):
+        invoke(message)
+        if message['shard']['index'] > 0:
+            job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+            assert 'duration' not in job
+    assert len(shopify.products) == 100
+    # a duplicate delivery of a finished shard does not finish the job again
+    invoke(shard_messages[1])
+
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['status'] == 'COMPLETED'
+    assert job['total_success'] == 100
+    user = table.get_item(Key={'PK': 'user#' + USER_ID, 'SK': 'user'})['Item']
+    assert user['active_job_count'] == 0
+
+
+def test_rate_budget_is_shared_between_workers(aws):
+    from dataaccess.data_access import DataAccess
+    from utility.rate_budget import RateBudget
+    first_worker = RateBudget('shop.myshopify.com', JOB_ID, DataAccess(), lease_size=1000)
+    second_worker = RateBudget('shop.myshopify.com', JOB_ID, DataAccess())
+
+    asyncio.run(first_worker.take(10, 1000, 1))
+    # the first worker leased the whole bucket, which restores too slowly for the second
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(second_worker.take(10, 1000, 1), 0.5))
+
+    state = DataAccess().get_rate_budget('shop.myshopify.com')
+    assert state['tokens'] < 10
+    assert list(state['jobs']) == [JOB_ID]
+    # a write based on a stale read is rejected
+    assert not DataAccess().put_rate_budget('shop.myshopify.com', state, state['updated_at'] - 1)
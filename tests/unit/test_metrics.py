@@ -0,0 +1,30 @@
+import json
+
+
+JOB_ID = 'metrics-job'
+
+
+def get_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+
+
+def test_metrics_are_written_as_emf_lines_of_at_most_100_values(capsys):
+    from utility.metrics import Metrics
+
+    metrics = Metrics({'JobType': 'CREATE'}, 'Test')
+    metrics.put_property('JobId', JOB_ID)
+    for i in range(150):
+        metrics.put('ShopifyLatency', i)
+    metrics.put('Products', 150, 'Count')
+    metrics.flush()
+
+    first, second = get_lines(capsys)
+    assert first['_aws']['CloudWatchMetrics'][0]['Namespace'] == 'Test'
+    assert first['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['JobType']]
+    assert first['JobType'] == 'CREATE' and first['JobId'] == JOB_ID
+    assert first['ShopifyLatency'] == list(range(100)) and first['Products'] == [150]
+    assert second['ShopifyLatency'] == list(range(100, 150)) and 'Products' not in second
+    assert [metric['Name'] for metric in second['_aws']['CloudWatchMetrics'][0]['Metrics']] == ['ShopifyLatency']
+
+    metrics.flush()
+    assert get_lines(capsys) == []
@@ -0,0 +1,328 @@
+import json
+
+import boto3
+import pytest
+
+from tests.mocks.lambda_context import LambdaContext
+from tests.mocks.shopify_server import MockShopifyServer
+
+
+JOB_ID = 'create-job'
+USER_ID = 'create-user'
+FILE_KEY = 'prepared/create-job.json'
+
+pytestmark = pytest.mark.result_status_index
+
+
+def get_products():
+    products = []
+    for i in range(120):
+        product = {'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []}
+        if i in (5, 64):
+            product['variants'] = [{'price': '1.00'}] * 101
+        if i == 7:
+            product['title'] = 'INVALID product'
+        products.append(product)
+    return products
+
+
+def run_product_processor(shopify, start_index, job_type='CREATE'):
+    from dataaccess.data_access import DataAccess
+    from utility.product_file_reader import ProductFileReader
+    from utility.product_processor import ProductProcessor
+
+    data_access = DataAccess()
+    processor = ProductProcessor({
+        'product_reader': ProductFileReader(FILE_KEY, data_access).load(),
+        'user_id': USER_ID,
+        'job_id': JOB_ID,
+        'start_index': start_index,
+        'type': job_type,
+        'file_key': FILE_KEY,
+        'domain': shopify.domain,
+        'access_token': 'token',
+        'context': LambdaContext(900000),
+        'data_access': data_access
+    })
+    return processor.process(), processor.next_index
+
+
+def test_invalid_products_fail_before_any_shopify_request(aws, shopify):
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(get_products()))
+
+    assert run_product_processor(shopify, 0) == (True, 118)
+
+    assert len(shopify.products) == 117
+    assert all(len(product['variants']) <= 100 for product in shopify.products)
+
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['total_success'] == 117
+    assert job['total_failed'] == 3
+
+    assert table.get_item(Key={'PK': 'result#65', 'SK': 'job#' + JOB_ID})['Item']['status'] == 'FAILED'
+    assert table.get_item(Key={'PK': 'result#8', 'SK': 'job#' + JOB_ID})['Item']['status'] == 'FAILED'
+    assert table.get_item(Key={'PK': 'result#120', 'SK': 'job#' + JOB_ID})['Item']['status'] == 'SUCCESS'
+
+    sendable = json.loads(boto3.client('s3').get_object(Bucket='prepared-products', Key=FILE_KEY + '.sendable.json')['Body'].read())
+    assert [entry['id'] for entry in sendable][:6] == [1, 2, 3, 4, 5, 7]
+
+
+def test_redelivered_batch_resumes_at_the_first_unfinished_product(aws, shopify):
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(60)]
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+    # an earlier attempt wrote the first 20 results and was interrupted while creating the 21st product
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    for result_id in range(1, 21):
+        table.put_item(Item={'PK': 'result#' + str(result_id), 'SK': 'job#' + JOB_ID, 'data': '{}', 'status': 'SUCCESS'})
+    table.put_item(Item={'PK': 'result#21', 'SK': 'job#' + JOB_ID, 'data': '{}', 'status': 'PENDING'})
+
+    assert run_product_processor(shopify, 0) == (True, 60)
+
+    assert sorted(product['title'] for product in shopify.products) == sorted('Product ' + str(i) for i in range(21, 60))
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['total_success'] == 59
+    assert job['total_failed'] == 1
+    interrupted_result = table.get_item(Key={'PK': 'result#21', 'SK': 'job#' + JOB_ID})['Item']
+    assert interrupted_result['status'] == 'FAILED'
+
+
+def test_products_are_claimed_when_their_request_is_sent(aws, shopify, monkeypatch):
+    from dataaccess.data_access import DataAccess
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(50)]
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    claimed = []
+    create_shopify_products = DataAccess.create_shopify_products
+
+    async def record_claims(self, product_items, *args):
+        claimed.append(table.scan(Select='COUNT', FilterExpression='begins_with(PK, :result)', ExpressionAttributeValues={':result': 'result#'})['Count'])
+        return await create_shopify_products(self, product_items, *args)
+    monkeypatch.setattr(DataAccess, 'create_shopify_products', record_claims)
+
+    assert run_product_processor(shopify, 0) == (True, 50)
+
+    # only one request is in flight until shopify reports the bucket, the
+    # products of the queued requests are not claimed yet
+    assert claimed[0] == 10
+    assert len(shopify.products) == 50
+
+
+def test_throttled_requests_are_sent_again_and_unanswered_mutations_are_not(aws):
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(30)]
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+
+    with MockShopifyServer(maximum_available=100, restore_rate=200, background_cost_rate=100, server_error_rate=0.2, seed=1) as shopify:
+        assert run_product_processor(shopify, 0) == (True, 30)
+
+        assert shopify.throttled_requests > 0
+        assert shopify.server_errors > 0
+        titles = [product['title'] for product in shopify.products]
+        assert len(set(titles)) == len(titles)
+
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['total_success'] == len(titles)
+    assert job['total_success'] + job['total_failed'] == 30
+    assert job['total_failed'] > 0
+    failed = [table.get_item(Key={'PK': 'result#' + str(i + 1), 'SK': 'job#' + JOB_ID})['Item'] for i, product in enumerate(products) if product['title'] not in titles]
+    assert all('check the store' in json.loads(result['errors'])[0] for result in failed)
+
+
+def test_results_refer_to_the_prepared_file_and_are_rehydrated(aws, shopify):
+    from dataaccess.data_access import DataAccess
+    from utility.product_results import read_result_data
+
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(10)]
+    products[7]['title'] = 'INVALID product'
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+
+    assert run_product_processor(shopify, 0) == (True, 10)
+
+    titles = [product['title'] for product in shopify.products]
+    product_id = 'gid://shopify/Product/' + str(titles.index('Product 2') + 1)
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    created = table.get_item(Key={'PK': 'result#3', 'SK': 'job#' + JOB_ID})['Item']
+    assert json.loads(created['data']) == {'ref': {'file_key': FILE_KEY, 'index': 2}, 'product_id': product_id}
+    invalid = table.get_item(Key={'PK': 'result#8', 'SK': 'job#' + JOB_ID})['Item']
+    assert 'product_id' not in json.loads(invalid['data'])
+
+    product_readers = {}
+    data_access = DataAccess()
+    assert read_result_data(created['data'], data_access, product_readers) == dict(products[2], id=product_id)
+    assert read_result_data(invalid['data'], data_access, product_readers) == products[7]
+    assert list(product_readers) == [FILE_KEY]
+
+
+def test_upsert_job_updates_existing_products_and_creates_the_rest(aws, shopify):
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(30)]
+    products[3]['handle'] = 'custom-handle'
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+    # an earlier run of the import created every fifth product
+    for i in range(0, 30, 5):
+        shopify.products.append({'id': 'gid://shopify/Product/' + str(i + 1000), 'title': 'Old ' + str(i), 'handle': 'product-' + str(i)})
+    shopify.products.append({'id': 'gid://shopify/Product/999', 'title': 'Old custom', 'handle': 'custom-handle'})
+
+    assert run_product_processor(shopify, 0, 'UPSERT') == (True, 30)
+
+    assert shopify.requests['products'] == 1
+    assert len(shopify.products) == 30
+    assert sorted(product['title'] for product in shopify.products) == sorted(product['title'] for product in products)
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    updated = table.get_item(Key={'PK': 'result#4', 'SK': 'job#' + JOB_ID})['Item']
+    assert updated['status'] == 'SUCCESS'
+    assert json.loads(updated['data'])['product_id'] == 'gid://shopify/Product/999'
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['total_success'] == 30
+
+    handles = json.loads(boto3.client('s3').get_object(Bucket='prepared-products', Key=FILE_KEY + '.handles.json')['Body'].read())
+    assert handles['custom-handle'] == 'gid://shopify/Product/999'
+
+
+def test_skip_existing_job_only_creates_missing_products(aws, shopify):
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(20)]
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+    for i in range(10):
+        shopify.products.append({'id': 'gid://shopify/Product/' + str(i + 1000), 'title': 'Product ' + str(i), 'handle': 'product-' + str(i)})
+
+    assert run_product_processor(shopify, 0, 'SKIP_EXISTING') == (True, 20)
+
+    assert shopify.requests['productUpdate'] == 0
+    assert sorted(product['title'] for product in shopify.products[10:]) == sorted('Product ' + str(i) for i in range(10, 20))
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    skipped = table.get_item(Key={'PK': 'result#1', 'SK': 'job#' + JOB_ID})['Item']
+    assert skipped['status'] == 'SUCCESS'
+    assert json.loads(skipped['data'])['product_id'] == 'gid://shopify/Product/1000'
+    assert 'already exists' in json.loads(skipped['warnings'])[0]
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert job['total_success'] == 20
+
+
+def test_replay_only_sends_failed_products_and_updates_results_in_place(aws, shopify):
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(80)]
+    for i in (3, 41, 77):
+        products[i]['title'] = 'INVALID product ' + str(i)
+    products[60]['variants'] = [{'price': '1.00'}] * 101
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+    assert run_product_processor(shopify, 0) == (True, 79)
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert (job['total_success'], job['total_failed']) == (76, 4)
+
+    # shopify accepts the products now, the one that failed validation still fails it
+    shopify.reject_invalid_titles = False
+    created = len(shopify.products)
+    assert run_product_processor(shopify, 0, 'REPLAY') == (True, 3)
+
+    assert sorted(product['title'] for product in shopify.products[created:]) == ['INVALID product 3', 'INVALID product 41', 'INVALID product 77']
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert (job['total_success'], job['total_failed']) == (79, 1)
+    replayed = table.get_item(Key={'PK': 'result#42', 'SK': 'job#' + JOB_ID})['Item']
+    assert replayed['status'] == 'SUCCESS'
+    assert 'errors' not in replayed
+    assert table.get_item(Key={'PK': 'result#61', 'SK': 'job#' + JOB_ID})['Item']['status'] == 'FAILED'
+
+    # replaying again finds nothing to send and leaves the counts alone
+    assert run_product_processor(shopify, 0, 'REPLAY') == (True, 0)
+    assert len(shopify.products) == created + 3
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert (job['total_success'], job['total_failed']) == (79, 1)
+
+
+
+def test_variant_heavy_products_are_split_into_one_result(aws, shopify, monkeypatch):
+    monkeypatch.setenv('product_create_variants', '40')
+    monkeypatch.setenv('variants_per_request', '25')
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(10)]
+    products[2]['variants'] = [{'price': '1.00', 'sku': 'A' + str(i)} for i in range(100)]
+    products[6]['variants'] = [{'price': '1.00', 'sku': 'B' + str(i)} for i in range(100)]
+    products[6]['variants'][70]['sku'] = 'INVALID'
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+
+    assert run_product_processor(shopify, 0) == (True, 10)
+
+    assert shopify.requests['productVariantsBulkCreate'] == 6
+    variants = {product['title']: product['variants'] for product in shopify.products}
+    assert [variant['sku'] for variant in variants['Product 2']] == ['A' + str(i) for i in range(100)]
+    assert len(variants['Product 6']) == 75
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert (job['total_success'], job['total_failed']) == (9, 1)
+    result = table.get_item(Key={'PK': 'result#7', 'SK': 'job#' + JOB_ID})['Item']
+    assert result['status'] == 'FAILED'
+    assert json.loads(result['errors']) == ['Variants 66 to 90 could not be added to the product, which was created without them. variants sku: Sku is invalid']
+    assert json.loads(result['data'])['product_id'].startswith('gid://shopify/Product/')
+
+    # the product exists on the store, so a replay does not create it again
+    shopify.reject_invalid_titles = False
+    assert run_product_processor(shopify, 0, 'REPLAY') == (True, 0)
+    assert len(shopify.products) == 10
+
+
+def test_retried_replay_write_is_counted_once(aws):
+    from dataaccess.data_access import DataAccess
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    table.put_item(Item={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID, 'total_success': 8, 'total_failed': 2})
+    for result_id in (4, 9):
+        table.put_item(Item={'PK': 'result#' + str(result_id), 'SK': 'job#' + JOB_ID, 'data': '{}', 'status': 'FAILED'})
+    job = {'id': JOB_ID, 'user_id': USER_ID}
+
+    assert DataAccess().replace_results(job, [{'id': '4', 'job_id': JOB_ID, 'data': '{}', 'status': 'SUCCESS'}]) == 1
+    assert DataAccess().replace_results(job, [
+        {'id': '4', 'job_id': JOB_ID, 'data': '{}', 'status': 'SUCCESS'},
+        {'id': '9', 'job_id': JOB_ID, 'data': '{}', 'status': 'SUCCESS'}
+    ]) == 1
+
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert (job['total_success'], job['total_failed']) == (10, 0)
+    assert DataAccess().get_failed_result_ids(JOB_ID) == []
+
+
+def test_retried_result_counts_are_added_once(aws):
+    from dataaccess.data_access import DataAccess
+    table = boto3.resource('dynamodb').Table('BulkManager')
+    table.put_item(Item={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID, 'total_success': 0, 'total_failed': 0})
+    job = {'id': JOB_ID, 'user_id': USER_ID}
+
+    assert DataAccess().add_result_counts(job, 48, 2, '1-50') is True
+    assert DataAccess().add_result_counts(job, 48, 2, '1-50') is False
+    assert DataAccess().add_result_counts(job, 50, 0, '51-100') is True
+
+    job = table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'user#' + USER_ID})['Item']
+    assert (job['total_success'], job['total_failed']) == (98, 2)
+    # the chunk markers are kept out of the job item
+    assert 'result_chunks' not in job
+    assert 'Item' in table.get_item(Key={'PK': 'job#' + JOB_ID, 'SK': 'chunk#51-100'})
+
+
+def test_product_processor_records_phase_metrics(aws, shopify, capsys):
+    from dataaccess.data_access import DataAccess
+    from utility.metrics import Metrics
+    from utility.product_file_reader import ProductFileReader
+    from utility.product_processor import ProductProcessor
+
+    products = [{'title': 'Product ' + str(i), 'variants': [{'price': '10.00'}], 'errors': [], 'warnings': []} for i in range(30)]
+    boto3.client('s3').put_object(Bucket='prepared-products', Key=FILE_KEY, Body=json.dumps(products))
+
+    data_access = DataAccess()
+    metrics = Metrics()
+    assert ProductProcessor({
+        'product_reader': ProductFileReader(FILE_KEY, data_access).load(),
+        'user_id': USER_ID,
+        'job_id': JOB_ID,
+        'type': 'CREATE',
+        'file_key': FILE_KEY,
+        'domain': shopify.domain,
+        'access_token': 'token',
+        'context': LambdaContext(900000),
+        'data_access': data_access,
+        'metrics': metrics
+    }).process() is True
+    metrics.flush()
+
+    line = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')][0]
+    for name in ('SendableFileTime', 'PageReadTime', 'PageTime', 'ShopifyLatency', 'ShopifyAdmissionWait',
+                 'ShopifyQueryCost', 'ShopifyCostAvailable', 'ResultWriteLatency', 'ResultCountLatency', 'ProductsPerSecond'):
+        assert name in line, name
+    assert line['Products'] == [30]
+    assert sum(line['ShopifyThrottled']) == 0
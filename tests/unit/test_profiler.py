@@ -0,0 +1,61 @@
+import asyncio
+import json
+import time
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def stall_loop():
+    await asyncio.sleep(0.05)
+    # blocks the event loop the way a slow synchronous call would
+    busy_wait(0.2)
+    await asyncio.sleep(0.05)
+
+
+def test_profiler_is_off_unless_enabled(monkeypatch):
+    from utility.profiler import start_profiler
+
+    monkeypatch.delenv('profile_enabled', raising=False)
+    assert start_profiler() is None
+
+
+def test_slow_invocation_writes_folded_stacks_and_loop_lag(monkeypatch, tmp_path):
+    from utility.metrics import Metrics
+    from utility.profiler import start_profiler
+    from utility.profiler import finish_profiler
+    from utility import shopify_connection
+
+    monkeypatch.setenv('profile_enabled', 'true')
+    monkeypatch.setenv('profile_interval', '5')
+    monkeypatch.setenv('profile_threshold', '0.1')
+    monkeypatch.setenv('profile_dir', str(tmp_path))
+
+    metrics = Metrics()
+    profiler = start_profiler()
+    shopify_connection.run(stall_loop())
+    finish_profiler(profiler, 'slow', None, metrics)
+
+    folded_stacks = (tmp_path / 'slow.folded').read_text().splitlines()
+    assert any(line.startswith('MainThread;') and 'busy_wait (test_profiler.py:' in line for line in folded_stacks)
+    assert all(int(line.rsplit(' ', 1)[1]) > 0 for line in folded_stacks)
+
+    summary = json.loads((tmp_path / 'slow.json').read_text())
+    assert summary['duration'] >= 0.3
+    assert summary['loop_lag']['max'] >= 100
+
+
+def test_fast_invocation_writes_nothing(monkeypatch, tmp_path):
+    from utility.metrics import Metrics
+    from utility.profiler import start_profiler
+    from utility.profiler import finish_profiler
+
+    monkeypatch.setenv('profile_enabled', 'true')
+    monkeypatch.setenv('profile_threshold', '60')
+    monkeypatch.setenv('profile_dir', str(tmp_path))
+
+    finish_profiler(start_profiler(), 'fast', None, Metrics())
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,75 @@
+import asyncio
+
+from tests.mocks.rate_budget_store import LocalRateBudgetStore
+
+
+DOMAIN = 'shop.myshopify.com'
+MAXIMUM_AVAILABLE = 1000
+RESTORE_RATE = 100
+REQUEST_COST = 50
+
+
+def spend_greedily(jobs, seconds, step=0.05):
+    """Every job asks for a request's cost at every step, returns what each got after the first 10 seconds."""
+    from utility.rate_budget import lease_rate_budget
+    state = None
+    spent = {job_id: 0 for job_id, _ in jobs}
+    settled = None
+    now = 0
+    while now < seconds:
+        for job_id, weight in jobs:
+            granted, _, leased = lease_rate_budget(state, job_id, weight, REQUEST_COST, REQUEST_COST, MAXIMUM_AVAILABLE, RESTORE_RATE, now)
+            if granted > 0:
+                state = leased
+                spent[job_id] += granted
+        now += step
+        if settled is None and now >= 10:
+            settled = dict(spent)
+    return {job_id: spent[job_id] - settled[job_id] for job_id in spent}
+
+
+def test_contended_budget_is_shared_by_weight():
+    from utility.rate_budget import get_job_weight
+    large_job = ('large-job', get_job_weight(50000))
+    small_job = ('small-job', get_job_weight(200))
+
+    spent = spend_greedily([large_job, small_job], 60)
+
+    # the shop's restore rate is used in full, a fifth of it by the large job
+    assert sum(spent.values()) >= 0.95 * RESTORE_RATE * 50
+    assert 0.15 <= spent['large-job'] / sum(spent.values()) <= 0.25
+    # the order in which the jobs ask does not matter
+    assert spend_greedily([small_job, large_job], 60) == spent
+
+
+def test_job_alone_gets_the_whole_budget():
+    spent = spend_greedily([('only-job', 1)], 60)
+    assert spent['only-job'] >= 0.95 * RESTORE_RATE * 50
+
+
+def test_released_lease_is_given_back_to_the_shop():
+    from utility.rate_budget import RateBudget
+    store = LocalRateBudgetStore()
+    now = [0]
+    large_job = RateBudget(DOMAIN, 'large-job', store, lease_size=MAXIMUM_AVAILABLE, clock=lambda: now[0])
+    small_job = RateBudget(DOMAIN, 'small-job', store, lease_size=REQUEST_COST, clock=lambda: now[0])
+
+    asyncio.run(large_job.take(REQUEST_COST, MAXIMUM_AVAILABLE, RESTORE_RATE))
+    assert store.get_rate_budget(DOMAIN)['tokens'] == 0
+    # a second later the shop has restored enough for the small job's request
+    now[0] = 1
+    asyncio.run(small_job.take(REQUEST_COST, MAXIMUM_AVAILABLE, RESTORE_RATE))
+    state = store.get_rate_budget(DOMAIN)
+    assert state['tokens'] == RESTORE_RATE - REQUEST_COST
+    assert set(state['jobs']) == {'large-job', 'small-job'}
+
+    large_job.release()
+    state = store.get_rate_budget(DOMAIN)
+    assert state['tokens'] == RESTORE_RATE - REQUEST_COST + MAXIMUM_AVAILABLE - REQUEST_COST
+    assert set(state['jobs']) == {'small-job'}
+
+
+def test_request_larger_than_the_bucket_is_capped():
+    from utility.rate_budget import RateBudget
+    budget = RateBudget(DOMAIN, 'only-job', LocalRateBudgetStore(), clock=lambda: 0)
+    asyncio.run(asyncio.wait_for(budget.take(2 * MAXIMUM_AVAILABLE, MAXIMUM_AVAILABLE, RESTORE_RATE), 1))
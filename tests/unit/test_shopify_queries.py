@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+
+def test_encoded_queries_are_compact_json():
+    from dataaccess.shopify_queries import QUERIES
+
+    body = json.loads(QUERIES['collections'].encode({'title': 'title:Summer "sale"'}))
+
+    assert body['query'] == 'query ($title: String) { collections(first: 1, query: $title) { edges { node { id } } } }'
+    assert body['variables'] == {'title': 'title:Summer "sale"'}
+
+
+def test_product_mutations_only_select_what_results_use():
+    from dataaccess.shopify_queries import get_product_create_prefix
+
+    body = json.loads(get_product_create_prefix(2) + b'"input0":{},"input1":{}}}')
+
+    assert body['query'] == ('mutation productCreate($input0: ProductInput!, $input1: ProductInput!) { '
+                             'p0: productCreate(input: $input0) { product { id } userErrors { field message } } '
+                             'p1: productCreate(input: $input1) { product { id } userErrors { field message } } }')
+
+
+def test_scheduler_budgets_with_requested_costs_until_shopify_reports_them():
+    from dataaccess.shopify_queries import get_requested_cost
+    from utility.cost_scheduler import CostScheduler
+
+    async def estimate():
+        scheduler = CostScheduler()
+        before = (scheduler.estimate_cost('productCreate', 5), scheduler.estimate_cost('collections'), scheduler.estimate_cost('products'))
+        ticket = await scheduler.acquire(before[0])
+        scheduler.release('productCreate', before[0], {'extensions': {'cost': {'requestedQueryCost': 60, 'actualQueryCost': 60}}}, 5, ticket)
+        return before, scheduler.estimate_cost('productCreate', 5)
+
+    before, after = asyncio.run(estimate())
+
+    assert before == (50, 3, 252)
+    assert get_requested_cost('unknownOperation', 2) == 30
+    assert after == 60